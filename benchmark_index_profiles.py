@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Compare the HNSW profiles of the Knowledge Base vector index (lib/lambda/index_profiles.py) with FAISS.
+
+Every profile is built locally on a sample of embeddings and measured against exact search:
+recall@k, p50/p95 single-query latency, build time and index size in memory.
+
+Embeddings are read from a .npy file (float32, one row per chunk), for example vectors exported from the
+OpenSearch Serverless index. Without --embeddings a clustered synthetic sample of unit vectors is used.
+
+Requires faiss-cpu and numpy:
+    pip install faiss-cpu numpy
+    python benchmark_index_profiles.py [--embeddings sample.npy] [--queries 500] [--k 5] [--profiles recall balanced]
+"""
+import argparse
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib", "lambda"))
+from index_profiles import INDEX_PROFILES, VECTOR_DIMENSION  # noqa: E402
+
+
+def synthetic_embeddings(count, dimension, clusters=200, seed=0):
+    # Chunks of the same document land close to each other: sample around random cluster centres
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dimension))
+    vectors = centres[rng.integers(0, clusters, count)] + 0.35 * rng.normal(size=(count, dimension))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype("float32")
+
+
+def build_index(profile, dimension):
+    """FAISS equivalent of the OpenSearch faiss engine index created for a profile."""
+    parameters = INDEX_PROFILES[profile]
+    if parameters.get("encoder") == "fp16":
+        index = faiss.IndexHNSWSQ(dimension, faiss.ScalarQuantizer.QT_fp16, parameters["m"])
+    else:
+        index = faiss.IndexHNSWFlat(dimension, parameters["m"])
+    index.hnsw.efConstruction = parameters["ef_construction"]
+    return index
+
+
+def measure(profile, base, queries, truth, k):
+    index = build_index(profile, base.shape[1])
+    started = time.perf_counter()
+    index.train(base)
+    index.add(base)
+    build_seconds = time.perf_counter() - started
+    index.hnsw.efSearch = max(INDEX_PROFILES[profile]["ef_search"], k)
+
+    latencies, found = [], []
+    for query in queries:
+        started = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - started)
+        found.append(ids[0])
+    recall = np.mean([len(set(ids) & set(expected)) / k for ids, expected in zip(found, truth)])
+    return {
+        "recall": recall,
+        "p50_ms": np.percentile(latencies, 50) * 1000,
+        "p95_ms": np.percentile(latencies, 95) * 1000,
+        "build_s": build_seconds,
+        "memory_mb": faiss.serialize_index(index).nbytes / 1024 / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings", help=".npy file with one embedding per row")
+    parser.add_argument("--sample", type=int, default=20000, help="synthetic vectors when --embeddings is not set")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5, help="numberOfResults of the Knowledge Base retrievals")
+    parser.add_argument("--profiles", nargs="*", default=list(INDEX_PROFILES))
+    args = parser.parse_args()
+
+    # Same conditions as a single OpenSearch query thread
+    faiss.omp_set_num_threads(1)
+    if args.embeddings:
+        vectors = np.load(args.embeddings).astype("float32")
+    else:
+        vectors = synthetic_embeddings(args.sample + args.queries, VECTOR_DIMENSION)
+    base, queries = vectors[:-args.queries], vectors[-args.queries:]
+
+    exact = faiss.IndexFlatL2(base.shape[1])
+    exact.add(base)
+    _, truth = exact.search(queries, args.k)
+
+    print(f"{len(base)} vectors of dimension {base.shape[1]}, {len(queries)} queries, k={args.k}")
+    print(f"{'profile':<15}{'recall@k':>10}{'p50 ms':>10}{'p95 ms':>10}{'build s':>10}{'memory MB':>12}")
+    for profile in args.profiles:
+        result = measure(profile, base, queries, truth, args.k)
+        print(f"{profile:<15}{result['recall']:>10.3f}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+              f"{result['build_s']:>10.1f}{result['memory_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
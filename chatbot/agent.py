@@ -1,14 +1,14 @@
 import streamlit as st
-import os
-import boto3
-from botocore.config import Config
-from PIL import Image
+from aws_clients import get_client
+from aws_clients import inference_profile_arn
+from app_config import get_config
 from utils import invoke_bedrock_agent
 from utils import read_agent_response
 from utils import enable_artifacts_download
-from utils import retrieve_environment_variables
 from utils import save_conversation
 from utils import invoke_bedrock_model_streaming
+from utils import cancel_generation_jobs
+from utils import authenticated_identity
 from layout import create_tabs, create_option_tabs, welcome_sidebar, login_page
 from styles import apply_styles
 from cost_estimate_widget import generate_cost_estimates
@@ -17,7 +17,19 @@ from generate_cdk_widget import generate_cdk
 from generate_cfn_widget import generate_cfn
 from generate_doc_widget import generate_doc
 from dsl_code_widget import generate_dsl
-import io
+from image_pipeline import normalize_image
+from insights_cache import ImageInsightsCache
+from insights_cache import cache_namespace
+from session_store import create_session_store
+from session_store import SnapshotConflict
+from session_store import SnapshotTooLarge
+from artifact_store import store_artifact
+from artifact_store import load_artifact
+from artifact_store import ARTIFACT_SPILL
+from preset_cache import PresetAnswerCache
+from preset_cache import preset_session_id
+from preset_cache import preset_history
+from upload import upload_file
 
 # Environment variables from .env file
 from dotenv import load_dotenv
@@ -27,23 +39,60 @@ load_dotenv()
 st.set_page_config(page_title="DevGenius", layout='wide')
 apply_styles()
 
-# Initialize AWS clients
-AWS_REGION = os.getenv("AWS_REGION")
-config = Config(read_timeout=1000, retries=dict(max_attempts=5))
-bedrock_client = boto3.client('bedrock-runtime', region_name=AWS_REGION, config=config)
-s3_client = boto3.client('s3', region_name=AWS_REGION)
-sts_client = boto3.client('sts', region_name=AWS_REGION)
-dynamodb_resource = boto3.resource('dynamodb', region_name=AWS_REGION)
-
-ACCOUNT_ID = sts_client.get_caller_identity()["Account"]
 # Constants 
-BEDROCK_MODEL_ID = f"arn:aws:bedrock:{AWS_REGION}:{ACCOUNT_ID}:inference-profile/us.anthropic.claude-3-5-sonnet-20241022-v2:0"  # noqa
-CONVERSATION_TABLE_NAME = retrieve_environment_variables("CONVERSATION_TABLE_NAME")
-FEEDBACK_TABLE_NAME = retrieve_environment_variables("FEEDBACK_TABLE_NAME")
-SESSION_TABLE_NAME = retrieve_environment_variables("SESSION_TABLE_NAME")
-S3_BUCKET_NAME = retrieve_environment_variables("S3_BUCKET_NAME")
-BEDROCK_AGENT_ID = retrieve_environment_variables("BEDROCK_AGENT_ID")
-BEDROCK_AGENT_ALIAS_ID = retrieve_environment_variables("BEDROCK_AGENT_ALIAS_ID")
+IMAGE_INFERENCE_PROFILE = "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
+PRESET_TOPICS = ["Data Lake", "Log Analytics", "Security", "Monitoring", "Debug"]
+# Language of the preset questions in get_initial_question
+PRESET_LANGUAGE = "es"
+# Streamlit re-runs this script on every interaction: the configuration is parsed once per process
+config = get_config()
+CONVERSATION_TABLE_NAME = config.conversation_table_name
+FEEDBACK_TABLE_NAME = config.feedback_table_name
+SESSION_TABLE_NAME = config.session_table_name
+S3_BUCKET_NAME = config.s3_bucket_name
+BEDROCK_AGENT_ID = config.bedrock_agent_id
+BEDROCK_AGENT_ALIAS_ID = config.bedrock_agent_alias_id
+
+
+@st.cache_resource
+def get_session_store():
+    # Long texts are kept out of the snapshot only when the artifacts are written through to S3, where any task
+    # can read them back
+    if ARTIFACT_SPILL == "s3":
+        return create_session_store(get_config(), store_artifact, load_artifact)
+    return create_session_store(get_config())
+
+
+def fetch_preset_answer(question):
+    response = invoke_bedrock_agent(preset_session_id(), question, end_session=False)
+    return read_agent_response(response['completion'])[1]
+
+
+@st.cache_resource
+def get_preset_cache():
+    # Warmed on a background thread from the first script run of the process, then refreshed on a schedule
+    questions = {(topic, PRESET_LANGUAGE): get_initial_question(topic) for topic in PRESET_TOPICS}
+    return PresetAnswerCache(fetch_preset_answer, questions).start()
+
+
+# Save the conversation so the session can continue on another task after a scale-in or a deployment
+def persist_session():
+    if not st.session_state.get('user_authenticated') or not st.session_state.get('resume_token'):
+        return
+    try:
+        get_session_store().save(st.session_state.resume_token, st.session_state)
+    except SnapshotConflict:
+        # The newer state saved from another tab has been loaded: show it instead of overwriting it
+        st.toast("Esta sesión se actualizó desde otra pestaña, se cargó la versión más reciente.")
+        st.rerun()
+    except SnapshotTooLarge as e:
+        print(f"Could not persist session state: {e}")
+        if not st.session_state.get('snapshot_too_large_notified'):
+            st.session_state.snapshot_too_large_notified = True
+            st.warning("La sesión es demasiado grande para guardarse: si el servidor cambia se perderá. "
+                       "Descarga los artefactos generados para conservarlos.")
+    except Exception as e:
+        print(f"Could not persist session state: {e}")
 
 
 def display_image(image, width=600, caption="Uploaded Image", use_center=True):
@@ -66,7 +115,7 @@ def display_image(image, width=600, caption="Uploaded Image", use_center=True):
 
 
 # Function to interact with the Bedrock model using an image and query
-def get_image_insights(image_data, query="Explain in detail the architecture flow"):
+def get_image_insights(image_data, image_format="png", query="Explain in detail the architecture flow", force_analysis=False):
     query = ('''Explica en detalle el flujo de la arquitectura.
                 Si la imagen proporcionada no está relacionada con la arquitectura técnica, solicita al usuario que suba un diagrama de arquitectura de **AWS** o un diagrama dibujado a mano.
                 Al generar la solución, resalta los nombres de los servicios de AWS en **negrita**.
@@ -74,40 +123,57 @@ def get_image_insights(image_data, query="Explain in detail the architecture flo
     messages = [{
         "role": "user",
         "content": [
-            {"image": {"format": "png", "source": {"bytes": image_data}}},
+            {"image": {"format": image_format, "source": {"bytes": image_data}}},
             {"text": query}
         ]}
     ]
-    try:
-        streaming_response = bedrock_client.converse_stream(
-            modelId=BEDROCK_MODEL_ID,
-            messages=messages,
-            inferenceConfig={"maxTokens": 2000, "temperature": 0.0, "topP": 0.9}
-        )
+    model_id = inference_profile_arn(IMAGE_INFERENCE_PROFILE)
+    # The same reference diagrams are uploaded over and over: reuse the stored analysis of identical or near-identical images
+    insights_cache = ImageInsightsCache(cache_namespace(model_id, query))
+    cached_insights = None
+    if not force_analysis:
+        try:
+            cached_insights = insights_cache.get(image_data)
+        except Exception as e:
+            print(f"Image insights cache lookup failed: {e}")
 
-        full_response = ""
-        output_placeholder = st.empty()
-        for chunk in streaming_response["stream"]:
-            if "contentBlockDelta" in chunk:
-                text = chunk["contentBlockDelta"]["delta"]["text"]
-                full_response += text
-                output_placeholder.markdown(f"<div class='wrapped-text'>{full_response}</div>", unsafe_allow_html=True)
-        output_placeholder.write("")
+    try:
+        if cached_insights is not None:
+            full_response = cached_insights["insights"]
+            st.caption(f"Análisis recuperado de una carga anterior de la misma imagen ({cached_insights['created_at'][:10]}).")
+        else:
+            streaming_response = get_client("bedrock-runtime").converse_stream(
+                modelId=model_id,
+                messages=messages,
+                inferenceConfig={"maxTokens": 2000, "temperature": 0.0, "topP": 0.9}
+            )
+
+            full_response = ""
+            output_placeholder = st.empty()
+            for chunk in streaming_response["stream"]:
+                if "contentBlockDelta" in chunk:
+                    text = chunk["contentBlockDelta"]["delta"]["text"]
+                    full_response += text
+                    output_placeholder.markdown(f"<div class='wrapped-text'>{full_response}</div>", unsafe_allow_html=True)
+            output_placeholder.write("")
+            insights_cache.put(image_data, full_response)
 
         if 'mod_messages' not in st.session_state:
             st.session_state.mod_messages = []
         st.session_state.mod_messages.append({"role": "assistant", "content": full_response})
-        st.session_state.interaction.append({"type": "Architecture details", "details": full_response})
+        st.session_state.interaction.append({"type": "Architecture details", "details": store_artifact(full_response)})
         save_conversation(st.session_state['conversation_id'], prompt, full_response)
+        return full_response
 
     except Exception as e:
-        st.error(f"ERROR: Can't invoke '{BEDROCK_MODEL_ID}'. Reason: {e}")
+        st.error(f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
 
 
 # Reset the chat history in session state
 def reset_chat():
     # Clear specific message-related session states
-    keys_to_keep = {'conversation_id', 'user_authenticated', 'user_name', 'user_email', 'cognito_authentication', 'token', 'midway_user'}  # noqa
+    keys_to_keep = {'conversation_id', 'resume_token', 'user_authenticated', 'user_name', 'user_email', 'cognito_authentication', 'token', 'midway_user',
+                    'session_restore_attempted', '_snapshot_version', '_snapshot_digest'}  # noqa
     keys_to_remove = set(st.session_state.keys()) - keys_to_keep
 
     for key in keys_to_remove:
@@ -116,18 +182,33 @@ def reset_chat():
     st.session_state.messages = []
 
 
+# Analyze the uploaded image again, bypassing the image insights cache
+def force_image_analysis():
+    reset_chat()
+    st.session_state.force_image_analysis = True
+
+
 # Reset the chat history in session state
 def reset_messages():
     # st.session_state['conversation_id'] = str(uuid.uuid4())
 
     initial_question = get_initial_question(st.session_state.topic_selector)
+    st.session_state.pop('pending_agent_history', None)
     st.session_state.messages = [{"role": "assistant", "content": "Bienvenido a DevGenius: convirtiendo ideas en realidad. Juntos diseñaremos tu arquitectura y solución, con cada conversación dando forma a tu visión. ¡Comencemos a construir!"}]
 
     if initial_question:
         st.session_state.messages.append({"role": "user", "content": initial_question})
-        response = invoke_bedrock_agent(st.session_state.conversation_id, initial_question)
-        event_stream = response['completion']
-        ask_user, agent_answer = read_agent_response(event_stream)
+        preset = get_preset_cache().get(st.session_state.topic_selector, PRESET_LANGUAGE)
+        if preset is not None:
+            agent_answer = preset["answer"]
+            # The agent session of this conversation has not seen the preset turn: it is sent as history with the
+            # first question the user asks, which is the first live agent call
+            st.session_state.pending_agent_history = preset_history(initial_question, agent_answer)
+        else:
+            response = invoke_bedrock_agent(st.session_state.conversation_id, initial_question)
+            event_stream = response['completion']
+            ask_user, agent_answer = read_agent_response(event_stream)
+            get_preset_cache().put(st.session_state.topic_selector, PRESET_LANGUAGE, agent_answer)
         st.session_state.messages.append({"role": "assistant", "content": agent_answer})
 
 
@@ -190,36 +271,28 @@ def get_initial_question(topic):
     }.get(topic, "")
 
 
-
-
-# Function to compress or resize image if it exceeds 5MB
-def resize_or_compress_image(uploaded_image):
-    # Open the image using PIL
-    image = Image.open(uploaded_image)
-
-    # Check the size of the uploaded image
-    image_bytes = uploaded_image.getvalue()
-    if len(image_bytes) > 5 * 1024 * 1024:  # 5MB in bytes
-        st.write("Image size exceeds 5MB. Resizing...")
-
-        # Resize the image (you can adjust the dimensions as needed)
-        image = image.resize((800, 600))  # Example resize, you can adjust this
-
-        # Compress the image by saving it to a BytesIO object with reduced quality
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format="JPEG", quality=85)  # Adjust quality if needed
-        img_byte_arr.seek(0)
-
-        # Return the compressed image
-        return img_byte_arr
-    else:
-        # If the image is under 5MB, no resizing is needed, just return the original
-        return uploaded_image
-
-
 #########################################
 # Streamlit Main Execution Starts Here
 #########################################
+# Start warming the preset answers before anyone logs in, so the first topic picked is already cached
+get_preset_cache()
+
+# The browser reconnects to any task behind the load balancer: resume the session from its stored snapshot,
+# only for the user who started it
+resume_token = st.query_params.get("session")
+if resume_token and not st.session_state.get('session_restore_attempted'):
+    st.session_state.session_restore_attempted = True
+    identity = authenticated_identity()
+    try:
+        if get_session_store().restore(resume_token, st.session_state,
+                                       {"user_name": identity["name"], "user_email": identity["email"]}):
+            print(f"Resumed session {st.session_state.conversation_id}")
+            st.session_state.user_authenticated = True
+        else:
+            st.query_params.pop("session", None)
+    except Exception as e:
+        print(f"Could not resume session: {e}")
+
 if 'user_authenticated' not in st.session_state:
     st.session_state.user_authenticated = False
 if 'interaction' not in st.session_state:
@@ -234,6 +307,8 @@ else:
     with st.sidebar:
         # st.title("DevGenius")
         welcome_sidebar()
+    # Documents uploaded from the sidebar are indexed in the Knowledge Base by the ingestion coordinator
+    upload_file()
 
     # Tab for "Generate Architecture Diagram and Solution"
     with tabs[0]:
@@ -249,7 +324,7 @@ else:
 
         col1, col2, _, _, right = st.columns(5)
         with col1:
-            topic = st.selectbox("Selecciona un ejemplo", ["","Data Lake", "Log Analytics", "Security", "Monitoring", "Debug"], key="topic_selector", on_change=reset_messages)  # noqa
+            topic = st.selectbox("Selecciona un ejemplo", [""] + PRESET_TOPICS, key="topic_selector", on_change=reset_messages)  # noqa
         with right:
             st.button('Clear Chat History', on_click=reset_messages)
 
@@ -272,23 +347,28 @@ else:
             st.session_state.cdk = False
             st.session_state.cfn = False
             st.session_state.doc = False
+            # The artifacts being generated for the previous version of the solution are no longer needed
+            cancel_generation_jobs()
 
             st.chat_message("user").markdown(prompt)
             st.session_state.messages.append({"role": "user", "content": prompt})
 
             with st.chat_message("assistant"):
+                answer_placeholder = st.empty()
                 with st.spinner("Pensando..."):
-                    response = invoke_bedrock_agent(st.session_state.conversation_id, prompt)
+                    response = invoke_bedrock_agent(st.session_state.conversation_id, prompt,
+                                                    conversation_history=st.session_state.pop('pending_agent_history', None))
                     event_stream = response['completion']
-                    ask_user, agent_answer = read_agent_response(event_stream)
-                    st.markdown(agent_answer)
+                    # The answer is shown as it streams in instead of after the whole agent run
+                    ask_user, agent_answer = read_agent_response(event_stream, on_chunk=answer_placeholder.markdown)
+                answer_placeholder.markdown(agent_answer)
 
             st.session_state.messages.append({"role": "assistant", "content": agent_answer})
 
             # Check if we have reached the number of questions
             if not ask_user:
                 st.session_state.interaction.append(
-                    {"type": "Details", "details": st.session_state.messages[-1]['content']})
+                    {"type": "Details", "details": store_artifact(st.session_state.messages[-1]['content'])})
                 devgenius_option_tabs = create_option_tabs()
                 with devgenius_option_tabs[0]:
                     generate_cost_estimates(st.session_state.messages)
@@ -339,21 +419,25 @@ else:
             st.session_state.active_tab = "Modify your existing architecture"
 
         if uploaded_file:
-            # write the upload file to S3 bucket
-            s3_key = f"{st.session_state.conversation_id}/uploaded_file/{uploaded_file.name}"  # noqa
-            # response = s3_client.put_object(Body=uploaded_file.getvalue(), Bucket=S3_BUCKET_NAME, Key=s3_key)
-            # print(response)
-            # st.session_state.uploaded_image = uploaded_file
-            resized_image = resize_or_compress_image(uploaded_file)
-            response = s3_client.put_object(Body=resized_image, Bucket=S3_BUCKET_NAME, Key=s3_key)
-            st.session_state.uploaded_image = resized_image
-            image = Image.open(st.session_state.uploaded_image)
-            display_image(image)
-            image_bytes = st.session_state.uploaded_image.getvalue()
+            # Normalize and write the upload file to S3 bucket once per uploaded file, not on every rerun
+            if st.session_state.get('uploaded_image_id') != uploaded_file.file_id:
+                image = normalize_image(uploaded_file.getvalue())
+                st.session_state.uploaded_image_id = uploaded_file.file_id
+                s3_key = f"{st.session_state.conversation_id}/uploaded_file/{uploaded_file.name}"  # noqa
+                get_client("s3").put_object(Body=image["bytes"], Bucket=S3_BUCKET_NAME, Key=s3_key,
+                                     ContentType=f"image/{image['format']}")
+                # Keep a single copy of the image, in the session artifact store
+                st.session_state.uploaded_image = {**image, "bytes": store_artifact(image["bytes"])}
+            image_bytes = load_artifact(st.session_state.uploaded_image["bytes"])
+            display_image(image_bytes)
+            st.button("⟳ Volver a analizar la imagen", key="reanalyze-image", type="secondary",
+                      on_click=force_image_analysis)
 
             if 'image_insights' not in st.session_state:
                 st.session_state.image_insights = get_image_insights(
-                    image_data=image_bytes)
+                    image_data=image_bytes,
+                    image_format=st.session_state.uploaded_image["format"],
+                    force_analysis=st.session_state.pop('force_image_analysis', False))
 
         if 'mod_messages' not in st.session_state:
             st.session_state.mod_messages = []
@@ -438,16 +522,21 @@ else:
             st.session_state.cfn = False
             st.session_state.doc = False
             st.session_state.dsl = False
+            # The artifacts being generated for the previous version of the solution are no longer needed
+            cancel_generation_jobs()
 
             st.session_state.mod_messages.append({"role": "user", "content": prompt})
             st.chat_message("user").markdown(prompt)
 
             with st.chat_message("assistant"):
                 with st.spinner("Thinking..."):
-                    response = invoke_bedrock_model_streaming(st.session_state.mod_messages)
-                    st.session_state.interaction.append({"type": "Architecture details", "details": response})
+                    response = invoke_bedrock_model_streaming(st.session_state.mod_messages, owner="chat")
+                    st.session_state.interaction.append({"type": "Architecture details", "details": store_artifact(response[0])})
                     st.markdown(f"<div class='wrapped-text'>{response}</div>", unsafe_allow_html=True)
 
             st.session_state.mod_messages.append({"role": "assistant", "content": response[0]})
             save_conversation(st.session_state['conversation_id'], prompt, response[0])
+            persist_session()
             st.rerun()
+
+persist_session()
@@ -0,0 +1,198 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+# Share of agent turns whose trace is recorded; ASK_USER detection does not depend on it
+AGENT_TRACE_SAMPLE_RATE = float(os.getenv("AGENT_TRACE_SAMPLE_RATE", "0.1"))
+# "ring" keeps the latest records in memory, "jsonl" also appends them to AGENT_TRACE_LOG
+AGENT_TRACE_SINK = os.getenv("AGENT_TRACE_SINK", "ring")
+AGENT_TRACE_LOG = os.getenv("AGENT_TRACE_LOG", "agent-trace.jsonl")
+RING_BUFFER_SIZE = 2000
+
+# Step kinds opened by an input event and closed by the matching output event with the same traceId
+MODEL_STEP = "model"
+KNOWLEDGE_BASE_STEP = "knowledge_base"
+ACTION_GROUP_STEP = "action_group"
+
+
+class RingBufferSink:
+    """Keeps the latest records in memory."""
+
+    def __init__(self, capacity=RING_BUFFER_SIZE):
+        self._lock = threading.Lock()
+        self.records = deque(maxlen=capacity)
+
+    def write(self, records):
+        with self._lock:
+            self.records.extend(records)
+
+    def latest(self, count=None):
+        with self._lock:
+            records = list(self.records)
+        return records if count is None else records[-count:]
+
+
+class JsonLogSink(RingBufferSink):
+    """Appends every batch to a JSON lines file and keeps the latest records in memory."""
+
+    def __init__(self, path=AGENT_TRACE_LOG, capacity=RING_BUFFER_SIZE):
+        super().__init__(capacity)
+        self.path = path
+
+    def write(self, records):
+        super().write(records)
+        lines = "".join(json.dumps(record, default=str) + "\n" for record in records)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as log_file:
+                log_file.write(lines)
+
+
+def _step_type(trace):
+    # (trace type, trace part) of a trace event, e.g. ("orchestration", {...})
+    for key, value in trace.items():
+        if key.endswith("Trace"):
+            return key[:-len("Trace")], value
+    return None, None
+
+
+def _usage(model_output):
+    usage = (model_output.get("metadata") or {}).get("usage") or {}
+    return usage.get("inputTokens", 0), usage.get("outputTokens", 0)
+
+
+class AgentTurnTrace:
+    """
+    Compact records of the steps of one agent turn.
+
+    Bedrock agent traces carry no timestamps, so durations are measured between the arrival of the event that
+    opens a step (model or knowledge base invocation input) and the one that closes it (model output or
+    observation), which the agent streams as the steps complete.
+    """
+
+    def __init__(self, sink, sampled, clock=time.monotonic):
+        self.sink = sink
+        self.sampled = sampled
+        self.clock = clock
+        self.turn_id = uuid.uuid4().hex[:12]
+        self.session_id = None
+        self.started = clock()
+        self.first_chunk_ms = None
+        self.records = []
+        self._open_steps = {}  # (trace id, step kind) -> (start, record)
+
+    def _elapsed_ms(self, since):
+        return round((self.clock() - since) * 1000, 1)
+
+    def _open(self, trace_id, kind, trace_type, **fields):
+        record = {"turn_id": self.turn_id, "session_id": self.session_id, "trace": trace_type, "step": kind,
+                  "trace_id": trace_id, "offset_ms": self._elapsed_ms(self.started), **fields}
+        self._open_steps[(trace_id, kind)] = (self.clock(), record)
+
+    def _close(self, trace_id, kind, **fields):
+        start, record = self._open_steps.pop((trace_id, kind), (None, None))
+        if record is None:
+            return
+        record["duration_ms"] = self._elapsed_ms(start)
+        record.update(fields)
+        self.records.append(record)
+
+    def observe(self, trace_part):
+        """Record one 'trace' event of the invoke_agent stream."""
+        if not self.sampled:
+            return
+        self.session_id = self.session_id or trace_part.get("sessionId")
+        trace_type, trace = _step_type(trace_part.get("trace", {}))
+        if trace is None:
+            return
+        if trace_type == "failure":
+            self.records.append({"turn_id": self.turn_id, "session_id": self.session_id, "trace": trace_type,
+                                 "step": "failure", "reason": trace.get("failureReason"),
+                                 "offset_ms": self._elapsed_ms(self.started)})
+            return
+
+        if "modelInvocationInput" in trace:
+            model_input = trace["modelInvocationInput"]
+            self._open(model_input.get("traceId"), MODEL_STEP, trace_type, prompt_type=model_input.get("type"))
+        if "modelInvocationOutput" in trace:
+            model_output = trace["modelInvocationOutput"]
+            input_tokens, output_tokens = _usage(model_output)
+            self._close(model_output.get("traceId"), MODEL_STEP, input_tokens=input_tokens,
+                        output_tokens=output_tokens)
+        if "invocationInput" in trace:
+            invocation = trace["invocationInput"]
+            kind = KNOWLEDGE_BASE_STEP if "knowledgeBaseLookupInput" in invocation else ACTION_GROUP_STEP
+            self._open(invocation.get("traceId"), kind, trace_type,
+                       knowledge_base_id=invocation.get("knowledgeBaseLookupInput", {}).get("knowledgeBaseId"))
+        if "observation" in trace:
+            observation = trace["observation"]
+            trace_id = observation.get("traceId")
+            if "knowledgeBaseLookupOutput" in observation:
+                references = observation["knowledgeBaseLookupOutput"].get("retrievedReferences", [])
+                self._close(trace_id, KNOWLEDGE_BASE_STEP, retrieved_references=len(references))
+            else:
+                self._close(trace_id, ACTION_GROUP_STEP, observation_type=observation.get("type"))
+
+    def chunk(self):
+        """Mark the arrival of an answer chunk; the first one gives the time to first chunk."""
+        if self.sampled and self.first_chunk_ms is None:
+            self.first_chunk_ms = self._elapsed_ms(self.started)
+
+    def summary(self):
+        totals = {MODEL_STEP: 0, KNOWLEDGE_BASE_STEP: 0, ACTION_GROUP_STEP: 0}
+        input_tokens = output_tokens = 0
+        for record in self.records:
+            totals[record["step"]] = totals.get(record["step"], 0) + record.get("duration_ms", 0)
+            input_tokens += record.get("input_tokens", 0)
+            output_tokens += record.get("output_tokens", 0)
+        return {"turn_id": self.turn_id, "session_id": self.session_id, "step": "turn",
+                "total_ms": self._elapsed_ms(self.started), "first_chunk_ms": self.first_chunk_ms,
+                "model_ms": totals[MODEL_STEP], "knowledge_base_ms": totals[KNOWLEDGE_BASE_STEP],
+                "action_group_ms": totals[ACTION_GROUP_STEP], "model_calls": sum(
+                    1 for record in self.records if record["step"] == MODEL_STEP),
+                "input_tokens": input_tokens, "output_tokens": output_tokens}
+
+    def finish(self):
+        """Write the records of the turn and its summary to the sink as one batch."""
+        if not self.sampled:
+            return
+        summary = self.summary()
+        self.sink.write(self.records + [summary])
+        print(f"Agent turn {self.turn_id}: {summary['total_ms']} ms, model {summary['model_ms']} ms, "
+              f"knowledge base {summary['knowledge_base_ms']} ms, first chunk {summary['first_chunk_ms']} ms")
+
+
+def _create_sink():
+    if AGENT_TRACE_SINK == "jsonl":
+        return JsonLogSink()
+    return RingBufferSink()
+
+
+trace_sink = _create_sink()
+
+
+def start_turn_trace(sample_rate=AGENT_TRACE_SAMPLE_RATE):
+    """Trace of a new agent turn, recorded with probability sample_rate."""
+    return AgentTurnTrace(trace_sink, random.random() < sample_rate)
+
+
+def latency_breakdown(records=None):
+    """
+    Average time per turn spent in model reasoning, knowledge base retrieval and action groups.
+
+    Args:
+        records: Trace records, by default the ones in the in-memory sink
+    """
+    turns = [record for record in (records if records is not None else trace_sink.latest())
+             if record["step"] == "turn"]
+    if not turns:
+        return {}
+    keys = ["total_ms", "model_ms", "knowledge_base_ms", "action_group_ms", "input_tokens", "output_tokens"]
+    breakdown = {key: round(sum(turn[key] for turn in turns) / len(turns), 1) for key in keys}
+    first_chunks = [turn["first_chunk_ms"] for turn in turns if turn["first_chunk_ms"] is not None]
+    breakdown["first_chunk_ms"] = round(sum(first_chunks) / len(first_chunks), 1) if first_chunks else None
+    breakdown["turns"] = len(turns)
+    return breakdown
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping
+from typing import Optional
+from aws_clients import get_client
+
+# Name of the environment variable holding the JSON document of the SSM parameter created in lib/index.ts
+RESOURCE_NAMES_VARIABLE = "AWS_RESOURCE_NAMES_PARAMETER"
+REQUIRED_KEYS = ["SESSION_TABLE_NAME", "FEEDBACK_TABLE_NAME", "CONVERSATION_TABLE_NAME", "BEDROCK_AGENT_ID",
+                 "BEDROCK_AGENT_ALIAS_ID", "S3_BUCKET_NAME"]
+SECRET_TTL = 15 * 60
+# Entries younger than SECRET_TTL but older than SECRET_TTL - SECRET_REFRESH_AHEAD are served as they are and
+# refreshed in the background, so rotations are picked up without a request ever waiting on Secrets Manager
+SECRET_REFRESH_AHEAD = 3 * 60
+
+
+@dataclass(frozen=True)
+class AppConfig:
+    aws_region: Optional[str]
+    session_table_name: str
+    feedback_table_name: str
+    conversation_table_name: str
+    bedrock_agent_id: str
+    bedrock_agent_alias_id: str
+    s3_bucket_name: str
+    knowledge_base_id: Optional[str]
+    knowledge_base_data_source_id: Optional[str]
+    frontend_url: Optional[str]
+    cognito_secret_id: Optional[str]
+    session_state_table_name: Optional[str]
+    # Every key of the parameter, including the ones without a typed field, read-only
+    parameters: Mapping[str, str]
+
+
+def parse_config(environ):
+    """
+    Parse and validate the application configuration.
+
+    Args:
+        environ: Mapping with the process environment
+
+    Returns:
+        AppConfig
+
+    Raises:
+        ValueError: if the resource names parameter is missing, is not a JSON object or lacks a required key
+    """
+    raw = environ.get(RESOURCE_NAMES_VARIABLE)
+    if not raw:
+        raise ValueError(f"{RESOURCE_NAMES_VARIABLE} is not set")
+    try:
+        parameters = json.loads(raw)
+    except ValueError as e:
+        raise ValueError(f"{RESOURCE_NAMES_VARIABLE} is not valid JSON: {e}") from None
+    if not isinstance(parameters, dict):
+        raise ValueError(f"{RESOURCE_NAMES_VARIABLE} must be a JSON object")
+    missing = [key for key in REQUIRED_KEYS if not parameters.get(key)]
+    if missing:
+        raise ValueError(f"{RESOURCE_NAMES_VARIABLE} is missing {', '.join(missing)}")
+
+    return AppConfig(
+        aws_region=environ.get("AWS_REGION"),
+        session_table_name=parameters["SESSION_TABLE_NAME"],
+        feedback_table_name=parameters["FEEDBACK_TABLE_NAME"],
+        conversation_table_name=parameters["CONVERSATION_TABLE_NAME"],
+        bedrock_agent_id=parameters["BEDROCK_AGENT_ID"],
+        bedrock_agent_alias_id=parameters["BEDROCK_AGENT_ALIAS_ID"],
+        s3_bucket_name=parameters["S3_BUCKET_NAME"],
+        knowledge_base_id=parameters.get("KNOWLEDGE_BASE_ID"),
+        knowledge_base_data_source_id=parameters.get("KNOWLEDGE_BASE_DATA_SOURCE_ID"),
+        frontend_url=parameters.get("FRONTEND_URL"),
+        cognito_secret_id=parameters.get("COGNITO_SECRET_ID"),
+        session_state_table_name=parameters.get("SESSION_STATE_TABLE_NAME"),
+        parameters=MappingProxyType(dict(parameters)),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_config():
+    """Configuration of the process, parsed from the environment on first use."""
+    return parse_config(os.environ)
+
+
+class SecretCache:
+    """
+    TTL cache of Secrets Manager secrets with background refresh and stampede protection.
+
+    A missing or expired entry is loaded by a single thread while concurrent readers of the same secret wait for
+    it instead of issuing their own calls. Entries close to expiry are returned immediately and refreshed on a
+    background thread; if that refresh fails the current value is kept until it expires.
+    """
+
+    def __init__(self, fetch, ttl=SECRET_TTL, refresh_ahead=SECRET_REFRESH_AHEAD, clock=time.monotonic):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = {}  # secret id -> (value, loaded_at)
+        self._refreshing = set()
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _load(self, key):
+        value = self.fetch(key)
+        self._entries[key] = (value, self.clock())
+        return value
+
+    def _refresh_in_background(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                with self._key_lock(key):
+                    self._load(key)
+            except Exception as e:
+                print(f"Background refresh of secret {key} failed, keeping the cached value: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name="secret-refresh", daemon=True).start()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, loaded_at = entry
+            age = self.clock() - loaded_at
+            if age < self.ttl - self.refresh_ahead:
+                return value
+            if age < self.ttl:
+                self._refresh_in_background(key)
+                return value
+
+        with self._key_lock(key):
+            # Another thread may have loaded it while this one was waiting for the lock
+            entry = self._entries.get(key)
+            if entry is not None and self.clock() - entry[1] < self.ttl:
+                return entry[0]
+            return self._load(key)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+def _fetch_secret(secret_id):
+    response = get_client("secretsmanager").get_secret_value(SecretId=secret_id)
+    return json.loads(response["SecretString"])
+
+
+secret_cache = SecretCache(_fetch_secret)
+
+
+def get_secret(secret_id):
+    """JSON secret from Secrets Manager, served from the process-wide cache."""
+    return secret_cache.get(secret_id)
@@ -0,0 +1,202 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+import streamlit as st
+from botocore.exceptions import ClientError
+from aws_clients import get_client
+from app_config import get_config
+
+# Responses below this size stay inline in the session state; a reference would not save anything
+INLINE_MAX_BYTES = 2048
+# Bytes of artifacts kept in memory per session before the least recently used ones are spilled
+SESSION_MEMORY_BUDGET = 4 * 1024 * 1024
+# "disk" spills to the task's local storage; "s3" writes every artifact through to the bucket when it is
+# stored, so a session resumed on another task (see session_store) can still read it
+ARTIFACT_SPILL = os.getenv("ARTIFACT_SPILL", "disk")
+ARTIFACT_SPILL_DIR = Path(os.getenv("ARTIFACT_SPILL_DIR", Path(tempfile.gettempdir()) / "devgenius-artifacts"))
+ARTIFACT_S3_PREFIX = "artifact-store"
+# Spill directories of sessions idle for longer than this are removed when a new session starts
+SPILL_RETENTION = 24 * 3600
+
+_registry = weakref.WeakValueDictionary()
+
+
+def is_artifact_ref(value):
+    return isinstance(value, dict) and "artifact" in value and "kind" in value
+
+
+class ArtifactStore:
+    """
+    Content-addressed store of the large responses of one session.
+
+    Every blob is kept once, keyed by its SHA-256, no matter how many messages refer to it. Blobs are held in
+    memory up to budget_bytes; past that the least recently used ones are moved to the spill tier (a per-session
+    directory or S3) and read back on demand.
+    """
+
+    def __init__(self, session_id, budget_bytes=SESSION_MEMORY_BUDGET, spill=ARTIFACT_SPILL,
+                 spill_dir=ARTIFACT_SPILL_DIR, bucket=None):
+        self.session_id = session_id
+        self.budget_bytes = budget_bytes
+        self.spill = spill
+        self.spill_dir = Path(spill_dir) / session_id
+        self.bucket = bucket
+        self._lock = threading.Lock()
+        self._hot = OrderedDict()  # digest -> bytes, least recently used first
+        self._hot_bytes = 0
+        self._spilled = {}  # digest -> size, blobs moved out of memory at least once
+        self._written = set()  # digests already written through to S3 by put
+        self.stats = {"puts": 0, "deduplicated": 0, "spilled": 0, "loads": 0}
+
+    def _spill_path(self, digest):
+        return self.spill_dir / digest
+
+    def _s3_key(self, digest):
+        return f"{ARTIFACT_S3_PREFIX}/{self.session_id}/{digest}"
+
+    def _write_spill(self, digest, data):
+        if self.spill == "s3":
+            get_client("s3").put_object(Bucket=self.bucket, Key=self._s3_key(digest), Body=data)
+        else:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            temp_path = self._spill_path(digest).with_suffix(".tmp")
+            temp_path.write_bytes(data)
+            os.replace(temp_path, self._spill_path(digest))
+
+    def _read_spill(self, digest):
+        if self.spill == "s3":
+            return get_client("s3").get_object(Bucket=self.bucket, Key=self._s3_key(digest))["Body"].read()
+        return self._spill_path(digest).read_bytes()
+
+    def _evict(self):
+        # Called with the lock held
+        while self._hot_bytes > self.budget_bytes and len(self._hot) > 1:
+            digest, data = self._hot.popitem(last=False)
+            self._hot_bytes -= len(data)
+            if digest not in self._spilled:
+                # With S3 the blob was already written through by put
+                if digest not in self._written:
+                    self._write_spill(digest, data)
+                self._spilled[digest] = len(data)
+            self.stats["spilled"] += 1
+
+    def put(self, content):
+        """
+        Store a text or binary artifact.
+
+        Returns:
+            The content itself when it is small, otherwise a reference dict to pass to get
+        """
+        kind = "text" if isinstance(content, str) else "bytes"
+        data = content.encode("utf-8") if kind == "text" else bytes(content)
+        if len(data) <= INLINE_MAX_BYTES:
+            return content
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self.stats["puts"] += 1
+            if digest in self._hot:
+                self._hot.move_to_end(digest)
+                self.stats["deduplicated"] += 1
+            elif digest in self._spilled or digest in self._written:
+                self.stats["deduplicated"] += 1
+            else:
+                if self.spill == "s3":
+                    self._write_spill(digest, data)
+                    self._written.add(digest)
+                self._hot[digest] = data
+                self._hot_bytes += len(data)
+                self._evict()
+        return {"artifact": digest, "kind": kind, "size": len(data)}
+
+    def get(self, value):
+        """Content of a reference returned by put; any other value is returned unchanged."""
+        if not is_artifact_ref(value):
+            return value
+        digest = value["artifact"]
+        with self._lock:
+            data = self._hot.get(digest)
+            if data is not None:
+                self._hot.move_to_end(digest)
+            else:
+                data = self._read_spill(digest)
+                self.stats["loads"] += 1
+                self._hot[digest] = data
+                self._hot_bytes += len(data)
+                self._spilled.setdefault(digest, len(data))
+                self._evict()
+        return data.decode("utf-8") if value["kind"] == "text" else data
+
+    def usage(self):
+        # Spilled blobs read back into memory are counted in memory only
+        with self._lock:
+            spilled = {digest: size for digest, size in self._spilled.items() if digest not in self._hot}
+            return {
+                "session_id": self.session_id,
+                "memory_bytes": self._hot_bytes,
+                "memory_blobs": len(self._hot),
+                "spilled_bytes": sum(spilled.values()),
+                "spilled_blobs": len(spilled),
+                "written_through_blobs": len(self._written),
+                **self.stats,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._hot.clear()
+            self._hot_bytes = 0
+            self._spilled.clear()
+            self._written.clear()
+        if self.spill != "s3":
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+
+def prune_spill_dir(spill_dir=ARTIFACT_SPILL_DIR, retention=SPILL_RETENTION):
+    """Remove the spill directories of sessions that have not been used for retention seconds."""
+    if not Path(spill_dir).is_dir():
+        return
+    cutoff = time.time() - retention
+    for session_dir in Path(spill_dir).iterdir():
+        try:
+            if session_dir.stat().st_mtime < cutoff:
+                shutil.rmtree(session_dir, ignore_errors=True)
+        except OSError:
+            continue
+
+
+def session_artifacts():
+    """Artifact store of the current Streamlit session, created on first use."""
+    store = st.session_state.get('artifact_store')
+    if store is None or store.session_id != st.session_state.conversation_id:
+        bucket = get_config().s3_bucket_name if ARTIFACT_SPILL == "s3" else None
+        store = ArtifactStore(st.session_state.conversation_id, bucket=bucket)
+        st.session_state.artifact_store = store
+        _registry[store.session_id] = store
+        prune_spill_dir()
+    return store
+
+
+def store_artifact(content):
+    return session_artifacts().put(content)
+
+
+def load_artifact(value):
+    """Resolve a value that may be an artifact reference; unavailable artifacts become a short notice."""
+    if not is_artifact_ref(value):
+        return value
+    try:
+        return session_artifacts().get(value)
+    except (OSError, ClientError) as e:
+        print(f"Artifact {value['artifact']} is not available: {e}")
+        return "(artefacto no disponible)" if value["kind"] == "text" else b""
+
+
+def memory_report():
+    """Memory used by the artifact stores of every live session in this process, largest first."""
+    return sorted((store.usage() for store in list(_registry.values())),
+                  key=lambda usage: usage["memory_bytes"], reverse=True)
@@ -0,0 +1,107 @@
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+AWS_REGION = os.getenv("AWS_REGION")
+# Every Streamlit session runs on its own thread and shares these clients, so allow more pooled connections
+# than botocore's default of 10
+MAX_POOL_CONNECTIONS = 50
+READ_TIMEOUT = 1000
+MAX_ATTEMPTS = 5
+# "record" saves the Bedrock responses to cassettes, "replay" runs offline from them (see aws_standin)
+AWS_STANDIN = os.getenv("AWS_STANDIN")
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+_account_id = None
+_resource_pools = {}
+
+
+def _get_session():
+    # boto3 is imported on first use: loading it and the service models is a large share of the start-up time
+    global _session
+    if _session is None:
+        import boto3
+        _session = boto3.session.Session(region_name=AWS_REGION)
+    return _session
+
+
+def _client_config():
+    from botocore.config import Config
+    return Config(read_timeout=READ_TIMEOUT, retries=dict(max_attempts=MAX_ATTEMPTS),
+                  max_pool_connections=MAX_POOL_CONNECTIONS)
+
+
+def get_client(service_name):
+    """
+    Return the shared boto3 client for a service, creating it on first use.
+
+    Clients are thread-safe and created once per process under a lock.
+    """
+    client = _clients.get(service_name)
+    if client is None:
+        with _lock:
+            client = _clients.get(service_name)
+            if client is None:
+                if AWS_STANDIN:
+                    from aws_standin import standin_client
+                    client = standin_client(service_name, AWS_STANDIN,
+                                            lambda: _get_session().client(service_name, config=_client_config()))
+                else:
+                    client = _get_session().client(service_name, config=_client_config())
+                _clients[service_name] = client
+    return client
+
+
+def create_resource(service_name):
+    """
+    Create a boto3 resource for a service from the shared session.
+
+    Resources are not thread-safe: the caller owns the instance. Short-lived uses should borrow one with
+    borrow_resource instead.
+    """
+    with _lock:
+        if AWS_STANDIN:
+            from aws_standin import standin_resource
+            return standin_resource(service_name, AWS_STANDIN,
+                                    lambda: _get_session().resource(service_name, config=_client_config()))
+        return _get_session().resource(service_name, config=_client_config())
+
+
+@contextmanager
+def borrow_resource(service_name):
+    """
+    Lend a boto3 resource for a service from a process-wide pool, creating one when all of them are in use.
+
+    Each resource is used by one thread at a time and goes back to the pool afterwards. Streamlit runs every
+    rerun on a new thread, so the pool only grows to the number of concurrent uses, not one per rerun.
+    """
+    with _lock:
+        pool = _resource_pools.setdefault(service_name, queue.SimpleQueue())
+    try:
+        resource = pool.get_nowait()
+    except queue.Empty:
+        resource = create_resource(service_name)
+    try:
+        yield resource
+    finally:
+        pool.put(resource)
+
+
+def account_id():
+    """AWS account id of the current credentials, resolved with STS once per process."""
+    global _account_id
+    if _account_id is None:
+        with _lock:
+            if _account_id is None and AWS_STANDIN == "replay":
+                from aws_standin import STANDIN_ACCOUNT_ID
+                _account_id = STANDIN_ACCOUNT_ID
+            elif _account_id is None:
+                _account_id = _get_session().client("sts").get_caller_identity()["Account"]
+    return _account_id
+
+
+def inference_profile_arn(inference_profile_id):
+    return f"arn:aws:bedrock:{AWS_REGION}:{account_id()}:inference-profile/{inference_profile_id}"
@@ -0,0 +1,501 @@
+import base64
+import copy
+import datetime
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from botocore.exceptions import ClientError
+
+# Selected in aws_clients with AWS_STANDIN: "record" calls AWS and saves every Bedrock response to a cassette,
+# "replay" serves the cassettes back with their original timing and keeps S3 and DynamoDB in memory
+STANDIN_CASSETTE_DIR = Path(os.getenv("AWS_STANDIN_CASSETTES", Path(__file__).parent / "cassettes"))
+# Multiplies the recorded delays on replay: 1 reproduces the original timing, 0.1 runs ten times faster and
+# 0 returns every event at once
+STANDIN_TIME_SCALE = float(os.getenv("AWS_STANDIN_TIME_SCALE", "1"))
+STANDIN_ACCOUNT_ID = "000000000000"
+
+# Operations recorded and replayed, and the field of their response holding an event stream
+RECORDED_OPERATIONS = {
+    "bedrock-runtime": {"invoke_model", "invoke_model_with_response_stream", "converse", "converse_stream"},
+    "bedrock-agent-runtime": {"invoke_agent", "retrieve"},
+}
+STREAM_FIELDS = {"invoke_model_with_response_stream": "body", "converse_stream": "stream", "invoke_agent": "completion"}
+# Request fields that differ on every run and must not change which cassette is played
+VOLATILE_REQUEST_FIELDS = {"sessionId"}
+# Key attributes of the DynamoDB tables in lib/index.ts, used by the in-memory tables to identify put items
+DYNAMODB_KEY_ATTRIBUTES = ["session_id", "conversation_id", "uuid"]
+
+
+class CassetteNotFound(LookupError):
+    """A replayed request was never recorded."""
+
+
+def _encode(value):
+    # JSON form of a request or response: bytes as base64, datetimes as ISO strings
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(bytes(value)).decode("ascii")}
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if set(value) == {"__bytes__"}:
+            return base64.b64decode(value["__bytes__"])
+        return {key: _decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+def _canonical_request(params):
+    # Images are identified by their digest and JSON bodies by their content, not their key order
+    def canonical(value):
+        if isinstance(value, (bytes, bytearray)):
+            return {"sha256": hashlib.sha256(value).hexdigest()}
+        if isinstance(value, dict):
+            return {key: canonical(item) for key, item in value.items() if key not in VOLATILE_REQUEST_FIELDS}
+        if isinstance(value, (list, tuple)):
+            return [canonical(item) for item in value]
+        return value
+
+    request = canonical(params)
+    if isinstance(request.get("body"), str):
+        try:
+            request["body"] = json.loads(request["body"])
+        except ValueError:
+            pass
+    return request
+
+
+def cassette_path(service_name, operation, params, cassette_dir=STANDIN_CASSETTE_DIR):
+    request = json.dumps(_canonical_request(params), sort_keys=True, default=str)
+    digest = hashlib.sha256(f"{operation}\n{request}".encode("utf-8")).hexdigest()[:16]
+    return Path(cassette_dir) / service_name / f"{operation}-{digest}.json"
+
+
+def _write_cassette(path, cassette):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(".tmp")
+    temp_path.write_text(json.dumps(cassette, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(temp_path, path)
+
+
+class _RecordingStream:
+    """Passes the events of a live event stream through and saves them with their offsets once it is exhausted."""
+
+    def __init__(self, stream, started, on_complete):
+        self._stream = stream
+        self._started = started
+        self._on_complete = on_complete
+        self._events = []
+
+    def __iter__(self):
+        for event in self._stream:
+            self._events.append({"offset": time.monotonic() - self._started, "event": _encode(event)})
+            yield event
+        self._on_complete(self._events)
+
+    def close(self):
+        # Cancelled streams are incomplete and are not saved
+        self._stream.close()
+
+
+class _ReplayStream:
+    """Yields recorded events at their recorded offsets times the time scale."""
+
+    def __init__(self, events, started, time_scale):
+        self._events = events
+        self._started = started
+        self._time_scale = time_scale
+        self._closed = threading.Event()
+
+    def __iter__(self):
+        for recorded in self._events:
+            delay = self._started + recorded["offset"] * self._time_scale - time.monotonic()
+            if delay > 0 and self._closed.wait(delay):
+                return
+            if self._closed.is_set():
+                return
+            yield _decode(recorded["event"])
+
+    def close(self):
+        self._closed.set()
+
+
+class _Body(io.BytesIO):
+    """Stand-in for botocore's StreamingBody."""
+
+    def close(self):
+        pass
+
+
+class RecordingClient:
+    """Live boto3 client that saves the responses of RECORDED_OPERATIONS to cassettes."""
+
+    def __init__(self, service_name, client, cassette_dir=STANDIN_CASSETTE_DIR):
+        self._service_name = service_name
+        self._client = client
+        self._cassette_dir = cassette_dir
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+        if name not in RECORDED_OPERATIONS.get(self._service_name, ()):
+            return method
+
+        def record(**params):
+            path = cassette_path(self._service_name, name, params, self._cassette_dir)
+            request = _encode(_canonical_request(params))
+            started = time.monotonic()
+            response = method(**params)
+            stream_field = STREAM_FIELDS.get(name)
+            metadata = {key: value for key, value in response.items() if key != stream_field}
+            if hasattr(metadata.get("body"), "read"):
+                # Non-streaming invoke_model: the body can only be read once, hand a copy back to the caller
+                body = metadata["body"].read()
+                response["body"] = _Body(body)
+                metadata["body"] = body
+            cassette = {"service": self._service_name, "operation": name, "request": request,
+                        "response": _encode(metadata), "duration": time.monotonic() - started}
+            if stream_field is None:
+                _write_cassette(path, cassette)
+                return response
+
+            def save(events):
+                _write_cassette(path, {**cassette, "events": events})
+                print(f"Recorded {len(events)} events of {self._service_name}.{name} to {path}")
+
+            response[stream_field] = _RecordingStream(response[stream_field], started, save)
+            return response
+
+        return record
+
+
+class ReplayClient:
+    """Serves the recorded responses of RECORDED_OPERATIONS through the same methods as the boto3 client."""
+
+    def __init__(self, service_name, cassette_dir=STANDIN_CASSETTE_DIR, time_scale=STANDIN_TIME_SCALE):
+        self._service_name = service_name
+        self._cassette_dir = cassette_dir
+        self._time_scale = time_scale
+
+    def __getattr__(self, name):
+        if name not in RECORDED_OPERATIONS.get(self._service_name, ()):
+            raise AttributeError(f"{self._service_name}.{name} is not available in replay mode")
+
+        def replay(**params):
+            path = cassette_path(self._service_name, name, params, self._cassette_dir)
+            if not path.exists():
+                raise CassetteNotFound(f"No recording of {self._service_name}.{name} for this request ({path.name}); "
+                                       f"record it with AWS_STANDIN=record")
+            cassette = json.loads(path.read_text(encoding="utf-8"))
+            started = time.monotonic()
+            response = _decode(cassette["response"])
+            stream_field = STREAM_FIELDS.get(name)
+            if stream_field is not None:
+                response[stream_field] = _ReplayStream(cassette.get("events", []), started, self._time_scale)
+                return response
+            time.sleep(cassette["duration"] * self._time_scale)
+            if isinstance(response.get("body"), bytes):
+                response["body"] = _Body(response["body"])
+            return response
+
+        return replay
+
+
+class UnavailableClient:
+    """Client of a service that has no stand-in: every call fails with a clear message."""
+
+    def __init__(self, service_name):
+        self._service_name = service_name
+
+    def __getattr__(self, name):
+        raise AttributeError(f"{self._service_name} has no stand-in in replay mode ({name} was called)")
+
+
+def _client_error(code, message, operation):
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+class FakeS3Client:
+    """In-memory S3 with the operations the application uses. Objects are shared by every client and resource."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objects = {}  # (bucket, key) -> {"body", "metadata", "content_type", "last_modified"}
+        self._uploads = {}  # upload id -> {part number: bytes}
+
+    def _put(self, bucket, key, data, metadata=None, content_type=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        elif hasattr(data, "read"):
+            data = data.read()
+        with self._lock:
+            self._objects[(bucket, key)] = {"body": bytes(data), "metadata": dict(metadata or {}),
+                                            "content_type": content_type,
+                                            "last_modified": datetime.datetime.now(datetime.timezone.utc)}
+        return {"ETag": f'"{hashlib.md5(bytes(data)).hexdigest()}"'}
+
+    def _get(self, bucket, key, operation):
+        with self._lock:
+            item = self._objects.get((bucket, key))
+        if item is None:
+            raise _client_error("NoSuchKey" if operation == "GetObject" else "404", "Not Found", operation)
+        return item
+
+    def put_object(self, Bucket, Key, Body=b"", Metadata=None, ContentType=None, **kwargs):
+        return self._put(Bucket, Key, Body, Metadata, ContentType)
+
+    def get_object(self, Bucket, Key, **kwargs):
+        item = self._get(Bucket, Key, "GetObject")
+        return {"Body": _Body(item["body"]), "ContentLength": len(item["body"]), "Metadata": item["metadata"],
+                "ContentType": item["content_type"], "LastModified": item["last_modified"]}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        item = self._get(Bucket, Key, "HeadObject")
+        return {"ContentLength": len(item["body"]), "Metadata": item["metadata"],
+                "ContentType": item["content_type"], "LastModified": item["last_modified"]}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        with self._lock:
+            self._objects.pop((Bucket, Key), None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        with self._lock:
+            keys = sorted(key for bucket, key in self._objects if bucket == Bucket and key.startswith(Prefix))
+            contents = [{"Key": key, "Size": len(self._objects[(Bucket, key)]["body"]),
+                         "LastModified": self._objects[(Bucket, key)]["last_modified"]} for key in keys]
+        return {"Contents": contents, "KeyCount": len(contents), "IsTruncated": False}
+
+    def get_paginator(self, operation):
+        if operation != "list_objects_v2":
+            raise AttributeError(f"s3 paginator {operation} is not available in replay mode")
+        client = self
+
+        class Paginator:
+            def paginate(self, **params):
+                return [client.list_objects_v2(**params)]
+
+        return Paginator()
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, **kwargs):
+        extra = ExtraArgs or {}
+        self._put(Bucket, Key, Path(Filename).read_bytes(), extra.get("Metadata"), extra.get("ContentType"))
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, **kwargs):
+        extra = ExtraArgs or {}
+        self._put(Bucket, Key, Fileobj.read(), extra.get("Metadata"), extra.get("ContentType"))
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        Path(Filename).write_bytes(self._get(Bucket, Key, "HeadObject")["body"])
+
+    def create_multipart_upload(self, Bucket, Key, Metadata=None, ContentType=None, **kwargs):
+        upload_id = hashlib.sha256(f"{Bucket}/{Key}/{time.time_ns()}".encode("utf-8")).hexdigest()
+        with self._lock:
+            self._uploads[upload_id] = {"parts": {}, "metadata": Metadata, "content_type": ContentType}
+        return {"Bucket": Bucket, "Key": Key, "UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        data = Body.read() if hasattr(Body, "read") else bytes(Body)
+        with self._lock:
+            if UploadId not in self._uploads:
+                raise _client_error("NoSuchUpload", "The specified upload does not exist", "UploadPart")
+            self._uploads[UploadId]["parts"][PartNumber] = data
+        return {"ETag": f'"{hashlib.md5(data).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        with self._lock:
+            upload = self._uploads.pop(UploadId, None)
+        if upload is None:
+            raise _client_error("NoSuchUpload", "The specified upload does not exist", "CompleteMultipartUpload")
+        data = b"".join(upload["parts"][part["PartNumber"]] for part in MultipartUpload["Parts"])
+        return {"Bucket": Bucket, "Key": Key, **self._put(Bucket, Key, data, upload["metadata"],
+                                                           upload["content_type"])}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        params = Params or {}
+        return f"http://s3.standin.local/{params.get('Bucket')}/{params.get('Key')}?expires={ExpiresIn}"
+
+
+class FakeS3Resource:
+    """The Bucket(name).objects.filter(Prefix=...) and download_file parts of the S3 resource."""
+
+    def __init__(self, client):
+        self.meta = type("Meta", (), {"client": client})()
+
+    def Bucket(self, name):
+        client = self.meta.client
+
+        class ObjectSummary:
+            def __init__(self, key):
+                self.bucket_name = name
+                self.key = key
+
+        class Objects:
+            def filter(self, Prefix=""):
+                return [ObjectSummary(item["Key"]) for item in client.list_objects_v2(Bucket=name, Prefix=Prefix)["Contents"]]
+
+            def all(self):
+                return self.filter()
+
+        class Bucket:
+            objects = Objects()
+
+            def download_file(self, Key, Filename, **kwargs):
+                client.download_file(name, Key, Filename)
+
+            def put_object(self, Key, Body=b"", **kwargs):
+                return client.put_object(Bucket=name, Key=Key, Body=Body, **kwargs)
+
+        bucket = Bucket()
+        bucket.name = name
+        return bucket
+
+
+_CONDITION = re.compile(r"^\s*(?:attribute_(not_)?exists\((\w+)\)|(\w+)\s*=\s*(:\w+))\s*$")
+_ASSIGNMENT = re.compile(r"^\s*(\w+)\s*=\s*(:\w+)\s*$")
+
+
+class FakeDynamoDBTable:
+    """
+    In-memory table with the item operations the application uses.
+
+    Condition expressions support attribute_exists(a), attribute_not_exists(a) and a = :value joined with AND;
+    update expressions support SET a = :value, ...
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._items = {}
+        self._key_names = None
+
+    def _key(self, attributes):
+        if self._key_names is None:
+            return tuple((name, attributes[name]) for name in DYNAMODB_KEY_ATTRIBUTES if name in attributes)
+        return tuple((name, attributes[name]) for name in self._key_names)
+
+    def _learn_key(self, key):
+        if self._key_names is None:
+            self._key_names = [name for name in DYNAMODB_KEY_ATTRIBUTES if name in key] or sorted(key)
+
+    def _check(self, item, expression, values, operation):
+        if not expression:
+            return
+        for clause in re.split(r"\s+AND\s+", expression, flags=re.IGNORECASE):
+            match = _CONDITION.match(clause)
+            if match is None:
+                raise NotImplementedError(f"Condition '{clause}' is not supported by the in-memory table")
+            negated, exists_name, name, placeholder = match.groups()
+            if exists_name:
+                passed = (item is not None and exists_name in item) != bool(negated)
+            else:
+                passed = item is not None and item.get(name) == values[placeholder]
+            if not passed:
+                raise _client_error("ConditionalCheckFailedException", "The conditional request failed", operation)
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        with self._lock:
+            key = self._key(Item)
+            self._check(self._items.get(key), ConditionExpression, ExpressionAttributeValues or {}, "PutItem")
+            self._items[key] = copy.deepcopy(Item)
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        with self._lock:
+            self._learn_key(Key)
+            item = self._items.get(self._key(Key))
+        return {"Item": copy.deepcopy(item)} if item is not None else {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None, ConditionExpression=None,
+                    ReturnValues="NONE", **kwargs):
+        values = ExpressionAttributeValues or {}
+        match = re.match(r"^\s*SET\s+(.*)$", UpdateExpression, flags=re.IGNORECASE)
+        if match is None:
+            raise NotImplementedError(f"Update '{UpdateExpression}' is not supported by the in-memory table")
+        with self._lock:
+            self._learn_key(Key)
+            key = self._key(Key)
+            self._check(self._items.get(key), ConditionExpression, values, "UpdateItem")
+            item = self._items.setdefault(key, copy.deepcopy(Key))
+            updated = {}
+            for assignment in match.group(1).split(","):
+                name, placeholder = _ASSIGNMENT.match(assignment).groups()
+                item[name] = updated[name] = copy.deepcopy(values[placeholder])
+        if ReturnValues == "UPDATED_NEW":
+            return {"Attributes": updated}
+        if ReturnValues == "ALL_NEW":
+            return {"Attributes": copy.deepcopy(item)}
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        with self._lock:
+            self._learn_key(Key)
+            self._items.pop(self._key(Key), None)
+        return {}
+
+    def scan(self, **kwargs):
+        with self._lock:
+            items = copy.deepcopy(list(self._items.values()))
+        return {"Items": items, "Count": len(items)}
+
+
+class FakeDynamoDBResource:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables = {}
+
+    def Table(self, name):
+        with self._lock:
+            return self._tables.setdefault(name, FakeDynamoDBTable(name))
+
+
+_fake_s3 = FakeS3Client()
+_fake_dynamodb = FakeDynamoDBResource()
+
+
+def standin_client(service_name, mode, create_client):
+    """
+    Client used by aws_clients.get_client when AWS_STANDIN is set.
+
+    Args:
+        mode: "record" or "replay"
+        create_client: callable() creating the real boto3 client
+    """
+    if mode == "record":
+        return RecordingClient(service_name, create_client()) if service_name in RECORDED_OPERATIONS \
+            else create_client()
+    if mode != "replay":
+        raise ValueError(f"AWS_STANDIN must be 'record' or 'replay', not '{mode}'")
+    if service_name in RECORDED_OPERATIONS:
+        return ReplayClient(service_name)
+    if service_name == "s3":
+        return _fake_s3
+    return UnavailableClient(service_name)
+
+
+def standin_resource(service_name, mode, create_resource):
+    """Resource used by aws_clients.create_resource when AWS_STANDIN is set; only replay mode replaces it."""
+    if mode != "replay":
+        return create_resource()
+    if service_name == "dynamodb":
+        return _fake_dynamodb
+    if service_name == "s3":
+        return FakeS3Resource(_fake_s3)
+    raise ValueError(f"{service_name} has no stand-in resource in replay mode")
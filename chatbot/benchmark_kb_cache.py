@@ -0,0 +1,148 @@
+"""
+Measure the hit rate and latency of the Knowledge Base retrieval cache on a synthetic query mix.
+
+The mix draws AWS documentation questions with a Zipf-like popularity and rewrites each one the way users
+do (case, accents, punctuation, filler words, word order). Offline, the embedding model and the Knowledge
+Base are simulated with fixed latencies and a character trigram embedding; with --live the Titan embedding
+model and the Retrieve API of the Knowledge Base in KNOWLEDGE_BASE_ID are called instead.
+
+Usage:
+    python benchmark_kb_cache.py [--queries N] [--kb-latency-ms MS] [--embed-latency-ms MS] [--live]
+"""
+import argparse
+import hashlib
+import os
+import random
+import statistics
+import time
+from kb_cache import QUERY_EMBEDDING_DIMENSIONS
+from kb_cache import SIMILARITY_THRESHOLD
+from kb_cache import RetrievalCache
+
+QUESTIONS = [
+    "¿Cómo configuro el ciclo de vida de un bucket de Amazon S3?",
+    "¿Qué diferencia hay entre Amazon Kinesis Data Streams y Amazon Data Firehose?",
+    "¿Cómo particiono tablas en AWS Glue para consultas con Amazon Athena?",
+    "¿Cuáles son los límites de concurrencia de AWS Lambda?",
+    "¿Cómo cifro una tabla de Amazon DynamoDB con una clave de AWS KMS?",
+    "¿Qué tipo de instancia de Amazon OpenSearch Service conviene para analítica de logs?",
+    "¿Cómo se configura AWS Lake Formation para permisos a nivel de columna?",
+    "¿Cómo envío logs de Amazon CloudWatch a Amazon S3?",
+    "¿Qué es Amazon GuardDuty y qué fuentes de datos analiza?",
+    "¿Cómo conecto Amazon Redshift Spectrum con el catálogo de AWS Glue?",
+    "¿Cómo habilito AWS CloudTrail en todas las cuentas de una organización?",
+    "¿Qué métricas de Amazon ECS debo monitorear con Container Insights?",
+    "¿Cómo replico un bucket de Amazon S3 en otra región?",
+    "¿Cuándo usar Amazon EMR Serverless en lugar de AWS Glue?",
+    "¿Cómo depuro un timeout de una función AWS Lambda en una VPC?",
+    "¿Qué es Amazon Bedrock Knowledge Bases y cómo se sincroniza una fuente de datos?",
+]
+FILLERS = ["por favor", "oye", "una pregunta", "necesito saber", "rápido"]
+TRIGRAM_DIMENSIONS = QUERY_EMBEDDING_DIMENSIONS
+
+
+def paraphrase(question, rng):
+    """One of the ways users retype the same question."""
+    variant = rng.randrange(6)
+    if variant == 0:
+        return question
+    if variant == 1:
+        return question.lower()
+    if variant == 2:
+        return question.replace("¿", "").replace("?", "").replace("ó", "o").replace("é", "e").replace("á", "a")
+    if variant == 3:
+        return f"{rng.choice(FILLERS)}, {question}"
+    if variant == 4:
+        return f"{question} {rng.choice(FILLERS)}"
+    words = question.strip("¿?").split()
+    split = rng.randrange(1, len(words))
+    return " ".join(words[split:] + words[:split])
+
+
+def query_mix(count, seed=0):
+    """(question index, query text) pairs; question i is drawn with weight 1 / (i + 1)."""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(QUESTIONS))]
+    for _ in range(count):
+        index = rng.choices(range(len(QUESTIONS)), weights)[0]
+        yield index, paraphrase(QUESTIONS[index], rng)
+
+
+def trigram_embedding(text, dimensions=TRIGRAM_DIMENSIONS):
+    # Stand-in for the embedding model: hashed character trigrams, close for texts that share most words
+    vector = [0.0] * dimensions
+    for word in text.split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            digest = hashlib.md5(padded[i:i + 3].encode("utf-8")).digest()
+            vector[digest[0] % dimensions] += 1.0 if digest[1] & 1 else -1.0
+    return vector
+
+
+def simulated(function, latency):
+    def call(*args):
+        time.sleep(latency)
+        return function(*args)
+    return call
+
+
+def _percentile(samples, percent):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def _report(name, latencies):
+    print(f"  {name:<22} mean {statistics.mean(latencies) * 1000:7.1f} ms   p50 "
+          f"{_percentile(latencies, 50) * 1000:7.1f} ms   p95 {_percentile(latencies, 95) * 1000:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--kb-latency-ms", type=float, default=150)
+    parser.add_argument("--embed-latency-ms", type=float, default=20)
+    parser.add_argument("--threshold", type=float, default=None)
+    parser.add_argument("--live", action="store_true")
+    args = parser.parse_args()
+
+    mix = list(query_mix(args.queries))
+    if args.live:
+        from kb_cache import knowledge_base_retriever
+        from kb_cache import titan_query_embedding
+        retrieve = knowledge_base_retriever(os.environ["KNOWLEDGE_BASE_ID"])
+        embed = titan_query_embedding
+        threshold = args.threshold or SIMILARITY_THRESHOLD
+    else:
+        # The retrieved "chunks" name the question they answer, to detect hits that served another question
+        retrieve = simulated(lambda query, count: [{"question": next(
+            index for index, text in mix if text == query)}], args.kb_latency_ms / 1000)
+        embed = simulated(trigram_embedding, args.embed_latency_ms / 1000)
+        threshold = args.threshold or 0.8
+
+    print(f"{len(mix)} queries over {len(QUESTIONS)} questions, threshold {threshold}")
+    baseline = []
+    for _, query in mix:
+        started = time.perf_counter()
+        retrieve(query, 5)
+        baseline.append(time.perf_counter() - started)
+
+    cache = RetrievalCache(retrieve, embed, threshold=threshold)
+    cached, wrong = [], 0
+    for index, query in mix:
+        started = time.perf_counter()
+        results, source = cache.retrieve(query, 5)
+        cached.append(time.perf_counter() - started)
+        if not args.live and source != "knowledge_base" and results[0]["question"] != index:
+            wrong += 1
+
+    status = cache.status()
+    print(f"Hit rate {status['hit_rate']:.1%}: {status['exact_hits']} exact, {status['semantic_hits']} semantic, "
+          f"{status['misses']} misses, {status['entries']} entries")
+    if not args.live:
+        print(f"Hits that served another question: {wrong}")
+    _report("Knowledge Base only", baseline)
+    _report("with retrieval cache", cached)
+
+
+if __name__ == "__main__":
+    main()
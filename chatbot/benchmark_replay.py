@@ -0,0 +1,55 @@
+"""
+Replay the recorded Bedrock responses and report their timing, without calling AWS.
+
+Cassettes are recorded by running the application with AWS_STANDIN=record (see aws_standin). Every streaming
+cassette is replayed through ReplayClient at the given time scale; the recorded and replayed time to first
+event and total time are printed side by side.
+
+Usage:
+    python benchmark_replay.py [--cassettes DIR] [--time-scale 0.1]
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from aws_standin import STANDIN_CASSETTE_DIR
+from aws_standin import STREAM_FIELDS
+from aws_standin import ReplayClient
+
+
+def _replay(cassette, cassette_dir, time_scale):
+    client = ReplayClient(cassette["service"], cassette_dir, time_scale)
+    # The request saved in the cassette is the canonical one it was keyed by, which maps to the same cassette
+    started = time.monotonic()
+    response = getattr(client, cassette["operation"])(**cassette["request"])
+    first_event = None
+    events = 0
+    for _ in response[STREAM_FIELDS[cassette["operation"]]]:
+        events += 1
+        if first_event is None:
+            first_event = time.monotonic() - started
+    return first_event, time.monotonic() - started, events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cassettes", type=Path, default=STANDIN_CASSETTE_DIR)
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    args = parser.parse_args()
+
+    paths = sorted(args.cassettes.glob("*/*.json"))
+    print(f"{len(paths)} cassette(s) in {args.cassettes}, time scale {args.time_scale}")
+    print(f"{'cassette':<58}{'events':>7}{'first (rec/replay) s':>24}{'total (rec/replay) s':>24}")
+    for path in paths:
+        cassette = json.loads(path.read_text(encoding="utf-8"))
+        if cassette["operation"] not in STREAM_FIELDS or not cassette.get("events"):
+            continue
+        recorded_first = cassette["events"][0]["offset"]
+        recorded_total = cassette["events"][-1]["offset"]
+        first, total, events = _replay(cassette, args.cassettes, args.time_scale)
+        print(f"{path.parent.name + '/' + path.stem:<58}{events:>7}"
+              f"{recorded_first:>12.2f}{first:>12.2f}{recorded_total:>12.2f}{total:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Measure the cold-start cost of the chatbot modules and of the first AWS client creation.
+
+Every measurement runs in a fresh interpreter so nothing is served from a previous import.
+
+Usage:
+    python benchmark_startup.py [module ...] [--runs N]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = ["aws_clients", "boto3", "pypdf", "pptx", "PIL.Image", "yaml", "utils", "upload", "agent"]
+DEFAULT_RUNS = 5
+DEFAULT_CLIENTS = ["s3", "bedrock-runtime", "dynamodb"]
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+CLIENT_SNIPPET = """
+import time
+import aws_clients
+start = time.perf_counter()
+aws_clients.get_client({service!r})
+first = time.perf_counter() - start
+start = time.perf_counter()
+aws_clients.get_client({service!r})
+print(first, time.perf_counter() - start)
+"""
+
+
+def _run(snippet):
+    result = subprocess.run([sys.executable, "-c", snippet], capture_output=True, text=True)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()
+        raise RuntimeError(error[-1] if error else f"exit code {result.returncode}")
+    return [float(value) for value in result.stdout.split()]
+
+
+def _summary(samples):
+    return f"median {statistics.median(samples) * 1000:8.1f} ms   min {min(samples) * 1000:8.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    args = parser.parse_args()
+
+    print("Module import time (fresh interpreter)")
+    for module in args.modules:
+        try:
+            samples = [_run(IMPORT_SNIPPET.format(module=module))[0] for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"  {module:<20} skipped: {e}")
+            continue
+        print(f"  {module:<20} {_summary(samples)}")
+
+    print("AWS client creation (first call / cached call)")
+    for service in DEFAULT_CLIENTS:
+        try:
+            samples = [_run(CLIENT_SNIPPET.format(service=service)) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"  {service:<20} skipped: {e}")
+            continue
+        print(f"  {service:<20} {_summary([first for first, _ in samples])}   "
+              f"cached {statistics.median(cached for _, cached in samples) * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import json
+import posixpath
+import re
+import zipfile
+
+PROJECT_NAME = "cdk-app"
+STACK_CLASS = re.compile(r"export\s+class\s+(\w+)\s+extends\s+(?:cdk\.)?Stack\b")
+
+DEFAULT_PACKAGE_JSON = {
+    "name": PROJECT_NAME,
+    "version": "0.1.0",
+    "bin": {PROJECT_NAME: f"bin/{PROJECT_NAME}.js"},
+    "scripts": {"build": "tsc", "watch": "tsc -w", "cdk": "cdk"},
+    "devDependencies": {
+        "@types/node": "^22.0.0",
+        "aws-cdk": "^2.1007.0",
+        "ts-node": "^10.9.2",
+        "typescript": "~5.8.2",
+    },
+    "dependencies": {
+        "aws-cdk-lib": "^2.191.0",
+        "constructs": "^10.4.2",
+        "source-map-support": "^0.5.21",
+    },
+}
+
+DEFAULT_TSCONFIG = {
+    "compilerOptions": {
+        "target": "ES2020",
+        "module": "commonjs",
+        "lib": ["es2020"],
+        "declaration": True,
+        "strict": True,
+        "noImplicitAny": True,
+        "strictNullChecks": True,
+        "esModuleInterop": True,
+        "inlineSourceMap": True,
+        "inlineSources": True,
+        "experimentalDecorators": True,
+        "typeRoots": ["./node_modules/@types"],
+    },
+    "exclude": ["node_modules", "cdk.out"],
+}
+
+
+def normalize_path(path):
+    """Return a safe project-relative POSIX path, or None for paths that escape the project root."""
+    path = posixpath.normpath(path.replace("\\", "/").strip().lstrip("/"))
+    if path in ("", ".") or path.startswith("../") or path == "..":
+        return None
+    return path
+
+
+def _default_bin(lib_files):
+    imports = []
+    stacks = []
+    for path, content in sorted(lib_files.items()):
+        for stack_class in STACK_CLASS.findall(content):
+            module = posixpath.splitext(posixpath.relpath(path, "bin"))[0]
+            imports.append(f"import {{ {stack_class} }} from '{module}';")
+            stacks.append(f"new {stack_class}(app, '{stack_class}');")
+    return "\n".join([
+        "#!/usr/bin/env node",
+        "import 'source-map-support/register';",
+        "import * as cdk from 'aws-cdk-lib';",
+        *imports,
+        "",
+        "const app = new cdk.App();",
+        *stacks,
+        "",
+    ])
+
+
+def build_project_tree(files):
+    """
+    Assemble a deployable CDK TypeScript project from the generated file map.
+
+    Generated files take precedence and later entries for the same path (continuations) replace earlier ones.
+    Missing scaffolding (bin entry point, package.json, cdk.json and tsconfig.json) is filled in so the
+    project can be installed and synthesized as is.
+
+    Args:
+        files: List of {"path": str, "content": str} as returned by the cdk_project tool
+
+    Returns:
+        dict mapping project-relative paths to file contents
+    """
+    tree = {}
+    for file in files:
+        path = normalize_path(file["path"])
+        if path:
+            tree[path] = file["content"]
+
+    bin_files = [path for path in tree if path.startswith("bin/") and path.endswith(".ts")]
+    if not bin_files:
+        lib_files = {path: content for path, content in tree.items() if path.startswith("lib/") and path.endswith(".ts")}
+        bin_files = [f"bin/{PROJECT_NAME}.ts"]
+        tree[bin_files[0]] = _default_bin(lib_files)
+
+    tree.setdefault("cdk.json", json.dumps(
+        {"app": f"npx ts-node --prefer-ts-exts {sorted(bin_files)[0]}"}, indent=2) + "\n")
+    tree.setdefault("package.json", json.dumps(DEFAULT_PACKAGE_JSON, indent=2) + "\n")
+    tree.setdefault("tsconfig.json", json.dumps(DEFAULT_TSCONFIG, indent=2) + "\n")
+    tree.setdefault(".gitignore", "*.js\n!jest.config.js\n*.d.ts\nnode_modules\ncdk.out\n")
+    return tree
+
+
+def write_project_zip(tree, fileobj):
+    """Stream the project tree as a zip archive into a (possibly non-seekable) file object."""
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for path in sorted(tree):
+            zip_file.writestr(f"{PROJECT_NAME}/{path}", tree[path])
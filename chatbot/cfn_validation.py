@@ -0,0 +1,282 @@
+import argparse
+import difflib
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+import yaml
+
+SPEC_INDEX_PATH = Path(__file__).parent / "data" / "cfn_resource_spec.json"
+VALIDATION_CACHE_SIZE = 256
+PSEUDO_PARAMETERS = {
+    "AWS::AccountId", "AWS::NotificationARNs", "AWS::NoValue", "AWS::Partition", "AWS::Region",
+    "AWS::StackId", "AWS::StackName", "AWS::URLSuffix",
+}
+TEMPLATE_SECTIONS = ["Parameters", "Mappings", "Conditions", "Resources", "Outputs"]
+SUB_VARIABLE = re.compile(r"\$\{([^!}][^}]*)\}")
+FN_TAGS = [
+    "And", "Base64", "Cidr", "Equals", "FindInMap", "GetAZs", "If", "ImportValue", "Join", "Length",
+    "Not", "Or", "Select", "Split", "Sub", "ToJsonString", "Transform",
+]
+
+_validation_cache = OrderedDict()
+_validation_cache_lock = threading.Lock()
+
+
+class CfnYamlLoader(yaml.SafeLoader):
+    """SafeLoader that understands the CloudFormation short-form intrinsic function tags."""
+
+
+def _construct_node(loader, node):
+    if isinstance(node, yaml.ScalarNode):
+        return loader.construct_scalar(node)
+    if isinstance(node, yaml.SequenceNode):
+        return loader.construct_sequence(node, deep=True)
+    return loader.construct_mapping(node, deep=True)
+
+
+def _intrinsic_constructor(function_name):
+    def constructor(loader, node):
+        return {function_name: _construct_node(loader, node)}
+    return constructor
+
+
+def _get_att_constructor(loader, node):
+    value = _construct_node(loader, node)
+    if isinstance(value, str):
+        value = value.split(".", 1)
+    return {"Fn::GetAtt": value}
+
+
+CfnYamlLoader.add_constructor("!Ref", _intrinsic_constructor("Ref"))
+CfnYamlLoader.add_constructor("!Condition", _intrinsic_constructor("Condition"))
+CfnYamlLoader.add_constructor("!GetAtt", _get_att_constructor)
+for _tag in FN_TAGS:
+    CfnYamlLoader.add_constructor(f"!{_tag}", _intrinsic_constructor(f"Fn::{_tag}"))
+
+
+@lru_cache(maxsize=1)
+def load_spec_index(path=SPEC_INDEX_PATH):
+    with open(path, encoding="utf-8") as f:
+        spec = json.load(f)
+    resource_types = {resource_type: set(attributes) for resource_type, attributes in spec["resource_types"].items()}
+    return resource_types, spec.get("complete", False)
+
+
+def parse_template(template_text):
+    """Parse a YAML or JSON CloudFormation template, including short-form intrinsic tags."""
+    return yaml.load(template_text, Loader=CfnYamlLoader)  # nosec B506 - CfnYamlLoader extends SafeLoader
+
+
+class CfnYamlDumper(yaml.SafeDumper):
+    """SafeDumper that keeps multi-line strings (inline code, policies) readable as literal blocks."""
+
+
+def _represent_str(dumper, data):
+    style = "|" if "\n" in data else None
+    return dumper.represent_scalar("tag:yaml.org,2002:str", data, style=style)
+
+
+CfnYamlDumper.add_representer(str, _represent_str)
+
+
+def dump_template(template):
+    """Serialize a parsed template back to YAML; intrinsic functions are written in their long form."""
+    return yaml.dump(template, Dumper=CfnYamlDumper, sort_keys=False, allow_unicode=True, width=120)
+
+
+def apply_template_patch(template_text, patch):
+    """
+    Apply an incremental update to a CloudFormation template.
+
+    Args:
+        template_text: Current template body in YAML or JSON
+        patch: dict with "upsert" (list of {"section", "logical_id", "definition"} where definition is the
+            YAML body of the element) and "remove" (list of {"section", "logical_id"})
+
+    Returns:
+        The updated template as YAML. Raises yaml.YAMLError if the template or a definition cannot be parsed.
+    """
+    template = parse_template(template_text)
+    for removed in patch.get("remove", []):
+        (template.get(removed["section"]) or {}).pop(removed["logical_id"], None)
+    for element in patch.get("upsert", []):
+        section = template.get(element["section"]) or {}
+        section[element["logical_id"]] = parse_template(element["definition"])
+        template[element["section"]] = section
+    for section_name in TEMPLATE_SECTIONS:
+        if section_name in template and not template[section_name]:
+            del template[section_name]
+    return dump_template(template)
+
+
+def _walk(node):
+    yield node
+    if isinstance(node, dict):
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+
+def _closest(name, candidates):
+    matches = difflib.get_close_matches(name, candidates, n=1, cutoff=0.85)
+    return matches[0] if matches else None
+
+
+def _check_resource_type(logical_id, resource_type, resource_types, complete, errors, warnings):
+    if not isinstance(resource_type, str):
+        errors.append(f"Resource {logical_id} has no Type")
+        return
+    if not resource_type.startswith("AWS::") or resource_type in resource_types:
+        return  # Custom resources, modules and third-party types are not part of the spec
+    suggestion = _closest(resource_type, resource_types.keys())
+    hint = f" Did you mean {suggestion}?" if suggestion else ""
+    if complete:
+        errors.append(f"Resource {logical_id} has an invalid type {resource_type}.{hint}")
+    else:
+        # A partial index misses valid types close to indexed ones (AWS::IAM::RolePolicy, AWS::S3::AccessPoint...)
+        warnings.append(f"Resource {logical_id} uses type {resource_type}, which is not in the local spec index.{hint}")
+
+
+def _check_get_att(target, attribute, resources, resource_types, complete, errors, warnings):
+    if target not in resources:
+        errors.append(f"Fn::GetAtt references unknown resource {target}")
+        return
+    if not isinstance(attribute, str):
+        return  # Attribute names built with intrinsic functions can only be resolved by CloudFormation
+    known_attributes = resource_types.get(resources[target].get("Type"))
+    if not known_attributes or attribute in known_attributes:
+        return
+    suggestion = _closest(attribute, known_attributes)
+    hint = f" Did you mean {suggestion}?" if suggestion else ""
+    if complete:
+        errors.append(f"Fn::GetAtt {target}.{attribute} is not an attribute of {resources[target]['Type']}.{hint}")
+    else:
+        warnings.append(f"Fn::GetAtt {target}.{attribute} is not in the local spec index.{hint}")
+
+
+def _validate(template_text):
+    errors = []
+    warnings = []
+    try:
+        template = parse_template(template_text)
+    except yaml.YAMLError as e:
+        return {"errors": [f"Template is not valid YAML: {e}"], "warnings": warnings}
+
+    if not isinstance(template, dict) or not isinstance(template.get("Resources"), dict) or not template["Resources"]:
+        return {"errors": ["Template must be a mapping with a non-empty Resources section"], "warnings": warnings}
+
+    resource_types, complete = load_spec_index()
+    resources = {
+        logical_id: resource if isinstance(resource, dict) else {}
+        for logical_id, resource in template["Resources"].items()
+    }
+    parameters = set(template.get("Parameters") or {})
+    conditions = set(template.get("Conditions") or {})
+    ref_targets = set(resources) | parameters | PSEUDO_PARAMETERS
+    # Macros such as AWS::Serverless-2016-10-31 generate resources (ApiRole, ServerlessRestApi...) and types of
+    # their own: what cannot be resolved before the transform runs is only a warning
+    unresolved = warnings if template.get("Transform") else errors
+
+    for logical_id, resource in resources.items():
+        _check_resource_type(logical_id, resource.get("Type"), resource_types, complete, unresolved, warnings)
+        depends_on = resource.get("DependsOn", [])
+        for dependency in [depends_on] if isinstance(depends_on, str) else depends_on:
+            if dependency not in resources:
+                unresolved.append(f"Resource {logical_id} DependsOn unknown resource {dependency}")
+        if "Condition" in resource and resource["Condition"] not in conditions:
+            errors.append(f"Resource {logical_id} uses unknown condition {resource['Condition']}")
+
+    for node in _walk(template):
+        if not isinstance(node, dict) or len(node) != 1:
+            continue
+        function_name, value = next(iter(node.items()))
+        if function_name == "Ref" and isinstance(value, str) and value not in ref_targets:
+            unresolved.append(f"Ref references unknown parameter or resource {value}")
+        elif function_name == "Fn::GetAtt":
+            if isinstance(value, str):
+                value = value.split(".", 1)
+            if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+                _check_get_att(value[0], value[1], resources, resource_types, complete, unresolved, warnings)
+            else:
+                errors.append(f"Fn::GetAtt has an invalid value {value}")
+        elif function_name == "Fn::Sub":
+            if isinstance(value, str):
+                sub_text, sub_variables = value, {}
+            elif isinstance(value, list) and len(value) == 2:
+                sub_text, sub_variables = value
+            else:
+                continue
+            if not isinstance(sub_text, str) or not isinstance(sub_variables, dict):
+                continue
+            for variable in SUB_VARIABLE.findall(sub_text):
+                target, _, attribute = variable.partition(".")
+                if variable in sub_variables or target in sub_variables:
+                    continue
+                if attribute and target in resources:
+                    _check_get_att(target, attribute, resources, resource_types, complete, unresolved, warnings)
+                elif variable not in ref_targets:
+                    unresolved.append(f"Fn::Sub references unknown parameter or resource {variable}")
+
+    return {"errors": errors, "warnings": warnings}
+
+
+def template_hash(template_text):
+    return hashlib.sha256(template_text.encode("utf-8")).hexdigest()
+
+
+def validate_template(template_text):
+    """
+    Validate a CloudFormation template locally, memoized by the template hash.
+
+    Args:
+        template_text: Template body in YAML or JSON
+
+    Returns:
+        dict with "hash", "errors" and "warnings" (lists of human readable messages)
+    """
+    digest = template_hash(template_text)
+    with _validation_cache_lock:
+        if digest in _validation_cache:
+            _validation_cache.move_to_end(digest)
+            return _validation_cache[digest]
+
+    result = {"hash": digest, **_validate(template_text)}
+    with _validation_cache_lock:
+        _validation_cache[digest] = result
+        if len(_validation_cache) > VALIDATION_CACHE_SIZE:
+            _validation_cache.popitem(last=False)
+    return result
+
+
+def build_spec_index(specification_path):
+    """Compact the official CloudFormationResourceSpecification.json into the spec index format."""
+    with open(specification_path, encoding="utf-8") as f:
+        specification = json.load(f)
+    return {
+        "complete": True,
+        "resource_types": {
+            resource_type: sorted(definition.get("Attributes", {}))
+            for resource_type, definition in specification["ResourceTypes"].items()
+        },
+        "version": specification.get("ResourceSpecificationVersion", "unknown"),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the CloudFormation spec index from the resource specification")
+    parser.add_argument("specification", help="Path to CloudFormationResourceSpecification.json")
+    parser.add_argument("--output", default=str(SPEC_INDEX_PATH))
+    args = parser.parse_args()
+
+    spec_index = build_spec_index(args.specification)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(spec_index, f, indent=1, sort_keys=True)
+        f.write("\n")
+    print(f"Wrote {len(spec_index['resource_types'])} resource types to {args.output}")
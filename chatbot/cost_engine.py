@@ -0,0 +1,281 @@
+import argparse
+import json
+import os
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from pathlib import Path
+
+PRICE_INDEX_PATH = Path(__file__).parent / "data" / "aws_price_index.json"
+GLOBAL_REGION = "global"
+HOURS_PER_MONTH = 730
+CENTS = Decimal("0.01")
+
+# Usage types in the AWS Price List carry a region prefix everywhere except us-east-1 (USE1 is implicit)
+REGION_USAGE_PREFIXES = {
+    "us-east-1": "USE1",
+    "us-east-2": "USE2",
+    "us-west-1": "USW1",
+    "us-west-2": "USW2",
+    "ca-central-1": "CAN1",
+    "sa-east-1": "SAE1",
+    "eu-west-1": "EU",
+    "eu-west-2": "EUW2",
+    "eu-central-1": "EUC1",
+    "ap-northeast-1": "APN1",
+    "ap-southeast-1": "APS1",
+    "ap-southeast-2": "APS2",
+    "ap-south-1": "APS3",
+}
+
+# Attribute filters used when compacting bulk offer files, so that a usage type maps to a single price
+OFFER_FILTERS = {
+    "AmazonEC2": {"operatingSystem": {"Linux", "NA"}, "tenancy": {"Shared", "NA"},
+                  "preInstalledSw": {"NA"}, "capacitystatus": {"Used", "NA"}},
+    "AmazonRDS": {"databaseEngine": {"MySQL", "Aurora MySQL", "Any"}},
+}
+
+
+class PriceIndex:
+    """
+    Compact, read-only price store keyed by (service code, region, usage type).
+
+    Args:
+        snapshot: Parsed price snapshot with the shape
+            {"version": str, "currency": str, "prices": {service: {region: {usage_type: [unit, price, description]}}}}
+    """
+
+    def __init__(self, snapshot):
+        self.version = snapshot.get("version", "unknown")
+        self.currency = snapshot.get("currency", "USD")
+        self._prices = {}
+        for service, regions in snapshot["prices"].items():
+            for region, usage_types in regions.items():
+                for usage_type, (unit, price, description) in usage_types.items():
+                    self._prices[(service, region, usage_type)] = (Decimal(price), unit, description)
+
+    def __len__(self):
+        return len(self._prices)
+
+    def lookup(self, service, region, usage_type):
+        """Return (price, unit, description) for the usage type, falling back to global pricing, or None."""
+        return self._prices.get((service, region, usage_type)) or \
+            self._prices.get((service, GLOBAL_REGION, usage_type))
+
+    def catalog(self, region):
+        """List the priced usage types available in a region as (service, usage_type, unit, description)."""
+        entries = [
+            (service, usage_type, unit, description)
+            for (service, price_region, usage_type), (_, unit, description) in self._prices.items()
+            if price_region in (region, GLOBAL_REGION)
+        ]
+        return sorted(entries)
+
+
+@lru_cache(maxsize=4)
+def load_price_index(path=PRICE_INDEX_PATH):
+    with open(path, encoding="utf-8") as f:
+        return PriceIndex(json.load(f))
+
+
+def default_region():
+    return os.getenv("AWS_REGION") or "us-east-1"
+
+
+def format_usd(amount):
+    return f"USD {amount.quantize(CENTS, rounding=ROUND_HALF_UP):,}"
+
+
+def format_unit_price(price):
+    # Unit prices can be fractions of a cent (e.g. per request), keep them exact instead of rounding to cents
+    return f"USD {price.normalize():f}"
+
+
+def catalog_as_text(index, region):
+    """Render the price catalog as compact pipe-separated lines for inclusion in a prompt."""
+    return "\n".join(
+        f"{service} | {usage_type} | {unit} | {description}"
+        for service, usage_type, unit, description in index.catalog(region)
+    )
+
+
+def estimate_costs(bill_of_materials, index, region=None):
+    """
+    Price a bill of materials against the local index.
+
+    Args:
+        bill_of_materials: List of line items, each a dict with the keys
+            service_name, service_code, usage_type, quantity, configuration and optionally region.
+        index: PriceIndex to price the line items with
+        region: Default region for line items that do not specify one
+
+    Returns:
+        dict with "rows" (one per service, sorted by monthly cost descending), "total" (Decimal)
+        and "unpriced" (line items that are not in the index)
+    """
+    region = region or default_region()
+    services = {}
+    unpriced = []
+
+    for item in bill_of_materials:
+        # Line items come from the model: any of them may be incomplete or carry a non-numeric quantity
+        service_name = item.get("service_name") or item.get("service_code")
+        service_code = item.get("service_code")
+        usage_type = item.get("usage_type")
+        try:
+            quantity = Decimal(str(item.get("quantity")))
+        except (ArithmeticError, ValueError):
+            quantity = None
+        if not service_name or not service_code or not usage_type or quantity is None or not quantity.is_finite():
+            unpriced.append(item)
+            continue
+        match = index.lookup(service_code, item.get("region") or region, usage_type)
+        if match is None:
+            unpriced.append(item)
+            continue
+
+        price, unit, _ = match
+        row = services.setdefault(service_name, {
+            "service_name": service_name,
+            "configuration": [],
+            "unit_prices": [],
+            "monthly_cost": Decimal("0"),
+        })
+        if item.get("configuration") and item["configuration"] not in row["configuration"]:
+            row["configuration"].append(item["configuration"])
+        unit_price = f"{format_unit_price(price)} por {unit}"
+        if unit_price not in row["unit_prices"]:
+            row["unit_prices"].append(unit_price)
+        row["monthly_cost"] += price * quantity
+
+    # Sort on the exact amount and break ties by name so the table is fully reproducible
+    rows = sorted(services.values(), key=lambda row: (-row["monthly_cost"], row["service_name"]))
+    total = sum((row["monthly_cost"] for row in rows), Decimal("0"))
+    return {"rows": rows, "total": total, "unpriced": unpriced}
+
+
+def line_item_key(item):
+    return item.get("service_name"), item.get("service_code"), item.get("usage_type")
+
+
+def apply_bom_patch(bill_of_materials, patch):
+    """
+    Apply an incremental update to a bill of materials.
+
+    Line items in patch["upsert"] replace the item with the same service name, service code and usage type
+    (or are appended), and items matching an entry of patch["remove"] are dropped. The order of the
+    remaining items is preserved.
+    """
+    items = {line_item_key(item): item for item in bill_of_materials}
+    for removed in patch.get("remove", []):
+        items.pop((removed.get("service_name"), removed.get("service_code"), removed.get("usage_type")), None)
+    for item in patch.get("upsert", []):
+        items[line_item_key(item)] = item
+    return list(items.values())
+
+
+def render_cost_table(estimate, index):
+    lines = [
+        "| Nombre del Servicio | Configuración | Precio (por unidad) | Costo Mensual Estimado |",
+        "|---------------------|---------------|---------------------|-------------------------|",
+    ]
+    for row in estimate["rows"]:
+        lines.append(
+            f"| {row['service_name']} | {'; '.join(row['configuration'])} | "
+            f"{' + '.join(row['unit_prices'])} | {format_usd(row['monthly_cost'])} |"
+        )
+    lines.append(f"| **Costo Mensual Estimado Total** | | | **{format_usd(estimate['total'])}** |")
+
+    notes = [
+        f"Precios On-Demand calculados localmente con el índice de precios de AWS ({index.version}), "
+        f"asumiendo {HOURS_PER_MONTH} horas por mes.",
+        "No incluye niveles gratuitos, descuentos por volumen, instancias reservadas ni Savings Plans.",
+    ]
+    if estimate["unpriced"]:
+        missing = ", ".join(
+            f"{item.get('service_name', item.get('service_code'))} ({item.get('usage_type')})"
+            for item in estimate["unpriced"]
+        )
+        notes.append(f"Sin precio en el índice local, no incluidos en el total: {missing}.")
+
+    return "\n".join(lines) + "\n\nTen en cuenta:\n" + "\n".join(
+        f"{number}. {note}" for number, note in enumerate(notes, start=1))
+
+
+def _matches_filters(service, attributes):
+    for attribute, allowed in OFFER_FILTERS.get(service, {}).items():
+        if attributes.get(attribute, "NA") not in allowed:
+            return False
+    return True
+
+
+def build_price_index(offer_paths, regions, version):
+    """
+    Compact AWS Price List bulk offer files (https://pricing.us-east-1.amazonaws.com/offers/v1.0/aws/index.json)
+    into the snapshot format read by PriceIndex. Only the first On-Demand price tier of each usage type is kept.
+    """
+    prices = {}
+    for offer_path in offer_paths:
+        with open(offer_path, encoding="utf-8") as f:
+            offer = json.load(f)
+        service = offer["offerCode"]
+        on_demand = offer.get("terms", {}).get("OnDemand", {})
+
+        # Iterate SKUs in sorted order so collisions resolve the same way on every build
+        for sku in sorted(offer["products"]):
+            attributes = offer["products"][sku].get("attributes", {})
+            region = attributes.get("regionCode") or GLOBAL_REGION
+            if region not in regions and region != GLOBAL_REGION:
+                continue
+            if not _matches_filters(service, attributes):
+                continue
+
+            usage_type = attributes.get("usagetype", "")
+            prefix = REGION_USAGE_PREFIXES.get(region)
+            if prefix and usage_type.startswith(f"{prefix}-"):
+                usage_type = usage_type[len(prefix) + 1:]
+
+            for term in on_demand.get(sku, {}).values():
+                for dimension in term["priceDimensions"].values():
+                    if dimension.get("beginRange", "0") != "0" or "USD" not in dimension["pricePerUnit"]:
+                        continue
+                    price = Decimal(dimension["pricePerUnit"]["USD"])
+                    if price == 0:
+                        continue
+                    prices.setdefault(service, {}).setdefault(region, {}).setdefault(
+                        usage_type, [dimension["unit"], f"{price.normalize():f}", dimension["description"]])
+
+    return {"version": version, "currency": "USD", "prices": prices}
+
+
+def write_price_index(snapshot, path):
+    # One usage type per line keeps the bundled snapshot small and diff friendly
+    lines = ["{", f' "currency": {json.dumps(snapshot["currency"])},', ' "prices": {']
+    services = sorted(snapshot["prices"])
+    for i, service in enumerate(services):
+        lines.append(f"  {json.dumps(service)}: {{")
+        regions = sorted(snapshot["prices"][service])
+        for j, region in enumerate(regions):
+            lines.append(f"   {json.dumps(region)}: {{")
+            usage_types = sorted(snapshot["prices"][service][region].items())
+            for k, (usage_type, entry) in enumerate(usage_types):
+                lines.append(f"    {json.dumps(usage_type)}: {json.dumps(entry)}" + ("," if k < len(usage_types) - 1 else ""))
+            lines.append("   }" + ("," if j < len(regions) - 1 else ""))
+        lines.append("  }" + ("," if i < len(services) - 1 else ""))
+    lines.append(" },")
+    lines.append(f' "version": {json.dumps(snapshot["version"])}')
+    lines.append("}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local AWS price index from Price List bulk offer files")
+    parser.add_argument("offers", nargs="+", help="Paths to downloaded offer index.json files")
+    parser.add_argument("--regions", nargs="+", default=["us-east-1", "us-west-2"])
+    parser.add_argument("--version", required=True, help="Label stored with the snapshot, e.g. '2025-06 on-demand snapshot'")
+    parser.add_argument("--output", default=str(PRICE_INDEX_PATH))
+    args = parser.parse_args()
+
+    snapshot = build_price_index(args.offers, set(args.regions), args.version)
+    write_price_index(snapshot, args.output)
+    print(f"Wrote {len(PriceIndex(snapshot))} prices to {args.output}")
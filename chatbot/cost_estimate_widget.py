@@ -1,12 +1,97 @@
+import json
 import streamlit as st
-from utils import BEDROCK_MODEL_ID
+from cost_engine import HOURS_PER_MONTH
+from cost_engine import apply_bom_patch
+from cost_engine import catalog_as_text
+from cost_engine import default_region
+from cost_engine import estimate_costs
+from cost_engine import load_price_index
+from cost_engine import render_cost_table
+from utils import bedrock_model_id
 from utils import store_in_s3
 from utils import save_conversation
 from utils import collect_feedback
-from utils import invoke_bedrock_model_streaming
+from utils import invoke_bedrock_model_structured
+from utils import prompts_to_messages
+from utils import cancel_generation_jobs
+from artifact_store import store_artifact
+from incremental import solution_text
+from incremental import plan_regeneration
+from incremental import record_artifact
+from incremental import forget_artifact
+from incremental import incremental_prompt
 import uuid
 from styles import apply_custom_styles
 
+LINE_ITEM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "service_name": {"type": "string", "description": "Display name, e.g. Amazon S3"},
+        "service_code": {"type": "string", "description": "service_code from the catalog"},
+        "usage_type": {"type": "string", "description": "usage_type from the catalog"},
+        "quantity": {"type": "number", "description": "Monthly quantity in the catalog unit"},
+        "configuration": {"type": "string", "description": "Short sizing summary"},
+        "region": {"type": "string"},
+    },
+    "required": ["service_name", "service_code", "usage_type", "quantity", "configuration"],
+}
+
+BILL_OF_MATERIALS_TOOL = {
+    "name": "record_bill_of_materials",
+    "description": "Record the monthly usage line items of the AWS services in the proposed architecture.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "items": {"type": "array", "items": LINE_ITEM_SCHEMA},
+        },
+        "required": ["items"],
+    },
+}
+
+BILL_OF_MATERIALS_PATCH_TOOL = {
+    "name": "update_bill_of_materials",
+    "description": "Record only the line items of the bill of materials that change for the refined architecture.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "upsert": {"type": "array", "items": LINE_ITEM_SCHEMA, "description": "New or modified line items"},
+            "remove": {
+                "type": "array",
+                "description": "Line items that are no longer part of the architecture",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "service_name": {"type": "string"},
+                        "service_code": {"type": "string"},
+                        "usage_type": {"type": "string"},
+                    },
+                    "required": ["service_name", "service_code", "usage_type"],
+                },
+            },
+        },
+        "required": ["upsert", "remove"],
+    },
+}
+
+
+def update_bill_of_materials(previous_items, diff, price_index, region):
+    # Only the affected line items are generated; the rest of the bill of materials is kept and re-priced locally
+    patch_prompt = incremental_prompt(
+        "la lista de materiales (bill of materials)",
+        json.dumps(previous_items, ensure_ascii=False),
+        diff,
+        f"""Registra con la herramienta update_bill_of_materials únicamente las líneas que se agregan o cambian
+    (identificadas por service_name, service_code y usage_type) y las líneas que ya no forman parte de la arquitectura.
+    Usa ÚNICAMENTE combinaciones service_code y usage_type del siguiente catálogo y cantidades mensuales en la unidad del catálogo.
+
+    <catalog region="{region}">
+    {catalog_as_text(price_index, region)}
+    </catalog>""")
+    patch, stop_reason = invoke_bedrock_model_structured(prompts_to_messages(patch_prompt), BILL_OF_MATERIALS_PATCH_TOOL, owner="cost")
+    if patch is None:
+        return None
+    return apply_bom_patch(previous_items, patch)
+
 
 # Generate Cost Estimates
 @st.fragment
@@ -46,6 +131,9 @@ def generate_cost_estimates(cost_messages):
         if select_cost != st.session_state.cost_user_select:
             print(select_cost)
             st.session_state.cost_user_select = select_cost
+            if not select_cost:
+                # Unticked mid-generation: stop the stream instead of paying for tokens nobody reads
+                cancel_generation_jobs("cost")
         print("st.session_state.cost_user_select", st.session_state.cost_user_select)
         st.markdown("</div>", unsafe_allow_html=True)
 
@@ -54,54 +142,57 @@ def generate_cost_estimates(cost_messages):
             st.markdown("<div class=stButton gen-style'>", unsafe_allow_html=True)
             if st.button(label="⟳ Retry", key="retry-cost", type="secondary"):
                 st.session_state.cost_user_select = True  # Probably redundant
+                forget_artifact("cost")
             st.markdown("</div>", unsafe_allow_html=True)
 
     if st.session_state.cost_user_select:
+        price_index = load_price_index()
+        region = default_region()
         cost_prompt = f"""
-        Calcula el costo mensual aproximado para la arquitectura generada con base en la siguiente descripción:
+        Extrae la lista de materiales (bill of materials) de la arquitectura generada con base en la siguiente descripción:
         {concatenated_message}
-        Usa https://docs.aws.amazon.com/awsaccountbilling/latest/aboutv2/price-changes.html para obtener los precios más recientes.
-        Proporciona un resumen breve en formato tabular para facilitar la comprensión: nombre del servicio, configuración, precio y costo total.
-        Ordena los servicios por el **costo total** en orden descendente al mostrar la tabla.
-        El formato tabular debe verse **muy profesional y legible**, con una estructura clara y fácil de interpretar.
-        Asegúrate de que los servicios estén ordenados por **Costo Total** de mayor a menor para resaltar los más costosos primero.
-        Usa el siguiente ejemplo como referencia para generar los detalles de precios en formato tabular.
+
+        No calcules precios ni totales: el costo se calcula localmente con el índice de precios de AWS.
+        Para cada servicio de AWS de la arquitectura, genera una o más líneas de uso usando ÚNICAMENTE las combinaciones
+        service_code y usage_type del siguiente catálogo (formato: service_code | usage_type | unidad | descripción).
+        La cantidad (quantity) es el consumo mensual estimado expresado en la unidad del catálogo.
+        Asume {HOURS_PER_MONTH} horas por mes para recursos que corren 24/7 y multiplica por el número de instancias o tareas.
+        Si un servicio no tiene una entrada en el catálogo, inclúyelo con el usage_type más cercano que describa su uso.
+
+        <catalog region="{region}">
+        {catalog_as_text(price_index, region)}
+        </catalog>
+
+        Registra las líneas con la herramienta record_bill_of_materials, sin texto adicional. Ejemplo de líneas:
 
         <example>
-        Con base en la arquitectura descrita y utilizando la información de precios más reciente de AWS, aquí tienes una estimación aproximada de los costos mensuales para la solución de data lake empresarial. Ten en cuenta que estas son estimaciones y los costos reales pueden variar según el uso, la transferencia de datos y otros factores.
-
-        | Nombre del Servicio | Configuración | Precio (por unidad) | Costo Mensual Estimado |
-        |---------------------|---------------|---------------------|-------------------------|
-        | Amazon ECS (Fargate) | 2 tareas, 0.25 vCPU, 0.5 GB RAM, corriendo 24/7 | $0.04048 por hora | $59.50 |
-        | Amazon OpenSearch | 1 instancia t3.small.search, 10 GB EBS | $0.036 por hora + $0.10 por GB-mes | $27.40 |
-        | Amazon S3 | 100 GB almacenamiento, 100 GB transferencia de datos | $0.023 por GB-mes + $0.09 por GB transferido | $11.30 |
-        | Amazon CloudFront | 100 GB transferencia de datos, 1M solicitudes | $0.085 por GB + $0.0075 por 10,000 solicitudes | $9.25 |
-        | Application Load Balancer | 1 ALB, corriendo 24/7 | $0.0225 por hora + $0.008 por LCU-hora | $16.74 |
-        | Amazon DynamoDB | 25 GB almacenamiento, 1M escrituras, 1M lecturas | $0.25 por GB-mes + $1.25 por millón de escrituras + $0.25 por millón de lecturas | $7.75 |
-        | AWS Lambda | 1M invocaciones, 128 MB memoria, 100ms duración promedio | $0.20 por 1M solicitudes + $0.0000166667 por GB-segundo | $0.41 |
-        | Amazon CloudWatch | 5 GB logs ingeridos, 5 métricas personalizadas | $0.50 por GB ingerido + $0.30 por métrica al mes | $4.00 |
-        | Amazon VPC | 1 NAT Gateway, corriendo 24/7 | $0.045 por hora + $0.045 por GB procesado | $33.48 |
-        | **Costo Mensual Estimado Total** | | | $169.83 |
-
-        Ten en cuenta:
-        1. Estas estimaciones suponen un uso moderado y pueden variar según la carga real de trabajo.
-        2. Los costos de transferencia de datos entre servicios dentro de la misma región no están incluidos, ya que normalmente son gratuitos.
-        3. Los costos de AWS CDK, CloudFormation e IAM no están incluidos ya que generalmente son servicios gratuitos.
-        4. Los costos de Bedrock Agent y el modelo Claude no están incluidos ya que la información de precios de estos servicios no estaba disponible al momento de esta estimación.
-        5. Los costos reales pueden ser menores con instancias reservadas, savings plans u otros descuentos disponibles en tu cuenta de AWS.
+        {{"service_name": "Amazon ECS (Fargate)", "service_code": "AmazonECS", "usage_type": "Fargate-vCPU-Hours:perCPU", "quantity": 365, "configuration": "2 tareas, 0.25 vCPU, 24/7"}}
+        {{"service_name": "Amazon ECS (Fargate)", "service_code": "AmazonECS", "usage_type": "Fargate-GB-Hours", "quantity": 730, "configuration": "2 tareas, 0.5 GB RAM, 24/7"}}
+        {{"service_name": "Amazon S3", "service_code": "AmazonS3", "usage_type": "TimedStorage-ByteHrs", "quantity": 100, "configuration": "100 GB almacenamiento Standard"}}
         </example>
         """
 
-        cost_messages.append({"role": "user", "content": cost_prompt})
-
-        cost_response, stop_reason = invoke_bedrock_model_streaming(cost_messages)
-        cost_response = cost_response.replace("$", "USD ")
-        st.session_state.cost_messages.append({"role": "assistant", "content": cost_response})
+        solution = solution_text(cost_messages)
+        mode, items, diff = plan_regeneration("cost", solution)
+        if mode == "incremental":
+            items = update_bill_of_materials(items, diff, price_index, region)
+        if items is None:
+            cost_messages.append({"role": "user", "content": cost_prompt})
+            bill_of_materials, stop_reason = invoke_bedrock_model_structured(cost_messages, BILL_OF_MATERIALS_TOOL, owner="cost")
+            if bill_of_materials is None:
+                st.error("No fue posible interpretar la lista de materiales generada. Por favor intenta de nuevo.")
+                return
+            items = bill_of_materials["items"]
+        record_artifact("cost", solution, items)
+
+        estimate = estimate_costs(items, price_index, region)
+        cost_response = render_cost_table(estimate, price_index)
+        st.session_state.cost_messages.append({"role": "assistant", "content": store_artifact(cost_response)})
 
         with st.container(height=350):
             st.markdown(cost_response)
 
-        st.session_state.interaction.append({"type": "Cost Analysis", "details": cost_response})
+        st.session_state.interaction.append({"type": "Cost Analysis", "details": store_artifact(cost_response)})
         store_in_s3(content=cost_response, content_type='cost')
         save_conversation(st.session_state['conversation_id'], cost_prompt, cost_response)
-        collect_feedback(str(uuid.uuid4()), cost_response, "generate_cost", BEDROCK_MODEL_ID)
+        collect_feedback(str(uuid.uuid4()), cost_response, "generate_cost", bedrock_model_id())
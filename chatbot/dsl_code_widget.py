@@ -1,13 +1,21 @@
 import uuid
 import get_code_from_markdown
 import streamlit as st
-from utils import BEDROCK_MODEL_ID
+from utils import bedrock_model_id
 from utils import store_in_s3
 from utils import save_conversation
 from utils import collect_feedback
 from utils import continuation_prompt
 from utils import invoke_bedrock_model_streaming
 from utils import display_diagram_streamlit, clean_dsl_code
+from utils import prompts_to_messages
+from utils import cancel_generation_jobs
+from artifact_store import store_artifact
+from incremental import solution_text
+from incremental import plan_regeneration
+from incremental import record_artifact
+from incremental import forget_artifact
+from incremental import incremental_prompt
 
 
 @st.fragment
@@ -36,6 +44,9 @@ def generate_dsl(dsl_messages):
         )
         if select_dsl != st.session_state.dsl_user_select:
             st.session_state.dsl_user_select = select_dsl
+            if not select_dsl:
+                # Unticked mid-generation: stop the stream instead of paying for tokens nobody reads
+                cancel_generation_jobs("dsl")
         st.markdown("</div>", unsafe_allow_html=True)
 
     with right:
@@ -43,6 +54,7 @@ def generate_dsl(dsl_messages):
             st.markdown("<div class=stButton gen-style'>", unsafe_allow_html=True)
             if st.button(label="⟳ Retry", key="retry-dsl", type="secondary"):
                 st.session_state.dsl_user_select = True
+                forget_artifact("dsl")
             st.markdown("</div>", unsafe_allow_html=True)
 
     if st.session_state.dsl_user_select:
@@ -152,25 +164,40 @@ def generate_dsl(dsl_messages):
         Ahora aplica este proceso de razonamiento para generar tu código en Structurizr DSL, asegurando que se sigan estrictamente todas las reglas."""   
 
         st.session_state.dsl_messages.append({"role": "user", "content": dsl_prompt})
-        dsl_messages.append({"role": "user", "content": dsl_prompt})
+        solution = solution_text(dsl_messages)
+        mode, previous_response, diff = plan_regeneration("dsl", solution)
+        if mode == "incremental":
+            # Edit the previous workspace instead of reasoning about the whole system again
+            dsl_prompt = incremental_prompt(
+                "el código Structurizr DSL",
+                previous_response,
+                diff,
+                """Modifica solo los elementos, relaciones y vistas afectados por los cambios y conserva los nombres de variables existentes.
+        Responde solo con el código DSL completo actualizado en markdown (```dsl).""")
+            dsl_messages = prompts_to_messages(dsl_prompt)
+        else:
+            dsl_messages.append({"role": "user", "content": dsl_prompt})
 
         max_attempts = 4
         full_response_array = []
         full_response = ""
 
-        for attempt in range(max_attempts):
-            dsl_response, stop_reason = invoke_bedrock_model_streaming(dsl_messages, enable_reasoning=True)
-            full_response_array.append(dsl_response)
+        if mode == "reuse":
+            full_response_array.append(previous_response)
+        else:
+            for attempt in range(max_attempts):
+                dsl_response, stop_reason = invoke_bedrock_model_streaming(dsl_messages, enable_reasoning=mode == "full", owner="dsl")
+                full_response_array.append(dsl_response)
 
-            if stop_reason != "max_tokens":
-                break
+                if stop_reason != "max_tokens":
+                    break
 
-            if attempt == 0:
-                full_response = ''.join(str(x) for x in full_response_array)
-                dsl_messages = continuation_prompt(dsl_prompt, full_response)
+                if attempt == 0:
+                    full_response = ''.join(str(x) for x in full_response_array)
+                    dsl_messages = continuation_prompt(dsl_prompt, full_response)
 
-        if attempt == max_attempts - 1:
-            st.error("Reached maximum number of attempts. Final result is incomplete. Please try again.")
+            if attempt == max_attempts - 1:
+                st.error("Reached maximum number of attempts. Final result is incomplete. Please try again.")
 
         try:
             full_response = ''.join(str(x) for x in full_response_array)
@@ -179,6 +206,7 @@ def generate_dsl(dsl_messages):
             
             # Limpiar y validar el código DSL
             dsl_code = clean_dsl_code(raw_dsl_code)
+            record_artifact("dsl", solution, full_response)
 
             # Mostrar el DSL en un text area (copiable)
             st.text_area("DSL Output", value=dsl_code, height=350)
@@ -198,10 +226,10 @@ def generate_dsl(dsl_messages):
                 st.code(dsl_code, language='text')
 
             st.session_state.dsl_messages.append({"role": "assistant", "content": "DSL"})
-            st.session_state.interaction.append({"type": "DSL Diagram", "details": full_response})
+            st.session_state.interaction.append({"type": "DSL Diagram", "details": store_artifact(full_response)})
             store_in_s3(content=full_response, content_type='dsl')
             save_conversation(st.session_state['conversation_id'], dsl_prompt, full_response)
-            collect_feedback(str(uuid.uuid4()), dsl_code, "generate_dsl", BEDROCK_MODEL_ID)
+            collect_feedback(str(uuid.uuid4()), dsl_code, "generate_dsl", bedrock_model_id())
 
         except IndexError:
             st.error("No se encontró código DSL en la respuesta generada.")
@@ -1,18 +1,17 @@
-import boto3
-import os
 import uuid
 import datetime
-from utils import retrieve_environment_variables
+from aws_clients import create_resource
+from app_config import get_config
 
 
 class DynanmoPersistance():
     def __init__(self):
-        AWS_REGION = os.getenv("AWS_REGION")
-        self.dynamodb_resource = boto3.resource('dynamodb', region_name=AWS_REGION)
-        self.CONVERSATION_TABLE_NAME = retrieve_environment_variables("CONVERSATION_TABLE_NAME")
-        self.FEEDBACK_TABLE_NAME = retrieve_environment_variables("FEEDBACK_TABLE_NAME")
-        self.SESSION_TABLE_NAME = retrieve_environment_variables("SESSION_TABLE_NAME")
-        self.S3_BUCKET_NAME = retrieve_environment_variables("S3_BUCKET_NAME")
+        self.dynamodb_resource = create_resource("dynamodb")
+        config = get_config()
+        self.CONVERSATION_TABLE_NAME = config.conversation_table_name
+        self.FEEDBACK_TABLE_NAME = config.feedback_table_name
+        self.SESSION_TABLE_NAME = config.session_table_name
+        self.S3_BUCKET_NAME = config.s3_bucket_name
 
     # Store conversation details in DynamoDB
     def save_session(self, conversation_id, name, email):
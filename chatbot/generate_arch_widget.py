@@ -1,13 +1,21 @@
 import uuid
 import get_code_from_markdown
 import streamlit as st
-from utils import BEDROCK_MODEL_ID
+from utils import bedrock_model_id
 from utils import store_in_s3
 from utils import save_conversation
 from utils import collect_feedback
 from utils import continuation_prompt
 from utils import convert_xml_to_html
 from utils import invoke_bedrock_model_streaming
+from utils import prompts_to_messages
+from utils import cancel_generation_jobs
+from artifact_store import store_artifact
+from incremental import solution_text
+from incremental import plan_regeneration
+from incremental import record_artifact
+from incremental import forget_artifact
+from incremental import incremental_prompt
 
 
 @st.fragment
@@ -38,6 +46,9 @@ def generate_arch(arch_messages):
         # Only update the session state when the checkbox value changes
         if select_arch != st.session_state.arch_user_select:
             st.session_state.arch_user_select = select_arch
+            if not select_arch:
+                # Unticked mid-generation: stop the stream instead of paying for tokens nobody reads
+                cancel_generation_jobs("arch")
         st.markdown("</div>", unsafe_allow_html=True)
 
     with right:
@@ -45,6 +56,7 @@ def generate_arch(arch_messages):
             st.markdown("<div class=stButton gen-style'>", unsafe_allow_html=True)
             if st.button(label="⟳ Retry", key="retry", type="secondary"):
                 st.session_state.arch_user_select = True  # Probably redundant
+                forget_artifact("arch")
             st.markdown("</div>", unsafe_allow_html=True)
 
     if st.session_state.arch_user_select:
@@ -64,40 +76,57 @@ def generate_arch(arch_messages):
  
 
         st.session_state.arch_messages.append({"role": "user", "content": architecture_prompt})
-        arch_messages.append({"role": "user", "content": architecture_prompt})
+        solution = solution_text(arch_messages)
+        mode, previous_response, diff = plan_regeneration("arch", solution)
+        if mode == "incremental":
+            # Edit the previous diagram instead of designing it again; no extended reasoning is needed for that
+            architecture_prompt = incremental_prompt(
+                "el diagrama de arquitectura en XML de draw.io",
+                previous_response,
+                diff,
+                """Modifica solo los íconos, contenedores y conexiones afectados por los cambios y conserva la posición y el estilo
+        del resto de los elementos. Responde únicamente con el XML completo actualizado en formato markdown—sin texto adicional.""")
+            arch_messages = prompts_to_messages(architecture_prompt)
+        else:
+            arch_messages.append({"role": "user", "content": architecture_prompt})
 
         max_attempts = 4
         full_response_array = []
         full_response = ""
 
-        for attempt in range(max_attempts):
-            arch_gen_response, stop_reason = invoke_bedrock_model_streaming(arch_messages, enable_reasoning=True)
-            # full_response += arch_gen_response
-            full_response_array.append(arch_gen_response)
+        if mode == "reuse":
+            full_response_array.append(previous_response)
+        else:
+            for attempt in range(max_attempts):
+                arch_gen_response, stop_reason = invoke_bedrock_model_streaming(
+                    arch_messages, enable_reasoning=mode == "full", owner="arch")
+                # full_response += arch_gen_response
+                full_response_array.append(arch_gen_response)
 
-            if stop_reason != "max_tokens":
-                break
+                if stop_reason != "max_tokens":
+                    break
 
-            if attempt == 0:
-                full_response = ''.join(str(x) for x in full_response_array)
-                arch_messages = continuation_prompt(architecture_prompt, full_response)
+                if attempt == 0:
+                    full_response = ''.join(str(x) for x in full_response_array)
+                    arch_messages = continuation_prompt(architecture_prompt, full_response)
 
-        if attempt == max_attempts - 1:
-            st.error("Reached maximum number of attempts. Final result is incomplete. Please try again.")
+            if attempt == max_attempts - 1:
+                st.error("Reached maximum number of attempts. Final result is incomplete. Please try again.")
 
         try:
             full_response = ''.join(str(x) for x in full_response_array)
             arch_content_xml = get_code_from_markdown.get_code_from_markdown(full_response, language="xml")[0]
             arch_content_html = convert_xml_to_html(arch_content_xml)
+            record_artifact("arch", solution, full_response)
             st.session_state.arch_messages.append({"role": "assistant", "content": "XML"})
 
             with st.container():
                 st.components.v1.html(arch_content_html, scrolling=True, height=350)
 
-            st.session_state.interaction.append({"type": "Solution Architecture", "details": full_response})
+            st.session_state.interaction.append({"type": "Solution Architecture", "details": store_artifact(full_response)})
             store_in_s3(content=full_response, content_type='architecture')
             save_conversation(st.session_state['conversation_id'], architecture_prompt, full_response)
-            collect_feedback(str(uuid.uuid4()), arch_content_xml, "generate_architecture", BEDROCK_MODEL_ID)
+            collect_feedback(str(uuid.uuid4()), arch_content_xml, "generate_architecture", bedrock_model_id())
 
         except Exception as e:
             st.error("Internal error occurred. Please try again.")
@@ -1,11 +1,131 @@
 import streamlit as st
-from utils import BEDROCK_MODEL_ID
+from app_config import get_config
+from utils import bedrock_model_id
 from utils import store_in_s3
 from utils import save_conversation
 from utils import collect_feedback
-from utils import invoke_bedrock_model_streaming
+from utils import invoke_bedrock_model_structured
+from utils import create_presigned_download_url
+from utils import S3StreamWriter
+from utils import prompts_to_messages
+from utils import cancel_generation_jobs
+from artifact_store import store_artifact
+from cdk_project import build_project_tree
+from cdk_project import normalize_path
+from cdk_project import write_project_zip
+from incremental import solution_text
+from incremental import plan_regeneration
+from incremental import record_artifact
+from incremental import forget_artifact
+from incremental import incremental_prompt
 import uuid
 
+MAX_FILES_PER_RESPONSE = 8
+
+CDK_TOOL = {
+    "name": "cdk_project",
+    "description": "Return the files of the AWS CDK TypeScript project for the solution and the commands to deploy it.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "files": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "path": {"type": "string", "description": "Path relative to the project root, e.g. lib/app-stack.ts"},
+                        "content": {"type": "string", "description": "Full file content"},
+                    },
+                    "required": ["path", "content"],
+                },
+            },
+            "deploy_commands": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Commands to install dependencies and deploy the CDK app"
+            },
+            "complete": {
+                "type": "boolean",
+                "description": "false when more project files remain to be generated in a follow-up response"
+            },
+            "removed_paths": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Paths of previously generated files that are no longer part of the project"
+            },
+        },
+        "required": ["files", "deploy_commands", "complete"],
+    },
+}
+
+CODE_LANGUAGES = {"ts": "typescript", "js": "javascript", "json": "json", "py": "python", "yaml": "yaml", "yml": "yaml"}
+
+
+def code_language(path):
+    return CODE_LANGUAGES.get(path.rsplit(".", 1)[-1].lower(), "text")
+
+
+def cdk_to_markdown(cdk_output):
+    sections = [f"### {file['path']}\n\n```{code_language(file['path'])}\n{file['content']}\n```"
+                for file in cdk_output["files"]]
+    deploy_commands = "\n".join(cdk_output["deploy_commands"])
+    sections.append(f"```bash\n{deploy_commands}\n```")
+    return "\n\n".join(sections) + "\n"
+
+
+def cdk_continuation_prompt(cdk_messages, cdk_prompt, generated_paths):
+    generated = "\n".join(f"- {path}" for path in generated_paths) or "- (ninguno)"
+    continuation = f"""
+    {cdk_prompt}
+
+    La respuesta anterior quedó incompleta. Ya se generaron los siguientes archivos del proyecto:
+    {generated}
+    No los repitas. Genera únicamente los archivos restantes, como máximo {MAX_FILES_PER_RESPONSE} por respuesta.
+    """
+    return cdk_messages[:-1] + [{"role": "user", "content": continuation}]
+
+
+def cdk_update_prompt(previous_project, diff):
+    project_files = "\n\n".join(f"### {path}\n{content}" for path, content in sorted(previous_project["tree"].items()))
+    return incremental_prompt(
+        "los archivos del proyecto CDK",
+        project_files,
+        diff,
+        f"""Entrega con la herramienta cdk_project únicamente los archivos que se agregan o cambian, con su contenido completo,
+    y lista en removed_paths los archivos que ya no son necesarios. No repitas los archivos que no cambian.
+    Entrega como máximo {MAX_FILES_PER_RESPONSE} archivos por respuesta; si quedan archivos pendientes, marca complete como false.""")
+
+
+def request_cdk_files(cdk_messages, cdk_prompt, deploy_commands, max_attempts=4):
+    """
+    Invoke the model until every file of the CDK project is generated.
+
+    Args:
+        cdk_messages: Messages of the request, ending with cdk_prompt
+        cdk_prompt: Prompt repeated in the continuation requests
+        deploy_commands: Deploy commands kept when the model returns none
+
+    Returns:
+        (files, removed_paths, deploy_commands, complete, responded): responded is False when no attempt
+        returned a usable response
+    """
+    files = []
+    removed_paths = []
+    responded = False
+    request_messages = cdk_messages
+    for attempt in range(max_attempts):
+        cdk_output, stop_reason = invoke_bedrock_model_structured(request_messages, CDK_TOOL, owner="cdk")
+        if cdk_output is not None:
+            responded = True
+            files.extend(cdk_output["files"])
+            removed_paths.extend(cdk_output.get("removed_paths", []))
+            deploy_commands = cdk_output["deploy_commands"] or deploy_commands
+            if cdk_output.get("complete", True):
+                return files, removed_paths, deploy_commands, True, responded
+        # Either the model asked for a follow-up or the response was cut off by the token limit
+        request_messages = cdk_continuation_prompt(cdk_messages, cdk_prompt, [file["path"] for file in files])
+    return files, removed_paths, deploy_commands, False, responded
+
 
 # Generate CDK
 @st.fragment
@@ -37,6 +157,9 @@ def generate_cdk(cdk_messages):
         # Only update the session state when the checkbox value changes
         if select_cdk != st.session_state.cdk_user_select:
             st.session_state.cdk_user_select = select_cdk
+            if not select_cdk:
+                # Unticked mid-generation: stop the stream instead of paying for tokens nobody reads
+                cancel_generation_jobs("cdk")
         st.markdown("</div>", unsafe_allow_html=True)
 
     with right:
@@ -44,6 +167,7 @@ def generate_cdk(cdk_messages):
             st.markdown("<div class=stButton gen-style'>", unsafe_allow_html=True)
             if st.button(label="⟳ Retry", key="retry-cdk", type="secondary"):
                 st.session_state.cdk_user_select = True  # Probably redundant
+                forget_artifact("cdk")
             st.markdown("</div>", unsafe_allow_html=True)
 
     if st.session_state.cdk_user_select:
@@ -52,23 +176,75 @@ def generate_cdk(cdk_messages):
         Proporciona el código fuente real para todos los trabajos cuando corresponda.
         El código CDK debe aprovisionar todos los recursos y componentes sin restricciones de versión.
         Si se necesita código en Python, genera un ejemplo "Hello, World!".
-        Al final, genera comandos de ejemplo para desplegar el código CDK.
-        """
-
+        Incluye también comandos de ejemplo para desplegar el código CDK.
+        Organiza el proyecto con la estructura estándar de CDK (bin/, lib/, package.json, cdk.json, tsconfig.json).
+        Entrega cada archivo del proyecto por separado con la herramienta cdk_project, sin explicaciones adicionales.
+        Entrega como máximo {max_files} archivos por respuesta; si quedan archivos pendientes, marca complete como false.
+        """.format(max_files=MAX_FILES_PER_RESPONSE)
 
         # Append the prompt to the session state and messages
         st.session_state.cdk_messages.append({"role": "user", "content": cdk_prompt1})
-        cdk_messages.append({"role": "user", "content": cdk_prompt1})
+        solution = solution_text(cdk_messages)
+        full_prompt, base_messages = cdk_prompt1, cdk_messages[:]
+        mode, previous_project, diff = plan_regeneration("cdk", solution)
+        if mode == "incremental":
+            # Only the changed files are generated and layered over the previous project
+            cdk_prompt1 = cdk_update_prompt(previous_project, diff)
+            cdk_messages = prompts_to_messages(cdk_prompt1)
+        else:
+            cdk_messages.append({"role": "user", "content": cdk_prompt1})
+
+        deploy_commands = previous_project["deploy_commands"] if previous_project else []
+        files, removed_paths, complete = [], [], True
+        if mode != "reuse":
+            files, removed_paths, deploy_commands, complete, responded = request_cdk_files(
+                cdk_messages, cdk_prompt1, deploy_commands)
+            if mode == "incremental" and not responded:
+                # The update produced nothing: regenerate the whole project instead of recording the stale one
+                print("Incremental CDK update returned no response, regenerating the full project")
+                previous_project = None
+                cdk_prompt1 = full_prompt
+                cdk_messages = base_messages + [{"role": "user", "content": cdk_prompt1}]
+                files, removed_paths, deploy_commands, complete, responded = request_cdk_files(
+                    cdk_messages, cdk_prompt1, [])
+            if not complete:
+                st.error("Reached maximum number of attempts. Final result is incomplete. Please try again.")
+
+        if previous_project:
+            files = [{"path": path, "content": content} for path, content in previous_project["tree"].items()] + files
+        if not files:
+            del st.session_state.cdk_messages[-1]
+            return
 
-        # Invoke the Bedrock model to get the CDK response
-        cdk_response, stop_reason = invoke_bedrock_model_streaming(cdk_messages)
-        st.session_state.cdk_messages.append({"role": "assistant", "content": cdk_response})
+        project_tree = build_project_tree(files)
+        for path in map(normalize_path, removed_paths):
+            project_tree.pop(path, None)
+        if complete:
+            # An incomplete project must not become the base of the next incremental update
+            record_artifact("cdk", solution, {"tree": project_tree, "deploy_commands": deploy_commands})
 
-        # Display the CDK response
+        cdk_output = {
+            "files": [{"path": path, "content": content} for path, content in sorted(project_tree.items())],
+            "deploy_commands": deploy_commands,
+        }
+        cdk_response = cdk_to_markdown(cdk_output)
+        st.session_state.cdk_messages.append({"role": "assistant", "content": store_artifact(cdk_response)})
+
+        # Display the CDK project file by file
         with st.container(height=350):
-            st.markdown(cdk_response)
+            for file in cdk_output["files"]:
+                st.markdown(f"**{file['path']}**")
+                st.code(file["content"], language=code_language(file["path"]))
+            st.code("\n".join(cdk_output["deploy_commands"]), language="bash")
 
-        st.session_state.interaction.append({"type": "CDK Template", "details": cdk_response})
+        st.session_state.interaction.append({"type": "CDK Template", "details": store_artifact(cdk_response)})
         store_in_s3(content=cdk_response, content_type='cdk')
         save_conversation(st.session_state['conversation_id'], cdk_prompt1, cdk_response)
-        collect_feedback(str(uuid.uuid4()), cdk_response, "generate_cdk", BEDROCK_MODEL_ID)
+        collect_feedback(str(uuid.uuid4()), cdk_response, "generate_cdk", bedrock_model_id())
+
+        # Stream the project as a zip into the conversation prefix and hand it out through a presigned URL
+        S3_BUCKET_NAME = get_config().s3_bucket_name
+        object_name = f"{st.session_state['conversation_id']}/cdk-project.zip"
+        with S3StreamWriter(S3_BUCKET_NAME, object_name, content_type="application/zip") as writer:
+            write_project_zip(project_tree, writer)
+        st.link_button("Download CDK project (.zip)", create_presigned_download_url(object_name))
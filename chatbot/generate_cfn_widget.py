@@ -1,23 +1,130 @@
 import os
-import boto3
+import json
+import yaml
 import streamlit as st
-import get_code_from_markdown
-from botocore.config import Config
-from utils import BEDROCK_MODEL_ID
-from utils import invoke_bedrock_model_streaming
-from utils import retrieve_environment_variables
+from aws_clients import get_client
+from app_config import get_config
+from utils import bedrock_model_id
+from utils import invoke_bedrock_model_structured
 from utils import store_in_s3
 from utils import save_conversation
 from utils import collect_feedback
+from utils import prompts_to_messages
+from utils import cancel_generation_jobs
+from artifact_store import store_artifact
+from cfn_validation import validate_template
+from cfn_validation import apply_template_patch
+from cfn_validation import TEMPLATE_SECTIONS
+from incremental import solution_text
+from incremental import plan_regeneration
+from incremental import record_artifact
+from incremental import forget_artifact
+from incremental import incremental_prompt
 import uuid
 
 AWS_REGION = os.getenv("AWS_REGION")
 
-config = Config(read_timeout=1000, retries=(dict(max_attempts=5)))
-s3_client = boto3.client('s3', region_name=AWS_REGION)
-dynamodb_resource = boto3.resource('dynamodb', region_name=AWS_REGION)
-bedrock_agent_runtime_client = boto3.client('bedrock-agent-runtime', region_name=AWS_REGION)
-bedrock_client = boto3.client('bedrock-runtime', region_name=AWS_REGION, config=config)
+CFN_TOOL = {
+    "name": "cloudformation_template",
+    "description": "Return the CloudFormation template for the solution and the commands to deploy it.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "template": {"type": "string", "description": "Complete CloudFormation template in YAML"},
+            "deploy_commands": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "AWS CLI commands to deploy the template"
+            },
+        },
+        "required": ["template", "deploy_commands"],
+    },
+}
+
+CFN_PATCH_TOOL = {
+    "name": "cloudformation_template_patch",
+    "description": "Return only the CloudFormation template elements that change for the refined solution.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "upsert": {
+                "type": "array",
+                "description": "New or modified template elements",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "section": {"type": "string", "enum": TEMPLATE_SECTIONS},
+                        "logical_id": {"type": "string"},
+                        "definition": {"type": "string", "description": "Complete YAML body of the element"},
+                    },
+                    "required": ["section", "logical_id", "definition"],
+                },
+            },
+            "remove": {
+                "type": "array",
+                "description": "Template elements that are no longer needed",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "section": {"type": "string", "enum": TEMPLATE_SECTIONS},
+                        "logical_id": {"type": "string"},
+                    },
+                    "required": ["section", "logical_id"],
+                },
+            },
+            "deploy_commands": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "AWS CLI commands to deploy the template"
+            },
+        },
+        "required": ["upsert", "remove", "deploy_commands"],
+    },
+}
+
+
+def cfn_to_markdown(cfn_output):
+    deploy_commands = "\n".join(cfn_output["deploy_commands"])
+    return f"```yaml\n{cfn_output['template']}\n```\n\n```bash\n{deploy_commands}\n```\n"
+
+
+def repair_cfn(cfn_output, errors):
+    # A single targeted repair call: the model only has to fix the reported problems, not regenerate the solution
+    error_list = "\n".join(f"- {error}" for error in errors)
+    repair_prompt = f"""
+    La siguiente plantilla de CloudFormation tiene errores de validación.
+    Corrige únicamente estos errores y conserva el resto de la plantilla sin cambios:
+    {error_list}
+
+    <TEMPLATE>
+    {cfn_output['template']}
+    </TEMPLATE>
+
+    Entrega la plantilla corregida completa con la herramienta cloudformation_template.
+    Conserva los mismos comandos de despliegue: {json.dumps(cfn_output['deploy_commands'], ensure_ascii=False)}
+    """
+    repaired_output, stop_reason = invoke_bedrock_model_structured(prompts_to_messages(repair_prompt), CFN_TOOL, owner="cfn")
+    return repaired_output or cfn_output
+
+
+def update_cfn(previous_output, diff):
+    # Only the affected resources, parameters or outputs are generated and merged into the previous template
+    patch_prompt = incremental_prompt(
+        "la plantilla de CloudFormation",
+        previous_output["template"],
+        diff,
+        """Entrega con la herramienta cloudformation_template_patch únicamente los elementos de la plantilla
+    (Parameters, Mappings, Conditions, Resources u Outputs) que se agregan o cambian, con su definición YAML completa,
+    y los elementos que ya no son necesarios. Incluye los comandos de despliegue actualizados.""")
+    patch, stop_reason = invoke_bedrock_model_structured(prompts_to_messages(patch_prompt), CFN_PATCH_TOOL, owner="cfn")
+    if patch is None:
+        return None
+    try:
+        template = apply_template_patch(previous_output["template"], patch)
+    except (yaml.YAMLError, AttributeError, KeyError, TypeError) as e:
+        print(f"Could not apply the CloudFormation template patch: {e}")
+        return None
+    return {"template": template, "deploy_commands": patch["deploy_commands"] or previous_output["deploy_commands"]}
 
 
 # Generate CFN
@@ -48,6 +155,9 @@ def generate_cfn(cfn_messages):
         # Only update the session state when the checkbox value changes
         if select_cfn != st.session_state.cfn_user_select:
             st.session_state.cfn_user_select = select_cfn
+            if not select_cfn:
+                # Unticked mid-generation: stop the stream instead of paying for tokens nobody reads
+                cancel_generation_jobs("cfn")
         st.markdown("</div>", unsafe_allow_html=True)
 
     with right:
@@ -55,6 +165,7 @@ def generate_cfn(cfn_messages):
             st.markdown("<div class=stButton gen-style'>", unsafe_allow_html=True)
             if st.button(label="⟳ Retry", key="retry-cfn", type="secondary"):
                 st.session_state.cfn_user_select = True  # Probably redundant
+                forget_artifact("cfn")
             st.markdown("</div>", unsafe_allow_html=True)
 
     if st.session_state.cfn_user_select:
@@ -63,29 +174,55 @@ def generate_cfn(cfn_messages):
         Proporciona el código fuente real para todos los jobs cuando corresponda.
         La plantilla de CloudFormation debe aprovisionar todos los recursos y componentes.
         Si se necesita código en Python, genera un ejemplo "Hello, World!".
-        Al final, genera comandos de ejemplo para desplegar la plantilla de CloudFormation.
-        """ 
-
-        cfn_messages.append({"role": "user", "content": cfn_prompt})
-
-        cfn_response, stop_reason = invoke_bedrock_model_streaming(cfn_messages)
-        st.session_state.cfn_messages.append({"role": "assistant", "content": cfn_response})
-
-        cfn_yaml = get_code_from_markdown.get_code_from_markdown(cfn_response, language="yaml")[0]
+        Incluye también comandos de ejemplo para desplegar la plantilla de CloudFormation.
+        Entrega el resultado con la herramienta cloudformation_template, sin explicaciones adicionales.
+        """
+
+        solution = solution_text(cfn_messages)
+        mode, cfn_output, diff = plan_regeneration("cfn", solution)
+        if mode == "incremental":
+            cfn_output = update_cfn(cfn_output, diff)
+        if cfn_output is None:
+            cfn_messages.append({"role": "user", "content": cfn_prompt})
+            cfn_output, stop_reason = invoke_bedrock_model_structured(cfn_messages, CFN_TOOL, owner="cfn")
+        if cfn_output is None:
+            st.error("The generated CloudFormation template is incomplete. Please try again.")
+            return
+
+        validation = validate_template(cfn_output["template"])
+        if validation["errors"]:
+            print(f"CloudFormation template {validation['hash']} failed validation: {validation['errors']}")
+            cfn_output = repair_cfn(cfn_output, validation["errors"])
+            validation = validate_template(cfn_output["template"])
+        if not validation["errors"]:
+            record_artifact("cfn", solution, cfn_output)
+
+        cfn_yaml = cfn_output["template"]
+        cfn_response = cfn_to_markdown(cfn_output)
+        st.session_state.cfn_messages.append({"role": "assistant", "content": store_artifact(cfn_response)})
 
         with st.container(height=350):
-            st.markdown(cfn_response)
+            st.code(cfn_yaml, language="yaml")
+            st.code("\n".join(cfn_output["deploy_commands"]), language="bash")
 
-        S3_BUCKET_NAME = retrieve_environment_variables("S3_BUCKET_NAME")
+        if validation["warnings"]:
+            st.warning("\n".join(f"- {warning}" for warning in validation["warnings"]))
 
-        st.session_state.interaction.append({"type": "CloudFormation Template", "details": cfn_response})
+        S3_BUCKET_NAME = get_config().s3_bucket_name
+
+        st.session_state.interaction.append({"type": "CloudFormation Template", "details": store_artifact(cfn_response)})
         store_in_s3(content=cfn_response, content_type='cfn')
         save_conversation(st.session_state['conversation_id'], cfn_prompt, cfn_response)
-        collect_feedback(str(uuid.uuid4()), cfn_response, "generate_cfn", BEDROCK_MODEL_ID)
+        collect_feedback(str(uuid.uuid4()), cfn_response, "generate_cfn", bedrock_model_id())
+
+        if validation["errors"]:
+            st.error("The generated template failed local validation, review it before deploying:\n\n" +
+                     "\n".join(f"- {error}" for error in validation["errors"]))
+            return
 
         # Write CFN template to S3 bucket and provide a button to launch the stack in the console
         object_name = f"{st.session_state['conversation_id']}/template.yaml"
-        s3_client.put_object(Body=cfn_yaml, Bucket=S3_BUCKET_NAME, Key=object_name)
+        get_client("s3").put_object(Body=cfn_yaml, Bucket=S3_BUCKET_NAME, Key=object_name)
         template_object_url = f"https://s3.amazonaws.com/{S3_BUCKET_NAME}/{object_name}"
 
         st.write("Click the below button to deploy the generated solution in your AWS account")
@@ -1,10 +1,20 @@
 import uuid
 import streamlit as st
-from utils import BEDROCK_MODEL_ID
+from utils import bedrock_model_id
 from utils import store_in_s3
 from utils import save_conversation
 from utils import collect_feedback
 from utils import invoke_bedrock_model_streaming
+from utils import prompts_to_messages
+from utils import cancel_generation_jobs
+from artifact_store import store_artifact
+from incremental import REMOVED_SECTION
+from incremental import solution_text
+from incremental import plan_regeneration
+from incremental import record_artifact
+from incremental import forget_artifact
+from incremental import incremental_prompt
+from incremental import merge_sections
 
 
 # Generate documentation
@@ -36,6 +46,9 @@ def generate_doc(doc_messages):
         # Only update the session state when the checkbox value changes
         if select_doc != st.session_state.doc_user_select:
             st.session_state.doc_user_select = select_doc
+            if not select_doc:
+                # Unticked mid-generation: stop the stream instead of paying for tokens nobody reads
+                cancel_generation_jobs("doc")
         st.markdown("</div>", unsafe_allow_html=True)
 
     with right:
@@ -43,6 +56,7 @@ def generate_doc(doc_messages):
             st.markdown("<div class=stButton gen-style'>", unsafe_allow_html=True)
             if st.button(label="⟳ Retry", key="retry-doc", type="secondary"):
                 st.session_state.doc_user_select = True  # Probably redundant
+                forget_artifact("doc")
             st.markdown("</div>", unsafe_allow_html=True)
 
     if st.session_state.doc_user_select:
@@ -52,15 +66,28 @@ def generate_doc(doc_messages):
         """ 
 
         st.session_state.doc_messages.append({"role": "user", "content": doc_prompt})
-        doc_messages.append({"role": "user", "content": doc_prompt})
-
-        doc_response, stop_reason = invoke_bedrock_model_streaming(doc_messages)
-        st.session_state.doc_messages.append({"role": "assistant", "content": doc_response})
+        solution = solution_text(doc_messages)
+        mode, doc_response, diff = plan_regeneration("doc", solution)
+        if mode == "incremental":
+            # Only the affected sections are rewritten and merged into the previous documentation
+            section_prompt = incremental_prompt(
+                "la documentación técnica",
+                doc_response,
+                diff,
+                f"""Responde únicamente con las secciones (encabezados de nivel 1 o 2) que se agregan o cambian, cada una completa
+        y con su encabezado exacto. Para eliminar una sección escribe su encabezado y como contenido solo {REMOVED_SECTION}.""")
+            section_response, stop_reason = invoke_bedrock_model_streaming(prompts_to_messages(section_prompt), owner="doc")
+            doc_response = merge_sections(doc_response, section_response)
+        elif mode == "full":
+            doc_messages.append({"role": "user", "content": doc_prompt})
+            doc_response, stop_reason = invoke_bedrock_model_streaming(doc_messages, owner="doc")
+        record_artifact("doc", solution, doc_response)
+        st.session_state.doc_messages.append({"role": "assistant", "content": store_artifact(doc_response)})
 
         with st.container(height=350):
             st.markdown(doc_response)
 
-        st.session_state.interaction.append({"type": "Technical documentation", "details": doc_response})
+        st.session_state.interaction.append({"type": "Technical documentation", "details": store_artifact(doc_response)})
         store_in_s3(content=doc_response, content_type='documentation')
         save_conversation(st.session_state['conversation_id'], doc_prompt, doc_response)
-        collect_feedback(str(uuid.uuid4()), doc_response, "generate_documentation", BEDROCK_MODEL_ID)
+        collect_feedback(str(uuid.uuid4()), doc_response, "generate_documentation", bedrock_model_id())
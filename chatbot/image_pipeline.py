@@ -0,0 +1,89 @@
+import io
+import math
+from PIL import Image
+from PIL import ImageOps
+
+# Claude vision works best at up to 1568 px on the long edge and ~1.15 megapixels; larger images are
+# downscaled by the service anyway, so sending them only adds upload time and latency
+MAX_LONG_EDGE = 1568
+MAX_PIXELS = 1_150_000
+# Bedrock rejects images above 3.75 MB
+MAX_IMAGE_BYTES = 3_750_000
+JPEG_QUALITIES = [90, 85, 80, 75, 70, 60, 50]
+# Diagrams and screenshots have few distinct colors and compress better (and stay sharper) as PNG
+PNG_MAX_COLORS = 256
+SUPPORTED_FORMATS = {"PNG": "png", "JPEG": "jpeg", "GIF": "gif", "WEBP": "webp"}
+EXIF_ORIENTATION = 0x0112
+
+
+def target_size(width, height):
+    """Largest size with the same aspect ratio that fits the long edge and pixel limits."""
+    scale = min(1.0, MAX_LONG_EDGE / max(width, height), math.sqrt(MAX_PIXELS / (width * height)))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _has_alpha(image):
+    return image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+
+
+def _encode(image, image_format, **params):
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, **params)
+    return buffer.getvalue()
+
+
+def _flatten(image):
+    # JPEG has no alpha channel: composite transparent areas over white, as diagram tools render them
+    if not _has_alpha(image):
+        return image.convert("RGB")
+    rgba = image.convert("RGBA")
+    background = Image.new("RGB", rgba.size, (255, 255, 255))
+    background.paste(rgba, mask=rgba.getchannel("A"))
+    return background
+
+
+def normalize_image(image_data):
+    """
+    Prepare an uploaded image for the Bedrock vision models.
+
+    The image is decoded once (JPEG files are decoded directly at a reduced scale), rotated according to its
+    EXIF orientation and downscaled in a single Lanczos step to the model's optimal size, keeping the aspect ratio.
+    Images that already fit are passed through untouched. Otherwise lossless PNG is used for images with
+    transparency or few colors and JPEG, with the highest quality that fits the byte budget, for photos.
+
+    Args:
+        image_data: Raw bytes of the uploaded image
+
+    Returns:
+        dict with "bytes", "format" (as expected by the Converse API), "width" and "height"
+    """
+    image = Image.open(io.BytesIO(image_data))
+    source_format = image.format
+    rotated = image.getexif().get(EXIF_ORIENTATION, 1) != 1
+    size = target_size(*image.size)
+    if (source_format in SUPPORTED_FORMATS and not rotated and size == image.size
+            and len(image_data) <= MAX_IMAGE_BYTES and not getattr(image, "is_animated", False)):
+        return {"bytes": image_data, "format": SUPPORTED_FORMATS[source_format], "width": size[0], "height": size[1]}
+
+    if source_format == "JPEG":
+        image.draft("RGB", size)
+    if rotated:
+        image = ImageOps.exif_transpose(image)
+    size = target_size(*image.size)
+    if size != image.size:
+        if image.mode not in ("RGB", "RGBA", "L", "LA"):
+            image = image.convert("RGBA" if _has_alpha(image) else "RGB")
+        image = image.resize(size, Image.LANCZOS)
+
+    if _has_alpha(image) or image.getcolors(maxcolors=PNG_MAX_COLORS) is not None:
+        encoded = _encode(image, "PNG", optimize=False, compress_level=6)
+        if len(encoded) <= MAX_IMAGE_BYTES:
+            return {"bytes": encoded, "format": "png", "width": size[0], "height": size[1]}
+
+    image = _flatten(image)
+    for quality in JPEG_QUALITIES:
+        # Full chroma resolution at high quality keeps thin colored marker strokes legible
+        encoded = _encode(image, "JPEG", quality=quality, optimize=True, subsampling=0 if quality >= 85 else 2)
+        if len(encoded) <= MAX_IMAGE_BYTES:
+            break
+    return {"bytes": encoded, "format": "jpeg", "width": size[0], "height": size[1]}
@@ -0,0 +1,118 @@
+import difflib
+import json
+import re
+import streamlit as st
+from artifact_store import store_artifact
+from artifact_store import load_artifact
+
+# Above this share of changed lines a refinement is treated as a new solution and regenerated from scratch
+INCREMENTAL_MAX_CHANGE = 0.5
+MARKDOWN_HEADING = re.compile(r"^#{1,2}\s+\S")  # Top level sections only, subsections travel with them
+REMOVED_SECTION = "ELIMINAR"
+
+
+def solution_text(messages):
+    return "\n".join(message['content'] for message in messages if message['role'] == 'assistant')
+
+
+def solution_diff(previous, current):
+    return "\n".join(difflib.unified_diff(
+        previous.splitlines(), current.splitlines(), "solución anterior", "solución actual", n=1, lineterm=""))
+
+
+def change_ratio(previous, current):
+    return 1 - difflib.SequenceMatcher(None, previous.splitlines(), current.splitlines(), autojunk=False).ratio()
+
+
+def record_artifact(name, solution, artifact):
+    """
+    Remember the artifact generated for a solution so later refinements can be applied incrementally.
+
+    The solution and the artifact (JSON encoded, it may be a dict or a list) go to the session artifact store:
+    the session state only keeps their references, so each text is held once and counts in the session budget.
+    """
+    if 'artifact_versions' not in st.session_state:
+        st.session_state.artifact_versions = {}
+    st.session_state.artifact_versions[name] = {
+        "solution": store_artifact(solution),
+        "artifact": store_artifact(json.dumps(artifact, ensure_ascii=False, default=str)),
+    }
+
+
+def forget_artifact(name):
+    st.session_state.get('artifact_versions', {}).pop(name, None)
+
+
+def plan_regeneration(name, solution):
+    """
+    Decide how to bring an artifact up to date with the current solution.
+
+    Returns:
+        ("full", None, None) when there is no usable previous artifact,
+        ("reuse", artifact, None) when the solution did not change, or
+        ("incremental", artifact, diff) when only part of the solution changed
+    """
+    previous = st.session_state.get('artifact_versions', {}).get(name)
+    if previous is None:
+        return "full", None, None
+    try:
+        artifact = json.loads(load_artifact(previous["artifact"]))
+    except ValueError:
+        # The stored artifact is no longer available (see load_artifact)
+        return "full", None, None
+    previous_solution = load_artifact(previous["solution"])
+    if previous_solution == solution:
+        return "reuse", artifact, None
+    if change_ratio(previous_solution, solution) > INCREMENTAL_MAX_CHANGE:
+        return "full", None, None
+    return "incremental", artifact, solution_diff(previous_solution, solution)
+
+
+def incremental_prompt(artifact_description, previous_artifact, diff, instructions):
+    return f"""
+    La solución fue refinada. A continuación están {artifact_description} generado para la solución anterior
+    y los cambios realizados en la solución (formato diff unificado).
+    No regeneres desde cero: actualiza únicamente las partes afectadas por los cambios y conserva el resto.
+
+    <PREVIOUS ARTIFACT>
+    {previous_artifact}
+    </PREVIOUS ARTIFACT>
+
+    <SOLUTION CHANGES>
+    {diff}
+    </SOLUTION CHANGES>
+
+    {instructions}
+    """
+
+
+def split_sections(markdown):
+    """Split a markdown document into [heading, body] pairs; text before the first heading has an empty heading."""
+    sections = [["", []]]
+    for line in markdown.splitlines():
+        if MARKDOWN_HEADING.match(line):
+            sections.append([line.strip(), []])
+        else:
+            sections[-1][1].append(line)
+    return [(heading, "\n".join(body)) for heading, body in sections if heading or any(body)]
+
+
+def merge_sections(previous, updated):
+    """
+    Merge the sections returned by an incremental update into the previous document.
+
+    Sections are matched by their exact heading: matching sections are replaced, sections whose body is
+    REMOVED_SECTION are dropped and new sections are appended at the end.
+    """
+    sections = {}
+    for heading, body in split_sections(previous):
+        # A repeated heading is folded into the first section with that heading so no content is lost
+        sections[heading] = f"{sections[heading]}\n{heading}\n{body}" if heading in sections else body
+    for heading, body in split_sections(updated):
+        if not heading:
+            continue  # Text outside of a section is commentary from the model
+        if body.strip() == REMOVED_SECTION:
+            sections.pop(heading, None)
+        else:
+            sections[heading] = body
+    return "\n".join(f"{heading}\n{body}" if heading else body for heading, body in sections.items())
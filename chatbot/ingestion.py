@@ -0,0 +1,171 @@
+import hashlib
+import threading
+import time
+from botocore.exceptions import ClientError
+
+# Uploads that arrive within this window are indexed by the same ingestion job
+INGESTION_BATCH_DELAY = 5
+INGESTION_POLL_INTERVAL = 10
+# A Knowledge Base data source only runs one ingestion job at a time
+MAX_CONCURRENT_INGESTION_JOBS = 1
+CONTENT_HASH_METADATA = "content-sha256"
+FINISHED_JOB_STATUSES = {"COMPLETE", "FAILED", "STOPPED"}
+
+
+def content_hash(fileobj, chunk_size=1024 * 1024):
+    """SHA-256 of a seekable binary stream, read in chunks and rewound afterwards."""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+class IngestionCoordinator:
+    """
+    Batches uploaded documents into Knowledge Base ingestion jobs and tracks their progress.
+
+    Documents are registered after they are uploaded to the data source bucket. Registrations are grouped
+    for INGESTION_BATCH_DELAY seconds and then picked up by a single start_ingestion_job call, keeping at most
+    max_concurrent_jobs jobs running. Running jobs are polled with get_ingestion_job and their statistics are
+    accumulated for display.
+
+    The clients are injected so the coordinator can run against stubbed bedrock-agent and S3 clients, and
+    run_once performs a single scheduling step without the background thread.
+    """
+
+    def __init__(self, bedrock_agent_client, s3_client, bucket, knowledge_base_id, data_source_id,
+                 max_concurrent_jobs=MAX_CONCURRENT_INGESTION_JOBS, batch_delay=INGESTION_BATCH_DELAY,
+                 poll_interval=INGESTION_POLL_INTERVAL, clock=time.monotonic):
+        self.bedrock_agent_client = bedrock_agent_client
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.knowledge_base_id = knowledge_base_id
+        self.data_source_id = data_source_id
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.batch_delay = batch_delay
+        self.poll_interval = poll_interval
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pending = set()
+        self._last_registered = None
+        self._retry_after = 0
+        self._running_jobs = {}  # ingestion job id -> documents in the batch
+        self.stats = {"indexed": 0, "failed": 0, "skipped": 0, "deleted": 0, "jobs": 0, "last_status": None}
+
+    def is_unchanged(self, key, sha256):
+        """True when the object already in the bucket was uploaded from identical content."""
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return response.get("Metadata", {}).get(CONTENT_HASH_METADATA) == sha256
+
+    def skip(self, key):
+        with self._lock:
+            self.stats["skipped"] += 1
+        print(f"Skipping ingestion of unchanged document {key}")
+
+    def register(self, key):
+        """Queue an uploaded document for the next ingestion job."""
+        with self._lock:
+            self._pending.add(key)
+            self._last_registered = self.clock()
+        self._wakeup.set()
+
+    def status(self):
+        with self._lock:
+            return {
+                **self.stats,
+                "pending": len(self._pending),
+                "in_progress": sum(len(documents) for documents in self._running_jobs.values()),
+            }
+
+    def _start_job(self):
+        with self._lock:
+            batch = self._pending
+            self._pending = set()
+        try:
+            response = self.bedrock_agent_client.start_ingestion_job(
+                knowledgeBaseId=self.knowledge_base_id, dataSourceId=self.data_source_id,
+                description=f"{len(batch)} uploaded document(s)")
+        except ClientError as e:
+            # ConflictException: a job started elsewhere (another task or the console) is still running
+            print(f"Could not start ingestion job, retrying later: {e}")
+            with self._lock:
+                self._pending |= batch
+                self._retry_after = self.clock() + self.poll_interval
+            return
+        job = response["ingestionJob"]
+        print(f"Started ingestion job {job['ingestionJobId']} for {len(batch)} document(s)")
+        with self._lock:
+            self._running_jobs[job["ingestionJobId"]] = batch
+            self.stats["jobs"] += 1
+            self.stats["last_status"] = job["status"]
+
+    def _poll_jobs(self):
+        with self._lock:
+            job_ids = list(self._running_jobs)
+        for job_id in job_ids:
+            try:
+                job = self.bedrock_agent_client.get_ingestion_job(
+                    knowledgeBaseId=self.knowledge_base_id, dataSourceId=self.data_source_id,
+                    ingestionJobId=job_id)["ingestionJob"]
+            except ClientError as e:
+                print(f"Could not poll ingestion job {job_id}: {e}")
+                continue
+            with self._lock:
+                self.stats["last_status"] = job["status"]
+                if job["status"] not in FINISHED_JOB_STATUSES:
+                    continue
+                del self._running_jobs[job_id]
+                statistics = job.get("statistics", {})
+                self.stats["indexed"] += (statistics.get("numberOfNewDocumentsIndexed", 0) +
+                                          statistics.get("numberOfModifiedDocumentsIndexed", 0))
+                self.stats["failed"] += statistics.get("numberOfDocumentsFailed", 0)
+                self.stats["deleted"] += statistics.get("numberOfDocumentsDeleted", 0)
+            print(f"Ingestion job {job_id} finished with status {job['status']}: {statistics}")
+
+    def run_once(self):
+        """Poll the running jobs and start a new one if a batch is ready and a slot is free."""
+        self._poll_jobs()
+        with self._lock:
+            now = self.clock()
+            batch_ready = (self._pending and now - self._last_registered >= self.batch_delay
+                           and now >= self._retry_after)
+            slot_free = len(self._running_jobs) < self.max_concurrent_jobs
+        if batch_ready and slot_free:
+            self._start_job()
+
+    def _next_wait(self):
+        # Seconds until the next scheduling step, None to sleep until a document is registered
+        with self._lock:
+            if self._running_jobs:
+                return self.poll_interval
+            if self._pending:
+                ready_at = max(self._last_registered + self.batch_delay, self._retry_after)
+                return max(0, ready_at - self.clock())
+            return None
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(timeout=self._next_wait())
+            self._wakeup.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Ingestion coordinator error: {e}")
+
+    def start(self):
+        """Run the scheduling loop on a daemon thread; it sleeps until documents are registered."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="kb-ingestion", daemon=True)
+                self._thread.start()
+        return self
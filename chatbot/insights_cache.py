@@ -0,0 +1,221 @@
+import base64
+import datetime
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from PIL import Image
+from PIL import ImageChops
+from PIL import ImageStat
+from botocore.exceptions import ClientError
+from aws_clients import get_client
+from app_config import get_config
+
+INSIGHTS_CACHE_PREFIX = "image-insights-cache"
+INSIGHTS_CACHE_DIR = Path(os.getenv("IMAGE_INSIGHTS_CACHE_DIR", Path(tempfile.gettempdir()) / "devgenius-image-insights"))
+# Two uploads whose 64-bit difference hashes differ in at most this many bits are candidate near-duplicates
+# (re-exports, screenshots at another zoom level, recompression). dHash cannot tell apart diagrams with the
+# same layout and different labels, so a candidate is only served after comparing the normalized images.
+NEAR_DUPLICATE_DISTANCE = 6
+DHASH_SIZE = 8
+# Images are compared as NORMALIZED_SIZE grayscale squares, tile by tile: a different label changes one tile a lot
+# while a recompression or rescale changes every tile a little. Measured on rendered architecture diagrams, a
+# relabelled diagram differs by about 5 in its worst tile, a rescaled or JPEG re-encoded copy by less than 1.
+NORMALIZED_SIZE = 256
+SIMILARITY_TILE = 16
+MAX_TILE_DIFFERENCE = 2.5
+# Perceptual hashes of the entries in S3 are listed once per namespace and refreshed after this many seconds,
+# to pick up the analyses stored by the other replicas
+HASH_INDEX_TTL = 600
+
+_hash_indexes = {}
+_hash_indexes_lock = threading.Lock()
+
+
+def content_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image_bytes):
+    """64-bit difference hash (dHash) as 16 hex digits: compares the brightness of horizontally adjacent pixels."""
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft("L", (DHASH_SIZE + 1, DHASH_SIZE))
+    pixels = list(image.convert("L").resize((DHASH_SIZE + 1, DHASH_SIZE), Image.LANCZOS).getdata())
+    bits = 0
+    for row in range(DHASH_SIZE):
+        for col in range(DHASH_SIZE):
+            left = pixels[row * (DHASH_SIZE + 1) + col]
+            right = pixels[row * (DHASH_SIZE + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:016x}"
+
+
+def normalized_image(image_bytes):
+    """The image as a NORMALIZED_SIZE square in grayscale, PNG encoded."""
+    image = Image.open(io.BytesIO(image_bytes)).convert("L").resize((NORMALIZED_SIZE, NORMALIZED_SIZE), Image.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, "PNG")
+    return output.getvalue()
+
+
+def same_image(normalized, other):
+    """
+    Whether two normalized images show the same diagram.
+
+    Args:
+        normalized: PNG bytes from normalized_image
+        other: PNG bytes from normalized_image
+
+    Returns:
+        True when no tile of the images differs by more than MAX_TILE_DIFFERENCE on average
+    """
+    difference = ImageChops.difference(Image.open(io.BytesIO(normalized)), Image.open(io.BytesIO(other)))
+    for top in range(0, NORMALIZED_SIZE, SIMILARITY_TILE):
+        for left in range(0, NORMALIZED_SIZE, SIMILARITY_TILE):
+            tile = difference.crop((left, top, left + SIMILARITY_TILE, top + SIMILARITY_TILE))
+            if ImageStat.Stat(tile).mean[0] > MAX_TILE_DIFFERENCE:
+                return False
+    return True
+
+
+def hamming_distance(phash, other):
+    return bin(int(phash, 16) ^ int(other, 16)).count("1")
+
+
+def cache_namespace(model_id, query):
+    # A new model or prompt must not serve analyses produced by the previous one
+    return hashlib.sha256(f"{model_id}\n{query}".encode("utf-8")).hexdigest()[:12]
+
+
+class ImageInsightsCache:
+    """
+    Two-tier cache of image analyses: a local disk tier in front of S3.
+
+    Entries are stored as <namespace>/<phash>/<sha256>.json so an exact upload is a single lookup. Near-duplicates
+    are found in an in-memory index of the perceptual hashes of the namespace and confirmed by comparing the
+    normalized images stored with the entries.
+    """
+
+    def __init__(self, namespace, bucket=None, cache_dir=INSIGHTS_CACHE_DIR):
+        self.namespace = namespace
+        self.bucket = bucket or get_config().s3_bucket_name
+        self.cache_dir = Path(cache_dir) / namespace
+
+    def _key(self, phash, sha256):
+        return f"{INSIGHTS_CACHE_PREFIX}/{self.namespace}/{phash}/{sha256}.json"
+
+    def _local_path(self, phash, sha256):
+        return self.cache_dir / phash / f"{sha256}.json"
+
+    def _read_local(self, path):
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _write_local(self, path, entry):
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_suffix(".tmp")
+            temp_path.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Could not write image insights to the local cache: {e}")
+
+    def _read_s3(self, key):
+        try:
+            response = get_client("s3").get_object(Bucket=self.bucket, Key=key)
+            return json.loads(response["Body"].read())
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                print(f"Could not read image insights from S3: {e}")
+            return None
+
+    def _list_hashes(self):
+        # Local entries, then the entries of every replica in S3: one listing per namespace and HASH_INDEX_TTL
+        hashes = set()
+        if self.cache_dir.is_dir():
+            hashes.update((path.parent.name, path.stem) for path in self.cache_dir.glob("*/*.json"))
+        prefix = f"{INSIGHTS_CACHE_PREFIX}/{self.namespace}/"
+        paginator = get_client("s3").get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                candidate_phash, _, file_name = item["Key"][len(prefix):].partition("/")
+                hashes.add((candidate_phash, file_name[:-len(".json")]))
+        return hashes
+
+    def _hash_index(self):
+        with _hash_indexes_lock:
+            index = _hash_indexes.get(self.namespace)
+            if index is not None and time.monotonic() - index["listed_at"] < HASH_INDEX_TTL:
+                return index["hashes"]
+        hashes = self._list_hashes()
+        with _hash_indexes_lock:
+            _hash_indexes[self.namespace] = {"hashes": hashes, "listed_at": time.monotonic()}
+        return hashes
+
+    def _index_entry(self, phash, sha256):
+        with _hash_indexes_lock:
+            index = _hash_indexes.get(self.namespace)
+            if index is not None:
+                index["hashes"].add((phash, sha256))
+
+    def _candidates(self, phash, sha256):
+        return [(candidate_phash, candidate_sha256) for candidate_phash, candidate_sha256 in self._hash_index()
+                if candidate_sha256 != sha256 and hamming_distance(candidate_phash, phash) <= NEAR_DUPLICATE_DISTANCE]
+
+    def get(self, image_bytes):
+        """
+        Look up the analysis of an image, trying the exact content hash first and then near-duplicates.
+
+        Returns:
+            The cached entry (dict with "insights", "sha256", "phash", "normalized", "created_at") or None
+        """
+        sha256 = content_hash(image_bytes)
+        phash = perceptual_hash(image_bytes)
+
+        entry = self._read_local(self._local_path(phash, sha256))
+        if entry is None:
+            entry = self._read_s3(self._key(phash, sha256))
+        if entry is None:
+            try:
+                candidates = self._candidates(phash, sha256)
+            except (ClientError, ValueError) as e:
+                print(f"Could not search the image insights cache: {e}")
+                candidates = []
+            normalized = normalized_image(image_bytes) if candidates else None
+            # Closest perceptual match first; entries stored without a normalized image only serve exact hits
+            for candidate_phash, candidate_sha256 in sorted(candidates, key=lambda c: hamming_distance(c[0], phash)):
+                candidate = self._read_local(self._local_path(candidate_phash, candidate_sha256)) or \
+                    self._read_s3(self._key(candidate_phash, candidate_sha256))
+                if candidate and candidate.get("normalized") and \
+                        same_image(normalized, base64.b64decode(candidate["normalized"])):
+                    entry = candidate
+                    break
+        if entry is not None:
+            self._write_local(self._local_path(phash, sha256), entry)
+        return entry
+
+    def put(self, image_bytes, insights):
+        sha256 = content_hash(image_bytes)
+        phash = perceptual_hash(image_bytes)
+        entry = {
+            "sha256": sha256,
+            "phash": phash,
+            "normalized": base64.b64encode(normalized_image(image_bytes)).decode("ascii"),
+            "insights": insights,
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+        self._write_local(self._local_path(phash, sha256), entry)
+        try:
+            get_client("s3").put_object(
+                Bucket=self.bucket, Key=self._key(phash, sha256),
+                Body=json.dumps(entry, ensure_ascii=False).encode("utf-8"), ContentType="application/json")
+        except ClientError as e:
+            print(f"Could not store image insights in S3: {e}")
+        self._index_entry(phash, sha256)
+        return entry
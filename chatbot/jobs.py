@@ -0,0 +1,258 @@
+import hashlib
+import json
+import queue
+import threading
+import time
+
+MAX_GENERATION_WORKERS = 8
+# Finished jobs are kept this long so a reconnecting browser can still collect the result
+JOB_RETENTION = 30 * 60
+JOB_POLL_INTERVAL = 0.25
+FINISHED_JOB_STATUSES = {"done", "failed", "cancelled"}
+# Rough size of a Claude output token, used to estimate the tokens saved by cancellations
+CHARS_PER_TOKEN = 4
+
+
+def job_key(scope, body):
+    """Deterministic job id: the same request from the same conversation always maps to the same job."""
+    payload = json.dumps(body, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(f"{scope}\n{payload}".encode("utf-8")).hexdigest()[:32]
+
+
+class CancellationToken:
+    """
+    Signals a running generation to stop.
+
+    Code holding a resource that should be released on cancellation (the HTTP stream of the model response)
+    registers a callback with on_cancel; cancel runs the callbacks right away on the cancelling thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled:
+                return False
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancellation callback failed: {e}")
+        return True
+
+
+class Job:
+    """A generation request and its partial output, updated by a worker thread as the model streams."""
+
+    def __init__(self, job_id, body):
+        self.id = job_id
+        self.body = body
+        self.token = CancellationToken()
+        self.status = "queued"
+        self.output = ""
+        self.stop_reason = None
+        self.error = None
+        self.delivered = False
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._changed = threading.Condition()
+
+    def _update(self, **changes):
+        with self._changed:
+            for name, value in changes.items():
+                setattr(self, name, value)
+            self._changed.notify_all()
+
+    def append(self, text):
+        with self._changed:
+            self.output += text
+            self._changed.notify_all()
+
+    def wait(self, seen_length, timeout=JOB_POLL_INTERVAL):
+        """Block until the output grows past seen_length or the job finishes, at most timeout seconds."""
+        with self._changed:
+            self._changed.wait_for(
+                lambda: len(self.output) != seen_length or self.status in FINISHED_JOB_STATUSES, timeout=timeout)
+            return self.status, self.output
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_JOB_STATUSES
+
+
+class JobService:
+    """
+    Process-level queue of model generations served by a fixed pool of worker threads.
+
+    A generation runs to completion on its worker regardless of what happens to the Streamlit script that asked
+    for it: reruns, widget interactions and browser reconnects only detach the viewer. The partial output is
+    checkpointed on the Job as it streams, so a viewer that re-attaches with the same job id sees everything
+    produced so far, and submitting a request that is already queued or running returns the existing job
+    instead of paying for a second generation.
+
+    Jobs can be cancelled while queued or running; the worker closes the model stream at once and moves on to
+    the next job. Queued and in-flight cancellations are counted separately in metrics, with the output tokens
+    saved estimated from the mean output of the completed jobs.
+
+    Args:
+        run: callable(body, token) yielding ("delta", text) and ("stop", stop_reason) events for a request body,
+            stopping early once the CancellationToken is cancelled
+        workers: number of generations running at the same time
+    """
+
+    def __init__(self, run, workers=MAX_GENERATION_WORKERS, retention=JOB_RETENTION):
+        self.run = run
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._queue = queue.Queue()
+        self.metrics = {"completed": 0, "completed_output_tokens": 0, "failed": 0, "cancelled_queued": 0,
+                        "cancelled_running": 0, "cancelled_output_tokens": 0, "cancelled_tokens_saved": 0}
+        self._workers = [threading.Thread(target=self._work, name=f"generation-worker-{i}", daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _prune(self):
+        # Called with the lock held
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def submit(self, job_id, body):
+        """
+        Queue a generation, or return the job already producing it.
+
+        A finished job is reused until its result has been delivered to a viewer; after that, submitting the
+        same request again (a "Retry" button) starts a new generation.
+        """
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(job_id)
+            if job is not None and job.status not in ("failed", "cancelled") and not job.delivered:
+                return job
+            job = Job(job_id, body)
+            self._jobs[job_id] = job
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job. Returns False if it is unknown or already finished."""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        return job.token.cancel()
+
+    def _record_completion(self, job):
+        with self._lock:
+            self.metrics["completed"] += 1
+            self.metrics["completed_output_tokens"] += len(job.output) // CHARS_PER_TOKEN
+
+    def _record_cancellation(self, job):
+        generated_tokens = len(job.output) // CHARS_PER_TOKEN
+        queued = job.started_at is None
+        with self._lock:
+            # Expected output length: the mean of the completed jobs, nothing is claimed before the first one
+            completed = self.metrics["completed"]
+            expected_tokens = self.metrics["completed_output_tokens"] // completed if completed else 0
+            saved_tokens = max(0, expected_tokens - generated_tokens)
+            self.metrics["cancelled_queued" if queued else "cancelled_running"] += 1
+            self.metrics["cancelled_output_tokens"] += generated_tokens
+            self.metrics["cancelled_tokens_saved"] += saved_tokens
+        print(f"Generation job {job.id} cancelled {'while queued' if queued else 'while running'} after "
+              f"~{generated_tokens} output tokens, ~{saved_tokens} tokens not generated")
+
+    def status(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"queued": self._queue.qsize(), "jobs": counts}
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if not job.token.cancelled:
+                    job._update(status="running", started_at=time.time())
+                    for event, value in self.run(job.body, job.token):
+                        if job.token.cancelled:
+                            break
+                        if event == "delta":
+                            job.append(value)
+                        elif event == "stop":
+                            job.stop_reason = value
+                if job.token.cancelled:
+                    self._record_cancellation(job)
+                    job._update(status="cancelled", stop_reason="cancelled", finished_at=time.time())
+                else:
+                    self._record_completion(job)
+                    job._update(status="done", finished_at=time.time())
+            except Exception as e:
+                if job.token.cancelled:
+                    # Closing the stream from another thread makes the read fail
+                    self._record_cancellation(job)
+                    job._update(status="cancelled", stop_reason="cancelled", finished_at=time.time())
+                else:
+                    print(f"Generation job {job.id} failed: {e}")
+                    with self._lock:
+                        self.metrics["failed"] += 1
+                    job._update(status="failed", error=e, finished_at=time.time())
+            finally:
+                self._queue.task_done()
+
+
+def follow_job(job, render, on_queued=None):
+    """
+    Stream the output of a job into the UI until it finishes.
+
+    Args:
+        job: Job returned by JobService.submit
+        render: callable(output) called whenever new output is available
+        on_queued: optional callable() called once while the job waits for a free worker
+
+    Returns:
+        (output, stop_reason); stop_reason is "cancelled" for a job cancelled while it was being followed
+
+    Raises:
+        The exception the generation failed with
+    """
+    seen_length = -1
+    queued_notice = False
+    while True:
+        status, output = job.wait(seen_length)
+        if status == "queued" and on_queued and not queued_notice:
+            on_queued()
+            queued_notice = True
+        if len(output) != seen_length:
+            render(output)
+            seen_length = len(output)
+        if status in FINISHED_JOB_STATUSES:
+            break
+    if job.status == "failed":
+        raise job.error
+    job.delivered = True
+    return job.output, job.stop_reason
@@ -0,0 +1,282 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from aws_clients import get_client
+
+# Same embedding model as the Knowledge Base (lib/index.ts); queries are only compared with each other, so the
+# smallest Titan v2 dimension is enough
+QUERY_EMBEDDING_MODEL = "amazon.titan-embed-text-v2:0"
+QUERY_EMBEDDING_DIMENSIONS = 256
+# Cosine similarity above which two queries share their retrieved chunks
+SIMILARITY_THRESHOLD = 0.92
+RETRIEVAL_CACHE_TTL = 6 * 3600
+RETRIEVAL_CACHE_MAX_ENTRIES = 5000
+# Random hyperplane LSH: every table hashes a vector to LSH_BITS sign bits; near neighbours share a bucket in
+# at least one of LSH_TABLES tables with high probability
+LSH_TABLES = 4
+LSH_BITS = 12
+# Ingestion jobs of the Knowledge Base data sources are checked at most this often
+INGESTION_CHECK_INTERVAL = 60
+
+
+def normalize_query(query):
+    """Case, accents, punctuation and whitespace folded away: "¿Qué es Amazon S3?" -> "que es amazon s3"."""
+    text = unicodedata.normalize("NFKD", query.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[^\w\s./-]", " ", text)
+    return " ".join(text.replace("-", " ").split()).strip(" .")
+
+
+def _unit(vector):
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def cosine(a, b):
+    # Both vectors are unit length
+    return sum(x * y for x, y in zip(a, b))
+
+
+class HyperplaneLSH:
+    """Approximate nearest neighbour index of unit vectors by random hyperplane hashing."""
+
+    def __init__(self, dimensions, tables=LSH_TABLES, bits=LSH_BITS, seed=0):
+        rng = random.Random(seed)
+        self._planes = [[[rng.gauss(0, 1) for _ in range(dimensions)] for _ in range(bits)] for _ in range(tables)]
+        self._buckets = [{} for _ in range(tables)]
+
+    def _signatures(self, vector):
+        return [sum(1 << bit for bit, plane in enumerate(planes) if cosine(plane, vector) >= 0)
+                for planes in self._planes]
+
+    def add(self, item_id, vector):
+        for buckets, signature in zip(self._buckets, self._signatures(vector)):
+            buckets.setdefault(signature, set()).add(item_id)
+
+    def remove(self, item_id, vector):
+        for buckets, signature in zip(self._buckets, self._signatures(vector)):
+            bucket = buckets.get(signature)
+            if bucket is not None:
+                bucket.discard(item_id)
+                if not bucket:
+                    del buckets[signature]
+
+    def candidates(self, vector):
+        found = set()
+        for buckets, signature in zip(self._buckets, self._signatures(vector)):
+            found |= buckets.get(signature, set())
+        return found
+
+    def clear(self):
+        for buckets in self._buckets:
+            buckets.clear()
+
+
+class IngestionWatermark:
+    """
+    Identifies the content of a Knowledge Base by the latest completed ingestion job of each data source.
+
+    It changes whenever an ingestion job completes, whether started by the kb_ds custom resource at deployment
+    or by the ingestion coordinator for uploaded documents.
+    """
+
+    def __init__(self, bedrock_agent_client, knowledge_base_id):
+        self.client = bedrock_agent_client
+        self.knowledge_base_id = knowledge_base_id
+
+    def current(self):
+        watermark = []
+        paginator = self.client.get_paginator("list_data_sources")
+        for page in paginator.paginate(knowledgeBaseId=self.knowledge_base_id):
+            for data_source in page["dataSourceSummaries"]:
+                jobs = self.client.list_ingestion_jobs(
+                    knowledgeBaseId=self.knowledge_base_id, dataSourceId=data_source["dataSourceId"],
+                    filters=[{"attribute": "STATUS", "operator": "EQ", "values": ["COMPLETE"]}],
+                    sortBy={"attribute": "STARTED_AT", "order": "DESCENDING"}, maxResults=1,
+                )["ingestionJobSummaries"]
+                latest = jobs[0]["ingestionJobId"] if jobs else None
+                watermark.append(f"{data_source['dataSourceId']}:{latest}")
+        return ",".join(sorted(watermark))
+
+
+class RetrievalCache:
+    """
+    Semantic cache of Knowledge Base retrievals.
+
+    A query is first looked up by its normalized text, which needs no embedding call. Otherwise it is embedded
+    and compared with the past queries that share an LSH bucket with it; the closest one above threshold serves
+    its retrieved chunks. Misses call the Knowledge Base and store the result.
+
+    Entries expire after ttl seconds and the whole cache is dropped when the ingestion watermark changes, so a
+    completed ingestion job is never hidden by chunks retrieved before it.
+
+    Args:
+        retrieve: callable(query, number_of_results) returning the list of retrieved chunks
+        embed: callable(text) returning the embedding of a query
+        watermark: optional IngestionWatermark
+    """
+
+    def __init__(self, retrieve, embed, watermark=None, dimensions=QUERY_EMBEDDING_DIMENSIONS,
+                 threshold=SIMILARITY_THRESHOLD, ttl=RETRIEVAL_CACHE_TTL, max_entries=RETRIEVAL_CACHE_MAX_ENTRIES,
+                 check_interval=INGESTION_CHECK_INTERVAL, clock=time.monotonic):
+        self.retrieve_chunks = retrieve
+        self.embed = embed
+        self.watermark = watermark
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._index = HyperplaneLSH(dimensions)
+        self._entries = OrderedDict()  # entry id -> entry, oldest first
+        self._by_text = {}  # (normalized query, number of results) -> entry id
+        self._next_id = 0
+        self._current_watermark = None
+        self._checked_at = None
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "invalidations": 0,
+                      "embed_seconds": 0.0, "retrieve_seconds": 0.0}
+
+    def _drop(self, entry_id):
+        # Called with the lock held
+        entry = self._entries.pop(entry_id)
+        self._index.remove(entry_id, entry["vector"])
+        key = (entry["query"], entry["number_of_results"])
+        if self._by_text.get(key) == entry_id:
+            del self._by_text[key]
+
+    def _clear(self):
+        # Called with the lock held
+        self._entries.clear()
+        self._by_text.clear()
+        self._index.clear()
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _check_watermark(self):
+        if self.watermark is None:
+            return
+        with self._lock:
+            now = self.clock()
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+        try:
+            watermark = self.watermark.current()
+        except Exception as e:
+            # Keep serving until the next check; entries still expire with the TTL
+            print(f"Could not check the Knowledge Base ingestion jobs: {e}")
+            return
+        with self._lock:
+            if watermark != self._current_watermark:
+                if self._current_watermark is not None:
+                    print("Knowledge Base content changed, dropping the retrieval cache")
+                    self.stats["invalidations"] += 1
+                self._clear()
+                self._current_watermark = watermark
+
+    def _lookup(self, normalized, vector, number_of_results):
+        # Called with the lock held
+        now = self.clock()
+        if vector is None:
+            entry_id = self._by_text.get((normalized, number_of_results))
+            candidates = [] if entry_id is None else [entry_id]
+        else:
+            candidates = self._index.candidates(vector)
+        best, best_score = None, self.threshold
+        for entry_id in candidates:
+            entry = self._entries[entry_id]
+            if now - entry["created_at"] > self.ttl:
+                self._drop(entry_id)
+                continue
+            if entry["number_of_results"] != number_of_results:
+                continue
+            score = 1.0 if vector is None else cosine(vector, entry["vector"])
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def _store(self, normalized, vector, number_of_results, results):
+        # Called with the lock held
+        while len(self._entries) >= self.max_entries:
+            self._drop(next(iter(self._entries)))
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = {"query": normalized, "vector": vector, "number_of_results": number_of_results,
+                                   "results": results, "created_at": self.clock()}
+        self._by_text[(normalized, number_of_results)] = entry_id
+        self._index.add(entry_id, vector)
+
+    def retrieve(self, query, number_of_results=5):
+        """
+        Retrieved chunks for a query, from the cache when a similar query was answered before.
+
+        Returns:
+            (results, source) with source "exact", "semantic" or "knowledge_base"
+        """
+        normalized = normalize_query(query)
+        self._check_watermark()
+        with self._lock:
+            entry = self._lookup(normalized, None, number_of_results)
+            if entry is not None:
+                self.stats["exact_hits"] += 1
+                return entry["results"], "exact"
+
+        started = time.perf_counter()
+        vector = _unit(self.embed(normalized))
+        embedded = time.perf_counter()
+        with self._lock:
+            self.stats["embed_seconds"] += embedded - started
+            entry = self._lookup(normalized, vector, number_of_results)
+            if entry is not None:
+                self.stats["semantic_hits"] += 1
+                return entry["results"], "semantic"
+
+        results = self.retrieve_chunks(query, number_of_results)
+        with self._lock:
+            self.stats["retrieve_seconds"] += time.perf_counter() - embedded
+            self.stats["misses"] += 1
+            self._store(normalized, vector, number_of_results, results)
+        return results, "knowledge_base"
+
+    def status(self):
+        with self._lock:
+            lookups = self.stats["exact_hits"] + self.stats["semantic_hits"] + self.stats["misses"]
+            hits = self.stats["exact_hits"] + self.stats["semantic_hits"]
+            return {**self.stats, "entries": len(self._entries),
+                    "hit_rate": round(hits / lookups, 3) if lookups else None}
+
+
+def titan_query_embedding(text, dimensions=QUERY_EMBEDDING_DIMENSIONS):
+    response = get_client("bedrock-runtime").invoke_model(
+        modelId=QUERY_EMBEDDING_MODEL,
+        body=json.dumps({"inputText": text, "dimensions": dimensions, "normalize": True}),
+    )
+    return json.loads(response["body"].read())["embedding"]
+
+
+def knowledge_base_retriever(knowledge_base_id):
+    """Retrieve function for RetrievalCache backed by the Bedrock Knowledge Base Retrieve API."""
+
+    def retrieve(query, number_of_results):
+        response = get_client("bedrock-agent-runtime").retrieve(
+            knowledgeBaseId=knowledge_base_id,
+            retrievalQuery={"text": query},
+            retrievalConfiguration={"vectorSearchConfiguration": {"numberOfResults": number_of_results}},
+        )
+        return [{"text": result["content"]["text"], "location": result.get("location", {}),
+                 "score": result.get("score")} for result in response["retrievalResults"]]
+
+    return retrieve
+
+
+def create_retrieval_cache(knowledge_base_id):
+    return RetrievalCache(knowledge_base_retriever(knowledge_base_id), titan_query_embedding,
+                          IngestionWatermark(get_client("bedrock-agent"), knowledge_base_id))
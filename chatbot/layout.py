@@ -1,5 +1,9 @@
 import streamlit as st
+import secrets
 import uuid
+from utils import cancel_generation_jobs
+from utils import authenticated_identity
+from utils import save_session
 
 
 def login_page():
@@ -28,7 +32,15 @@ def login_page():
 
             if submit:
                 st.session_state.conversation_id = str(uuid.uuid4())
+                identity = authenticated_identity()
+                st.session_state.user_name = identity["name"]
+                st.session_state.user_email = identity["email"]
+                save_session(st.session_state.conversation_id, identity["name"], identity["email"])
                 st.session_state.user_authenticated = True
+                # Lets a reconnect to another task find the session again. The snapshot is stored under an
+                # unguessable token, not the conversation id that is shown in the sidebar and stored with the data
+                st.session_state.resume_token = secrets.token_urlsafe(32)
+                st.query_params["session"] = st.session_state.resume_token
                 st.rerun()
 
     # Description and Disclaimer
@@ -121,9 +133,11 @@ def welcome_sidebar():
         """, unsafe_allow_html=True)
 
         if st.button("Nueva sesión", use_container_width=True):
+            cancel_generation_jobs()
             st.session_state.user_authenticated = False
             st.session_state.messages = []
             st.session_state.mod_messages = []
+            st.query_params.pop("session", None)
             st.rerun()
         
         st.divider()
@@ -148,6 +162,14 @@ def welcome_sidebar():
         </p>
     """, unsafe_allow_html=True)
 
+    if 'artifact_store' in st.session_state:
+        usage = st.session_state.artifact_store.usage()
+        st.markdown(f"""
+            <p class='small-font'>
+                Artefactos: {usage['memory_bytes'] / 1e6:.1f} MB en memoria, {usage['spilled_bytes'] / 1e6:.1f} MB en disco/S3
+            </p>
+        """, unsafe_allow_html=True)
+
 
 def create_tabs():
     """Create and return the Streamlit tabs."""
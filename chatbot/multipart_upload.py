@@ -0,0 +1,125 @@
+import base64
+import hashlib
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from botocore.exceptions import BotoCoreError
+from botocore.exceptions import ClientError
+
+# S3 requires at least 5 MiB for every part but the last one
+PART_SIZE = 8 * 1024 * 1024
+MAX_CONCURRENCY = 4
+MAX_PART_ATTEMPTS = 4
+RETRY_BASE_DELAY = 0.5
+
+
+def sha256_base64(data):
+    return base64.b64encode(hashlib.sha256(data).digest()).decode("ascii")
+
+
+def _read_part(fileobj, part_size):
+    # Non-blocking streams may return short reads: keep reading until the part is full or the stream ends
+    chunks = []
+    remaining = part_size
+    while remaining:
+        chunk = fileobj.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def _with_retries(operation, description):
+    for attempt in range(1, MAX_PART_ATTEMPTS + 1):
+        try:
+            return operation()
+        except (ClientError, BotoCoreError) as e:
+            if attempt == MAX_PART_ATTEMPTS:
+                raise
+            delay = RETRY_BASE_DELAY * (2 ** (attempt - 1))
+            print(f"{description} failed (attempt {attempt}/{MAX_PART_ATTEMPTS}), retrying in {delay}s: {e}")
+            time.sleep(delay)
+
+
+def upload_fileobj(s3_client, fileobj, bucket, key, size=None, content_type=None, metadata=None, on_progress=None,
+                   part_size=PART_SIZE, max_concurrency=MAX_CONCURRENCY):
+    """
+    Upload a file object to S3 with a parallel multipart upload and SHA-256 checksums.
+
+    The stream is read one part at a time and at most max_concurrency parts are held in memory and in flight,
+    so memory stays flat regardless of the file size. Every part carries its SHA-256 checksum, which S3 verifies,
+    and failed parts are retried with exponential backoff. Files smaller than one part are sent with a single
+    put_object call. On failure the multipart upload is aborted so no orphaned parts are left behind.
+
+    Args:
+        s3_client: boto3 S3 client
+        fileobj: Readable binary file object
+        bucket: Target bucket
+        key: Target object key
+        size: Total size in bytes, only used for progress reporting
+        content_type: Optional Content-Type of the object
+        metadata: Optional user metadata of the object
+        on_progress: Optional callable(uploaded_bytes, size), always called from the calling thread
+
+    Returns:
+        The S3 response of the final put_object or complete_multipart_upload call
+    """
+    extra_args = {"ContentType": content_type} if content_type else {}
+    if metadata:
+        extra_args["Metadata"] = metadata
+    first_part = _read_part(fileobj, part_size)
+
+    if len(first_part) < part_size:
+        response = _with_retries(
+            lambda: s3_client.put_object(Bucket=bucket, Key=key, Body=first_part,
+                                         ChecksumSHA256=sha256_base64(first_part), **extra_args),
+            f"Upload of s3://{bucket}/{key}")
+        if on_progress:
+            on_progress(len(first_part), size or len(first_part))
+        return response
+
+    upload_id = s3_client.create_multipart_upload(
+        Bucket=bucket, Key=key, ChecksumAlgorithm="SHA256", **extra_args)["UploadId"]
+
+    def upload_part(part_number, data):
+        checksum = sha256_base64(data)
+        response = _with_retries(
+            lambda: s3_client.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=part_number,
+                                          Body=data, ChecksumAlgorithm="SHA256", ChecksumSHA256=checksum),
+            f"Part {part_number} of s3://{bucket}/{key}")
+        return {"PartNumber": part_number, "ETag": response["ETag"], "ChecksumSHA256": checksum}, len(data)
+
+    parts = []
+    uploaded = 0
+
+    def collect(futures):
+        nonlocal uploaded
+        for future in futures:
+            part, part_bytes = future.result()
+            parts.append(part)
+            uploaded += part_bytes
+            if on_progress:
+                on_progress(uploaded, size)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            in_flight = set()
+            part_number = 1
+            data = first_part
+            while data:
+                in_flight.add(executor.submit(upload_part, part_number, data))
+                if len(in_flight) >= max_concurrency:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+                part_number += 1
+                data = _read_part(fileobj, part_size)
+            collect(in_flight)
+
+        parts.sort(key=lambda part: part["PartNumber"])
+        return s3_client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+    except BaseException:
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        raise
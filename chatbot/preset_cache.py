@@ -0,0 +1,90 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Preset answers are regenerated on this schedule so they follow changes to the agent and its Knowledge Base
+PRESET_REFRESH_INTERVAL = 6 * 3600
+# Warm-up and refreshes run a few agent calls at a time to stay clear of the agent's throttling limits
+PRESET_WARMUP_CONCURRENCY = 2
+
+
+class PresetAnswerCache:
+    """
+    Warm cache of the agent's first answer to every preset question, per topic and language.
+
+    The cache is filled in the background when it starts and refreshed every refresh_interval seconds. A
+    failed refresh keeps the previous answer. Lookups never call the agent: a miss (still warming up, or the
+    agent failed) returns None and the caller asks the agent live.
+
+    Args:
+        fetch: callable(question) returning the agent's answer
+        questions: dict of (topic, language) -> question
+    """
+
+    def __init__(self, fetch, questions, refresh_interval=PRESET_REFRESH_INTERVAL,
+                 concurrency=PRESET_WARMUP_CONCURRENCY):
+        self.fetch = fetch
+        self.questions = dict(questions)
+        self.refresh_interval = refresh_interval
+        self.concurrency = concurrency
+        self._lock = threading.Lock()
+        self._answers = {}  # (topic, language) -> {"question", "answer", "refreshed_at"}
+        self._thread = None
+
+    def get(self, topic, language):
+        with self._lock:
+            entry = self._answers.get((topic, language))
+        if entry is None or entry["question"] != self.questions.get((topic, language)):
+            return None
+        return entry
+
+    def put(self, topic, language, answer):
+        question = self.questions.get((topic, language))
+        if question is None or not answer:
+            return
+        with self._lock:
+            self._answers[(topic, language)] = {"question": question, "answer": answer, "refreshed_at": time.time()}
+
+    def _refresh_one(self, key):
+        topic, language = key
+        try:
+            self.put(topic, language, self.fetch(self.questions[key]))
+        except Exception as e:
+            print(f"Could not refresh the preset answer for {topic} ({language}): {e}")
+
+    def refresh(self):
+        """Ask the agent every preset question again."""
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(self._refresh_one, self.questions))
+        print(f"Refreshed {len(self._answers)}/{len(self.questions)} preset answers in {time.time() - started:.1f}s")
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.refresh_interval)
+
+    def start(self):
+        """Warm up and keep refreshing on a daemon thread."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="preset-answers", daemon=True)
+                self._thread.start()
+        return self
+
+
+def preset_session_id():
+    # Every preset answer is generated in a throwaway agent session so it does not depend on any user's history
+    return f"preset-{uuid.uuid4()}"
+
+
+def preset_history(question, answer):
+    """
+    Conversation history for the agent's sessionState, so the first live turn after a cached preset answer
+    continues from it.
+    """
+    return {"messages": [
+        {"role": "user", "content": [{"text": question}]},
+        {"role": "assistant", "content": [{"text": answer}]},
+    ]}
@@ -0,0 +1,294 @@
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from botocore.exceptions import ClientError
+from aws_clients import borrow_resource
+
+# Bump when the layout of the snapshot changes; snapshots with another schema are ignored instead of restored
+SNAPSHOT_SCHEMA = 2
+# Identity of the user a snapshot belongs to; a snapshot is only restored for the same user
+IDENTITY_KEYS = ["user_name", "user_email"]
+# Conversation state that must survive a move to another task. Uploaded files, widget values and clients
+# stay local: they are either re-created by the page or too large to persist on every interaction
+SNAPSHOT_KEYS = IDENTITY_KEYS + [
+    "conversation_id", "resume_token", "topic_selector", "active_tab",
+    "messages", "mod_messages", "interaction", "image_insights",
+    "arch_messages", "cdk_messages", "cfn_messages", "cost_messages", "doc_messages", "dsl_messages",
+    "generate_arch_called", "generate_cdk_called", "generate_cfn_called", "generate_cost_estimates_called",
+    "generate_doc_called", "generate_dsl_called",
+    "artifact_versions",
+]
+SESSION_TTL_DAYS = 7
+COMPRESSION_LEVEL = 6
+# DynamoDB items are limited to 400 KB
+MAX_DYNAMODB_SNAPSHOT_BYTES = 380 * 1024
+# Longer texts (solutions, generated artifacts) are persisted as references to the artifact store, which writes
+# them through to S3 with ARTIFACT_SPILL=s3: the snapshot only carries their digests
+SNAPSHOT_INLINE_MAX_BYTES = 2048
+SNAPSHOT_ARTIFACT = "_snapshot_artifact"
+
+
+class SnapshotConflict(Exception):
+    """The stored snapshot was written by another task since it was loaded."""
+
+
+class SnapshotTooLarge(Exception):
+    """The snapshot does not fit in the backend; the session can no longer be resumed on another task."""
+
+
+def _compact(value, put_artifact):
+    if isinstance(value, str) and len(value.encode("utf-8")) > SNAPSHOT_INLINE_MAX_BYTES:
+        stored = put_artifact(value)
+        return {SNAPSHOT_ARTIFACT: stored} if isinstance(stored, dict) else value
+    if isinstance(value, dict):
+        return {key: _compact(item, put_artifact) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_compact(item, put_artifact) for item in value]
+    return value
+
+
+def _expand(value, load_artifact):
+    if isinstance(value, dict):
+        if set(value) == {SNAPSHOT_ARTIFACT}:
+            return load_artifact(value[SNAPSHOT_ARTIFACT])
+        return {key: _expand(item, load_artifact) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_expand(item, load_artifact) for item in value]
+    return value
+
+
+def encode_snapshot(state, put_artifact=None):
+    """
+    Serialize the persisted keys of a session state into a compressed snapshot.
+
+    Args:
+        state: Session state
+        put_artifact: Optional callable storing a long text and returning an artifact reference, used to keep
+            the texts longer than SNAPSHOT_INLINE_MAX_BYTES out of the snapshot
+
+    Returns:
+        (bytes, sha256 hex digest of the uncompressed document)
+    """
+    persisted = {}
+    for key in SNAPSHOT_KEYS:
+        if key not in state:
+            continue
+        try:
+            value = json.loads(json.dumps(state[key], ensure_ascii=False))
+        except (TypeError, ValueError) as e:
+            print(f"Session state key {key} is not serializable and will not be persisted: {e}")
+            continue
+        persisted[key] = _compact(value, put_artifact) if put_artifact else value
+    document = json.dumps({"schema": SNAPSHOT_SCHEMA, "state": persisted}, ensure_ascii=False,
+                          separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return zlib.compress(document, COMPRESSION_LEVEL), hashlib.sha256(document).hexdigest()
+
+
+def decode_snapshot(blob):
+    """Inverse of encode_snapshot, texts stored as artifacts left as references; None for another schema."""
+    document = json.loads(zlib.decompress(blob))
+    if document.get("schema") != SNAPSHOT_SCHEMA:
+        print(f"Ignoring session snapshot with schema {document.get('schema')}")
+        return None
+    return document["state"]
+
+
+class InMemorySessionBackend:
+    """Process-local backend for development and tests; sessions do not survive a restart or move between tasks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = {}
+
+    def load(self, session_id):
+        with self._lock:
+            return self._snapshots.get(session_id)
+
+    def save(self, session_id, blob, expected_version):
+        with self._lock:
+            current_version = self._snapshots.get(session_id, (0, None))[0]
+            if current_version != expected_version:
+                raise SnapshotConflict(session_id)
+            self._snapshots[session_id] = (expected_version + 1, blob)
+            return expected_version + 1
+
+
+class DynamoDBSessionBackend:
+    """Snapshots stored as one item per session, with optimistic locking on the version and a TTL attribute."""
+
+    def __init__(self, table_name, ttl_days=SESSION_TTL_DAYS):
+        self.table_name = table_name
+        self.ttl_days = ttl_days
+
+    def load(self, session_id):
+        with borrow_resource("dynamodb") as dynamodb:
+            item = dynamodb.Table(self.table_name).get_item(
+                Key={"session_id": session_id}, ConsistentRead=True).get("Item")
+        if item is None:
+            return None
+        return int(item["version"]), bytes(item["snapshot"])
+
+    def save(self, session_id, blob, expected_version):
+        if len(blob) > MAX_DYNAMODB_SNAPSHOT_BYTES:
+            raise SnapshotTooLarge(f"Session snapshot of {len(blob)} bytes exceeds the DynamoDB item limit")
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        condition = "attribute_not_exists(session_id)" if expected_version == 0 else "version = :expected"
+        values = {} if expected_version == 0 else {":expected": expected_version}
+        try:
+            with borrow_resource("dynamodb") as dynamodb:
+                dynamodb.Table(self.table_name).put_item(
+                    Item={
+                        "session_id": session_id,
+                        "version": expected_version + 1,
+                        "snapshot": blob,
+                        "updated_at": now.strftime("%Y-%m-%d %H:%M:%S"),
+                        "expires_at": int(time.time()) + self.ttl_days * 24 * 3600,
+                    },
+                    ConditionExpression=condition,
+                    **({"ExpressionAttributeValues": values} if values else {}))
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise SnapshotConflict(session_id) from None
+            raise
+        return expected_version + 1
+
+
+class RedisSessionBackend:
+    """Snapshots stored in a Redis hash per session, written in a WATCH/MULTI transaction."""
+
+    def __init__(self, url, ttl_days=SESSION_TTL_DAYS, prefix="devgenius:session:"):
+        # redis is an optional dependency, only needed when this backend is selected
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_days * 24 * 3600
+        self.prefix = prefix
+
+    def load(self, session_id):
+        version, blob = self.client.hmget(self.prefix + session_id, "version", "snapshot")
+        if blob is None:
+            return None
+        return int(version), blob
+
+    def save(self, session_id, blob, expected_version):
+        import redis
+
+        key = self.prefix + session_id
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                current_version = int(pipe.hget(key, "version") or 0)
+                if current_version != expected_version:
+                    raise SnapshotConflict(session_id)
+                pipe.multi()
+                pipe.hset(key, mapping={"version": expected_version + 1, "snapshot": blob})
+                pipe.expire(key, self.ttl_seconds)
+                pipe.execute()
+            except redis.WatchError:
+                raise SnapshotConflict(session_id) from None
+        return expected_version + 1
+
+
+class SessionStore:
+    """
+    Saves and restores the conversation part of a Streamlit session so it can continue on any task.
+
+    Every save writes a new version of the snapshot and only succeeds if the stored version is the one this
+    session last saw. If another task wrote in between (the same session open in another tab), the newer stored
+    snapshot wins: it is loaded into the state and SnapshotConflict is raised so the user can be told. Unchanged
+    state is not written again.
+
+    Long texts are persisted through put_artifact and read back with load_artifact when both are given (see
+    artifact_store), so the snapshot stays small whatever the size of the generated artifacts.
+    """
+
+    def __init__(self, backend, put_artifact=None, load_artifact=None):
+        self.backend = backend
+        self.put_artifact = put_artifact
+        self.load_artifact = load_artifact
+
+    def _apply(self, snapshot, version, state):
+        # The conversation id comes first: the artifact store of the session is keyed by it
+        if "conversation_id" in snapshot:
+            state["conversation_id"] = snapshot["conversation_id"]
+        for key, value in snapshot.items():
+            state[key] = _expand(value, self.load_artifact) if self.load_artifact else value
+        state["_snapshot_version"] = version
+        state["_snapshot_digest"] = encode_snapshot(snapshot)[1]
+
+    def restore(self, session_id, state, identity):
+        """
+        Copy the stored snapshot of session_id into state if it belongs to the given user.
+
+        Args:
+            session_id: Resume token the snapshot is stored under
+            state: Session state to restore into
+            identity: dict with the IDENTITY_KEYS of the user asking to resume the session
+
+        Returns:
+            True if a snapshot of this user was found and restored
+        """
+        stored = self.backend.load(session_id)
+        if stored is None:
+            return False
+        version, blob = stored
+        snapshot = decode_snapshot(blob)
+        if snapshot is None:
+            return False
+        if any(snapshot.get(key) != identity.get(key) for key in IDENTITY_KEYS):
+            print(f"Session {session_id[:8]}... belongs to another user, not restoring it")
+            return False
+        self._apply(snapshot, version, state)
+        return True
+
+    def save(self, session_id, state):
+        """
+        Persist the session state if it changed since the last save.
+
+        Returns:
+            True if a new version was written
+
+        Raises:
+            SnapshotConflict: If another task saved a newer version; it has been loaded into state
+            SnapshotTooLarge: If the snapshot does not fit in the backend
+        """
+        blob, digest = encode_snapshot(state, self.put_artifact)
+        if state.get("_snapshot_digest") == digest:
+            return False
+        try:
+            version = self.backend.save(session_id, blob, state.get("_snapshot_version", 0))
+        except SnapshotConflict:
+            stored = self.backend.load(session_id)
+            snapshot = decode_snapshot(stored[1]) if stored else None
+            if snapshot is None:
+                raise
+            print(f"Session {session_id[:8]}... was updated by another task (version {stored[0]}), loading it")
+            self._apply(snapshot, stored[0], state)
+            raise
+        state["_snapshot_version"] = version
+        state["_snapshot_digest"] = digest
+        return True
+
+
+def create_session_store(config, put_artifact=None, load_artifact=None):
+    """
+    Select the backend from SESSION_STORE_BACKEND (dynamodb, redis or memory).
+
+    By default DynamoDB is used when the stack provides SESSION_STATE_TABLE_NAME, Redis when REDIS_URL is set
+    and the in-memory backend otherwise. put_artifact and load_artifact are passed to the SessionStore.
+    """
+    backend = os.getenv("SESSION_STORE_BACKEND")
+    if backend is None:
+        backend = "dynamodb" if config.session_state_table_name else "redis" if os.getenv("REDIS_URL") else "memory"
+    if backend == "dynamodb":
+        return SessionStore(DynamoDBSessionBackend(config.session_state_table_name), put_artifact, load_artifact)
+    if backend == "redis":
+        return SessionStore(RedisSessionBackend(os.environ["REDIS_URL"]), put_artifact, load_artifact)
+    if backend == "memory":
+        print("Session state is kept in memory, sessions will not survive a restart or move between tasks")
+        return SessionStore(InMemorySessionBackend(), put_artifact, load_artifact)
+    raise ValueError(f"Unknown session store backend: {backend}")
@@ -0,0 +1,43 @@
+from cfn_validation import validate_template
+
+SAM_TEMPLATE = """
+Transform: AWS::Serverless-2016-10-31
+Resources:
+  Api:
+    Type: AWS::Serverless::Api
+    Properties:
+      StageName: prod
+  Handler:
+    Type: AWS::Serverless::Function
+    DependsOn: ApiDeployment
+    Properties:
+      Runtime: python3.13
+      Handler: app.handler
+      InlineCode: "def handler(event, context): return {}"
+      Events:
+        Root:
+          Type: Api
+          Properties:
+            RestApiId: !Ref Api
+            Path: /
+            Method: get
+Outputs:
+  RoleArn:
+    Value: !GetAtt ApiRole.Arn
+  Url:
+    Value: !Sub "https://${ServerlessRestApi}.execute-api.${AWS::Region}.amazonaws.com/prod"
+"""
+
+
+def test_sam_generated_resources_are_warnings():
+    result = validate_template(SAM_TEMPLATE)
+    assert result["errors"] == []
+    assert any("ApiRole" in warning for warning in result["warnings"])
+    assert any("ServerlessRestApi" in warning for warning in result["warnings"])
+    assert any("ApiDeployment" in warning for warning in result["warnings"])
+
+
+def test_unknown_references_are_errors_without_transform():
+    result = validate_template(SAM_TEMPLATE.replace("Transform: AWS::Serverless-2016-10-31\n", ""))
+    assert any("ApiRole" in error for error in result["errors"])
+    assert any("ServerlessRestApi" in error for error in result["errors"])
@@ -0,0 +1,108 @@
+import botocore.session
+from botocore.stub import Stubber
+from ingestion import CONTENT_HASH_METADATA
+from ingestion import IngestionCoordinator
+
+KNOWLEDGE_BASE_ID = "KB12345678"
+DATA_SOURCE_ID = "DS12345678"
+BUCKET = "uploads-bucket"
+JOB_KEY = {"knowledgeBaseId": KNOWLEDGE_BASE_ID, "dataSourceId": DATA_SOURCE_ID}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def ingestion_job(job_id, status, statistics=None):
+    job = {**JOB_KEY, "ingestionJobId": job_id, "status": status,
+           "startedAt": "2024-01-01T00:00:00Z", "updatedAt": "2024-01-01T00:00:00Z"}
+    if statistics:
+        job["statistics"] = statistics
+    return {"ingestionJob": job}
+
+
+def make_coordinator():
+    session = botocore.session.get_session()
+    bedrock_agent_client = session.create_client("bedrock-agent", region_name="us-east-1",
+                                                 aws_access_key_id="test", aws_secret_access_key="test")
+    s3_client = session.create_client("s3", region_name="us-east-1",
+                                      aws_access_key_id="test", aws_secret_access_key="test")
+    clock = FakeClock()
+    coordinator = IngestionCoordinator(bedrock_agent_client, s3_client, BUCKET, KNOWLEDGE_BASE_ID, DATA_SOURCE_ID,
+                                       batch_delay=5, poll_interval=10, clock=clock)
+    return coordinator, Stubber(bedrock_agent_client), Stubber(s3_client), clock
+
+
+def test_uploads_are_batched_into_one_job():
+    coordinator, bedrock_agent, _, clock = make_coordinator()
+    bedrock_agent.add_response("start_ingestion_job", ingestion_job("JOB1", "STARTING"),
+                               {**JOB_KEY, "description": "2 uploaded document(s)"})
+    bedrock_agent.add_response("get_ingestion_job", ingestion_job("JOB1", "IN_PROGRESS"),
+                               {**JOB_KEY, "ingestionJobId": "JOB1"})
+    bedrock_agent.add_response("get_ingestion_job", ingestion_job("JOB1", "COMPLETE", {
+        "numberOfNewDocumentsIndexed": 1, "numberOfModifiedDocumentsIndexed": 1, "numberOfDocumentsFailed": 0,
+        "numberOfDocumentsDeleted": 0}), {**JOB_KEY, "ingestionJobId": "JOB1"})
+
+    with bedrock_agent:
+        coordinator.register("knowledge-base-uploads/a.pdf")
+        clock.now = 3
+        coordinator.register("knowledge-base-uploads/b.pdf")
+        clock.now = 6
+        coordinator.run_once()  # Still within the batch delay of the second upload
+        assert coordinator.status()["jobs"] == 0
+
+        clock.now = 8
+        coordinator.run_once()
+        assert coordinator.status() == {"indexed": 0, "failed": 0, "skipped": 0, "deleted": 0, "jobs": 1,
+                                        "last_status": "STARTING", "pending": 0, "in_progress": 2}
+
+        clock.now = 18
+        coordinator.run_once()
+        assert coordinator.status()["last_status"] == "IN_PROGRESS"
+
+        clock.now = 28
+        coordinator.run_once()
+        status = coordinator.status()
+        assert status["indexed"] == 2
+        assert status["in_progress"] == 0
+        assert status["last_status"] == "COMPLETE"
+    bedrock_agent.assert_no_pending_responses()
+
+
+def test_conflict_requeues_the_batch():
+    coordinator, bedrock_agent, _, clock = make_coordinator()
+    bedrock_agent.add_client_error("start_ingestion_job", "ConflictException", http_status_code=409)
+    bedrock_agent.add_response("start_ingestion_job", ingestion_job("JOB2", "STARTING"),
+                               {**JOB_KEY, "description": "1 uploaded document(s)"})
+
+    with bedrock_agent:
+        coordinator.register("knowledge-base-uploads/a.pdf")
+        clock.now = 5
+        coordinator.run_once()
+        assert coordinator.status()["pending"] == 1
+
+        clock.now = 10
+        coordinator.run_once()  # Waits for the retry delay
+        assert coordinator.status()["jobs"] == 0
+
+        clock.now = 15
+        coordinator.run_once()
+        assert coordinator.status()["jobs"] == 1
+        assert coordinator.status()["in_progress"] == 1
+    bedrock_agent.assert_no_pending_responses()
+
+
+def test_unchanged_documents_are_detected_from_the_object_metadata():
+    coordinator, _, s3, _ = make_coordinator()
+    s3.add_response("head_object", {"Metadata": {CONTENT_HASH_METADATA: "abc"}},
+                    {"Bucket": BUCKET, "Key": "knowledge-base-uploads/a.pdf"})
+    s3.add_client_error("head_object", "404", http_status_code=404)
+
+    with s3:
+        assert coordinator.is_unchanged("knowledge-base-uploads/a.pdf", "abc")
+        assert not coordinator.is_unchanged("knowledge-base-uploads/b.pdf", "abc")
+    s3.assert_no_pending_responses()
@@ -0,0 +1,33 @@
+import threading
+from jobs import CHARS_PER_TOKEN
+from jobs import JobService
+
+
+def test_cancellation_savings_use_the_mean_completed_output():
+    release = threading.Event()
+
+    def run(body, token):
+        if body.get("block"):
+            token.on_cancel(release.set)
+            release.wait(5)
+            return
+        yield "delta", "x" * (100 * CHARS_PER_TOKEN)
+        yield "stop", "end_turn"
+
+    service = JobService(run, workers=1)
+    service.submit("done", {"max_tokens": 128000})
+    service._queue.join()
+
+    running = service.submit("running", {"block": True, "max_tokens": 128000})
+    queued = service.submit("queued", {"max_tokens": 128000})
+    while running.started_at is None:
+        running.wait(-1, timeout=0.05)
+    service.cancel("queued")
+    service.cancel("running")
+    service._queue.join()
+
+    assert queued.status == "cancelled" and running.status == "cancelled"
+    assert service.metrics["completed"] == 1
+    assert service.metrics["cancelled_queued"] == 1
+    assert service.metrics["cancelled_running"] == 1
+    assert service.metrics["cancelled_tokens_saved"] == 200
@@ -1,51 +1,99 @@
 import streamlit as st
-import boto3
 import os
-from pypdf import PdfWriter, PdfReader
 import io
 import tempfile
-from botocore.config import Config
-# Import necessary modules
-from langchain.document_loaders import UnstructuredPowerPointLoader
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from aws_clients import get_client
+from multipart_upload import upload_fileobj
+from ingestion import IngestionCoordinator
+from ingestion import INGESTION_POLL_INTERVAL
+from ingestion import CONTENT_HASH_METADATA
+from ingestion import content_hash
+from app_config import get_config
 
-# NORTHSTAR_S3_BUCKET_NAME = os.environ.get('NORTHSTAR_S3_BUCKET_NAME')
-NORTHSTAR_S3_BUCKET_NAME = "devgenius-reinvent-release-037225164867-us-west-2"
-AWS_REGION = os.getenv("AWS_REGION")
-config = Config(read_timeout=1000, retries=(dict(max_attempts=5)))
+# Bedrock Knowledge Bases only ingest documents up to 50 MB, larger PDFs are split before uploading
+PDF_SPLIT_THRESHOLD = 45 * 1024 * 1024
 
-bedrock_agent_runtime_client = boto3.client('bedrock-agent-runtime', region_name=AWS_REGION)
-bedrock_client = boto3.client('bedrock-runtime', region_name=AWS_REGION, config=config)
-s3_client = boto3.client('s3', region_name=AWS_REGION, config=config)
-s3_resource = boto3.resource('s3', region_name=AWS_REGION)
+# Uploads go to the Knowledge Base data source bucket unless NORTHSTAR_S3_BUCKET_NAME points elsewhere
+NORTHSTAR_S3_BUCKET_NAME = os.environ.get('NORTHSTAR_S3_BUCKET_NAME') or get_config().s3_bucket_name
+# Must match the inclusion prefix of the uploads data source in lib/index.ts
+KNOWLEDGE_BASE_UPLOADS_PREFIX = "knowledge-base-uploads/"
 
 import re
 
 class PPTExtraction:
-    def __init__(self, file_path):
+    def __init__(self, file):
         """
-        Initialize PPTExtraction class with the provided file path.
+        Initialize PPTExtraction class with the provided PowerPoint file.
 
         Args:
-        - file_path (str): Path to the PowerPoint file.
+        - file (str or file-like): Path or binary stream of the PowerPoint file.
         """
-        self.file_path = file_path
-        # Initialize the UnstructuredPowerPointLoader to load PowerPoint data.
-        self.loader = UnstructuredPowerPointLoader(self.file_path, mode="elements")
-        # Load the PowerPoint data.
-        self.data = self.loader.load()
+        self.file = file
 
-    def extract(self):
+    def _shape_lines(self, shape):
+        from pptx.enum.shapes import MSO_SHAPE_TYPE
+
+        # Group shapes nest their text boxes and tables
+        if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+            for child in shape.shapes:
+                yield from self._shape_lines(child)
+        elif shape.has_text_frame:
+            for paragraph in shape.text_frame.paragraphs:
+                text = "".join(run.text for run in paragraph.runs).strip()
+                if text:
+                    yield f"Content: {text}"
+        elif shape.has_table:
+            rows = [" | ".join(cell.text.strip() for cell in row.cells) for row in shape.table.rows]
+            yield "Table:\n" + "\n".join(rows)
+
+    def iter_slides(self):
         """
-        Extract text content from the PowerPoint slides and format them.
+        Stream the slides of a .pptx file as formatted text, one slide at a time.
 
-        Returns:
-        - str: Formatted text containing the extracted content.
+        Yields:
+        - str: "Slide N:" followed by the Title/Outline, Content, Table and Notes entries of the slide.
         """
+        # pptx and pypdf are only imported when a document is processed, they add a noticeable share of the start-up time
+        from pptx import Presentation
+
+        presentation = Presentation(self.file)
+        for slide_number, slide in enumerate(presentation.slides, start=1):
+            entries = [f"Slide {slide_number}:"]
+            title_shape = slide.shapes.title
+            title = title_shape.text_frame.text.strip() if title_shape is not None else ""
+            if title:
+                entries.append(f"Title: {title}" if slide_number == 1 else f"Outline: {title}")
+            for shape in slide.shapes:
+                if title_shape is not None and shape.shape_id == title_shape.shape_id:
+                    continue
+                entries.extend(self._shape_lines(shape))
+            if slide.has_notes_slide:
+                notes = slide.notes_slide.notes_text_frame.text.strip()
+                if notes:
+                    entries.append(f"Notes: {notes}")
+            yield "\n\n".join(entries)
+
+    def _extract_with_unstructured(self):
+        # Legacy binary .ppt files are not supported by python-pptx: fall back to unstructured, imported lazily
+        # because langchain and unstructured are slow to import and heavy on memory
+        from langchain.document_loaders import UnstructuredPowerPointLoader
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = self.file
+            if not isinstance(file_path, str):
+                file_path = os.path.join(tmp_dir, "presentation.ppt")
+                self.file.seek(0)
+                with open(file_path, "wb") as tmp_file:
+                    tmp_file.write(self.file.read())
+            data = UnstructuredPowerPointLoader(file_path, mode="elements").load()
+
         slides = []
         current_slide_number = None
 
         # Iterate through each document in the PowerPoint data.
-        for document in self.data:
+        for document in data:
             # Check the category of the current document.
             if document.metadata["category"] == "Title":
                 slide_number = document.metadata["page_number"]
@@ -69,102 +117,206 @@ class PPTExtraction:
 
             slides.append(slide)
 
-        # Join the formatted slides into a single string.
-        formatted_slides = "\n\n".join(slides)
-        return formatted_slides
+        return "\n\n".join(slides)
+
+    def extract(self):
+        """
+        Extract text content from the PowerPoint slides and format them.
+
+        Returns:
+        - str: Formatted text containing the extracted content.
+        """
+        from pptx.exc import PackageNotFoundError
+
+        try:
+            return "\n\n".join(self.iter_slides())
+        except (PackageNotFoundError, zipfile.BadZipFile):
+            return self._extract_with_unstructured()
+
+
+def _write_pdf(writer):
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def _page_size(page):
+    # Size of the page written on its own; resources shared between pages (fonts, logos) are counted for
+    # every page, so the estimate errs on the side of smaller parts
+    from pypdf import PdfWriter
 
+    writer = PdfWriter()
+    writer.add_page(page)
+    return len(_write_pdf(writer))
 
-def split_pdf(pdf_content):
-    pdf_reader = PdfReader(io.BytesIO(pdf_content))
+
+def split_pdf(pdf_file, max_part_bytes=PDF_SPLIT_THRESHOLD):
+    """
+    Split a PDF into as many parts as needed to keep each one under max_part_bytes.
+
+    Pages are accumulated until the next one would push the part over the limit and every part is yielded
+    as soon as it is written, so only one part is held in memory at a time. A single page larger than the
+    limit becomes a part of its own.
+
+    Args:
+        pdf_file: Readable binary file object (or path) of the PDF
+
+    Yields:
+        (pages_done, total_pages, part_bytes) for each part in page order
+    """
+    from pypdf import PdfReader
+    from pypdf import PdfWriter
+
+    pdf_reader = PdfReader(pdf_file)
     total_pages = len(pdf_reader.pages)
-    mid_point = total_pages // 2
+    writer = PdfWriter()
+    part_size = 0
 
-    # Create two new PDF writers
-    part1_writer = PdfWriter()
-    part2_writer = PdfWriter()
+    for page_num, page in enumerate(pdf_reader.pages):
+        page_size = _page_size(page)
+        if writer.pages and part_size + page_size > max_part_bytes:
+            yield page_num, total_pages, _write_pdf(writer)
+            writer = PdfWriter()
+            part_size = 0
+        writer.add_page(page)
+        part_size += page_size
 
-    # Split pages between the two writers
-    for page_num in range(total_pages):
-        if page_num < mid_point:
-            part1_writer.add_page(pdf_reader.pages[page_num])
-        else:
-            part2_writer.add_page(pdf_reader.pages[page_num])
+    if writer.pages:
+        yield total_pages, total_pages, _write_pdf(writer)
 
-    # Save both parts to bytes objects
-    part1_bytes = io.BytesIO()
-    part2_bytes = io.BytesIO()
 
-    part1_writer.write(part1_bytes)
-    part2_writer.write(part2_bytes)
+def upload_pdf_parts(pdf_file, filename_base, bucket_name, metadata=None):
+    """Split a large PDF and upload each part while the next one is being built. Returns the uploaded keys."""
+    progress_bar = st.progress(0.0, text="Splitting PDF...")
+    part_keys = []
+    pending_upload = None
+    try:
+        # A single worker keeps at most one part uploading while the next part is written
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            for pages_done, total_pages, part in split_pdf(pdf_file):
+                if pending_upload:
+                    pending_upload.result()
+                part_keys.append(f"{filename_base}_part{len(part_keys) + 1}.pdf")
+                pending_upload = executor.submit(
+                    upload_fileobj, get_client("s3"), io.BytesIO(part), bucket_name, part_keys[-1],
+                    size=len(part), content_type="application/pdf", metadata=metadata)
+                progress_bar.progress(pages_done / total_pages,
+                                      text=f"Uploading part {len(part_keys)} (pages up to {pages_done} of {total_pages})...")
+            if pending_upload:
+                pending_upload.result()
+        return part_keys
+    except Exception as e:
+        st.error(f"Error uploading to S3: {str(e)}")
+        return []
+    finally:
+        progress_bar.empty()
+
 
-    return part1_bytes.getvalue(), part2_bytes.getvalue()
+def upload_to_s3(file_content, filename, bucket_name, size=None, metadata=None):
+    """Upload bytes or a readable file object, showing the progress of the transfer."""
+    if isinstance(file_content, str):
+        file_content = file_content.encode("utf-8")
+    if isinstance(file_content, bytes):
+        size = len(file_content)
+        file_content = io.BytesIO(file_content)
 
+    progress_bar = st.progress(0.0, text=f"Uploading {filename}...")
+
+    def on_progress(uploaded, total):
+        progress_bar.progress(min(uploaded / total, 1.0) if total else 1.0, text=f"Uploading {filename}...")
 
-def upload_to_s3(file_content, filename, bucket_name):
     try:
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=filename,
-            Body=file_content
-        )
+        upload_fileobj(get_client("s3"), file_content, bucket_name, filename, size=size, metadata=metadata,
+                       on_progress=on_progress)
         return True
     except Exception as e:
         st.error(f"Error uploading to S3: {str(e)}")
         return False
+    finally:
+        progress_bar.empty()
+
+
+@st.cache_resource
+def get_ingestion_coordinator():
+    # One coordinator per process, shared by every session, so concurrent uploads are batched together
+    config = get_config()
+    if not config.knowledge_base_id or not config.knowledge_base_data_source_id:
+        print("Knowledge Base ingestion is not configured, uploaded files will not be indexed")
+        return None
+    return IngestionCoordinator(get_client("bedrock-agent"), get_client("s3"), NORTHSTAR_S3_BUCKET_NAME,
+                                config.knowledge_base_id, config.knowledge_base_data_source_id).start()
+
+
+@st.fragment(run_every=INGESTION_POLL_INTERVAL)
+def show_ingestion_status(coordinator):
+    status = coordinator.status()
+    if not status["jobs"] and not status["pending"] and not status["skipped"]:
+        return
+    st.caption("Knowledge Base ingestion")
+    indexed, failed, pending = st.columns(3)
+    indexed.metric("Indexed", status["indexed"])
+    failed.metric("Failed", status["failed"])
+    pending.metric("Pending", status["pending"] + status["in_progress"])
+    st.caption(f"Skipped (unchanged): {status['skipped']} · Last job: {status['last_status'] or '-'}")
 
 
 def upload_file():
+    coordinator = get_ingestion_coordinator()
     with st.sidebar:
         # File uploader
         uploaded_file = st.file_uploader(
             "Upload a file",
-            type=['pdf', 'doc','docx','xls', 'xlsx','csv','txt']
+            type=['pdf', 'doc','docx','xls', 'xlsx','csv','txt','ppt','pptx']
         )
 
-        if uploaded_file is not None:
-            file_content = uploaded_file.read()
-            file_size = len(file_content)
+        # Reruns keep the same uploaded file around: process each upload only once
+        if uploaded_file is not None and st.session_state.get('uploaded_document_id') != uploaded_file.file_id:
+            st.session_state.uploaded_document_id = uploaded_file.file_id
+            file_size = uploaded_file.size
             file_extension = uploaded_file.name.split('.')[-1].lower()
             print("file_extension:",file_extension)
             print("uploaded_file.name:",uploaded_file.name)
 
-            # Save the uploaded file to a temporary location
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_file.name)[1]) as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_file.flush()  # Ensure all data is written to disk
-                file_path = tmp_file.name
+            # Unchanged documents are neither uploaded nor ingested again
+            sha256 = content_hash(uploaded_file)
+            metadata = {CONTENT_HASH_METADATA: sha256}
+            filename_base = KNOWLEDGE_BASE_UPLOADS_PREFIX + uploaded_file.name.rsplit('.', 1)[0]
+            split_pdf_upload = file_extension == 'pdf' and file_size > PDF_SPLIT_THRESHOLD
+            if split_pdf_upload:
+                object_key = f"{filename_base}_part1.pdf"
+            elif file_extension in ['ppt', 'pptx']:
+                object_key = f"{filename_base}.txt"
+            else:
+                object_key = KNOWLEDGE_BASE_UPLOADS_PREFIX + uploaded_file.name
 
+            uploaded_keys = []
+            if coordinator and coordinator.is_unchanged(object_key, sha256):
+                coordinator.skip(object_key)
+                st.info("This document is already in the knowledge base, skipping upload.")
             # Handle large files (> 45MB)
-            if file_extension == 'pdf':
-                if file_size > 45 * 1024 * 1024:  # 45MB in bytes
-                    st.info("File is larger than 45MB. Splitting into two parts...")
-                    part1, part2 = split_pdf(file_content)
-                    # Upload both parts
-                    filename_base = uploaded_file.name.rsplit('.', 1)[0]
-                    success1 = upload_to_s3(part1, f"{filename_base}_part1.pdf", NORTHSTAR_S3_BUCKET_NAME)
-                    success2 = upload_to_s3(part2, f"{filename_base}_part2.pdf", NORTHSTAR_S3_BUCKET_NAME)
-
-                    if success1 and success2:
-                        st.success("Both parts uploaded successfully!")
-                else:
-                    # Upload normal file
-                    if upload_to_s3(file_content, uploaded_file.name, NORTHSTAR_S3_BUCKET_NAME):
-                        st.success("File uploaded successfully!")
+            elif split_pdf_upload:
+                st.info("File is larger than 45MB. Splitting into parts...")
+                uploaded_keys = upload_pdf_parts(uploaded_file, filename_base, NORTHSTAR_S3_BUCKET_NAME, metadata)
+                if uploaded_keys:
+                    st.success(f"All {len(uploaded_keys)} parts uploaded successfully!")
             # Handle PPT/PPTX conversion
             elif file_extension in ['ppt', 'pptx']:
                 st.info("Converting PowerPoint to txt...")
-                ppt_extract = PPTExtraction(file_path)
+                ppt_extract = PPTExtraction(uploaded_file)
                 updated_file_content = ppt_extract.extract()
-                # file_content = convert_ppt_to_pdf(file_content)
-                uploaded_file.name = uploaded_file.name.rsplit('.', 1)[0] + '.txt'
                 # Upload normal file
-                if upload_to_s3(updated_file_content, uploaded_file.name, NORTHSTAR_S3_BUCKET_NAME):
+                if upload_to_s3(updated_file_content, object_key, NORTHSTAR_S3_BUCKET_NAME, metadata=metadata):
+                    uploaded_keys = [object_key]
                     st.success("File uploaded successfully!")
-            else: # docx, txt, xlsx,csv
-                if file_size > 45 * 1024 * 1024:  # 45MB in bytes
-                    st.error("Files larger than 45MB that are not PDFs cannot be split automatically.")
-                else:
-                # Upload normal file
-                    if upload_to_s3(file_content, uploaded_file.name, NORTHSTAR_S3_BUCKET_NAME):
-                        st.success("File uploaded successfully!")
+            else: # pdf, docx, txt, xlsx, csv
+                # Streamed as a multipart upload straight from the upload buffer, whatever the size
+                if upload_to_s3(uploaded_file, object_key, NORTHSTAR_S3_BUCKET_NAME, size=file_size, metadata=metadata):
+                    uploaded_keys = [object_key]
+                    st.success("File uploaded successfully!")
+
+            if coordinator:
+                for key in uploaded_keys:
+                    coordinator.register(key)
 
+        if coordinator:
+            show_ingestion_status(coordinator)
@@ -1,9 +1,7 @@
 import streamlit as st
 import uuid
-import boto3
 import os
 import json
-from botocore.config import Config
 from botocore.exceptions import ClientError
 from defusedxml.ElementTree import fromstring
 from defusedxml.ElementTree import tostring
@@ -18,87 +16,95 @@ import base64
 import zlib
 import requests
 
+from aws_clients import get_client
+from aws_clients import borrow_resource
+from aws_clients import inference_profile_arn
+from app_config import get_config
+from app_config import get_secret
+from artifact_store import load_artifact
+from jobs import JobService
+from jobs import follow_job
+from jobs import job_key
+from agent_trace import start_turn_trace
+from kb_cache import create_retrieval_cache
+
 from dotenv import load_dotenv
 load_dotenv()
 
 AWS_REGION = os.getenv("AWS_REGION")
-config = Config(read_timeout=1000, retries=(dict(max_attempts=5)))
+# Cookies set by cognito-at-edge: <prefix><app client id>.LastAuthUser and <prefix><app client id>.<user>.idToken
+COGNITO_COOKIE_PREFIX = "CognitoIdentityServiceProvider."
 BEDROCK_MAX_TOKENS = 128000
+# Knowledge Base chunks returned by retrieve_knowledge
+KNOWLEDGE_CONTEXT_RESULTS = 5
 BEDROCK_TEMPERATURE = 0
-sts_client = boto3.client('sts', region_name=AWS_REGION)
-ACCOUNT_ID = sts_client.get_caller_identity()["Account"]
 # Cross Region Inference for improved resilience https://docs.aws.amazon.com/bedrock/latest/userguide/cross-region-inference.html  # noqa
-BEDROCK_MODEL_ID = f"arn:aws:bedrock:{AWS_REGION}:{ACCOUNT_ID}:inference-profile/us.anthropic.claude-3-7-sonnet-20250219-v1:0"  # noqa
+BEDROCK_INFERENCE_PROFILE = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
+# Stream the final answer of the agent as it is generated instead of in one chunk at the end
+AGENT_STREAMING_CONFIGURATION = {"streamFinalResponse": True}
+
 
-dynamodb_resource = boto3.resource('dynamodb', region_name=AWS_REGION)
-bedrock_agent_runtime_client = boto3.client('bedrock-agent-runtime', region_name=AWS_REGION)
-bedrock_client = boto3.client('bedrock-runtime', region_name=AWS_REGION, config=config)
-s3_client = boto3.client('s3', region_name=AWS_REGION, config=config)
-secrets_client = boto3.client('secretsmanager', region_name=AWS_REGION, config=config)
-s3_resource = boto3.resource('s3', region_name=AWS_REGION)
+def bedrock_model_id():
+    # Resolved on first use: the account id lookup is an STS round trip that should not run at import time
+    return inference_profile_arn(BEDROCK_INFERENCE_PROFILE)
 
 
 def invoke_bedrock_agent(
-        session_id, query, bedrock_agent='solution', enable_trace=True, end_session=False):
-    agent_id = retrieve_environment_variables("BEDROCK_AGENT_ID")
-    agent_alias_id = retrieve_environment_variables("BEDROCK_AGENT_ALIAS_ID")
+        session_id, query, bedrock_agent='solution', enable_trace=True, end_session=False, conversation_history=None):
+    agent_id = get_config().bedrock_agent_id
+    agent_alias_id = get_config().bedrock_agent_alias_id
 
-    return bedrock_agent_runtime_client.invoke_agent(
+    # Earlier turns that did not go through this agent session (cached preset answers)
+    session_state = {"sessionState": {"conversationHistory": conversation_history}} if conversation_history else {}
+    return get_client("bedrock-agent-runtime").invoke_agent(
         inputText=query,
         agentId=agent_id,
         agentAliasId=agent_alias_id,
         enableTrace=enable_trace,
         endSession=end_session,
-        sessionId=session_id
+        sessionId=session_id,
+        streamingConfigurations=AGENT_STREAMING_CONFIGURATION,
+        **session_state
     )
 
 
-@st.fragment
-def invoke_bedrock_model_streaming(messages, enable_reasoning=False, reasoning_budget=4096):
-    body = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": BEDROCK_MAX_TOKENS,
-        "messages": messages,
-        "temperature": BEDROCK_TEMPERATURE,
-    }
+@st.cache_resource
+def get_retrieval_cache():
+    # One cache per process: similar questions from every session share their Knowledge Base retrievals
+    return create_retrieval_cache(get_config().knowledge_base_id)
 
-    if enable_reasoning:
-        body["thinking"] = {
-            "type": "enabled",
-            "budget_tokens": reasoning_budget
-        }
-        body["temperature"] = 1   # temperature may only be set to 1 when thinking is enabled.
 
+def retrieve_knowledge(query, number_of_results=KNOWLEDGE_CONTEXT_RESULTS):
+    """
+    Chunks of the Knowledge Base relevant to a query, served from the semantic retrieval cache when possible.
+
+    Returns:
+        List of dicts with "text", "location" and "score", empty when the Knowledge Base is not configured or
+        cannot be reached
+    """
+    if not get_config().knowledge_base_id:
+        return []
+    try:
+        results, source = get_retrieval_cache().retrieve(query, number_of_results)
+    except ClientError as e:
+        print(f"Could not retrieve Knowledge Base context: {e}")
+        return []
+    print(f"Retrieved {len(results)} Knowledge Base chunk(s), served from {source}")
+    return results
+
+
+def invoke_bedrock_with_retries(body):
     retry_count = 0
     max_retries = 3
     initial_delay = 1
-    while retry_count < max_retries:
+    while True:
         try:
-            response = bedrock_client.invoke_model_with_response_stream(
+            return get_client("bedrock-runtime").invoke_model_with_response_stream(
                 body=json.dumps(body),
-                modelId=BEDROCK_MODEL_ID,
+                modelId=bedrock_model_id(),
                 contentType='application/json',
                 accept='application/json'
             )
-
-            result = ""
-            response_placeholder = st.empty()
-            stop_reason = None
-
-            with response_placeholder.container(height=150):
-                for event in response['body']:
-                    chunk = event.get('chunk')
-                    if chunk and 'bytes' in chunk:
-                        decoded_chunk = json.loads(chunk['bytes'].decode('utf-8'))
-                        if decoded_chunk.get("type") == "content_block_delta":
-                            result += decoded_chunk["delta"].get("text", "")
-                            response_placeholder.markdown(result)
-                        elif decoded_chunk['type'] == 'message_delta':
-                            stop_reason = decoded_chunk['delta'].get('stop_reason')
-
-            response_placeholder.empty()
-            return result, stop_reason
-
         except ClientError as e:
             error_code = e.response.get('Error', {}).get('Code', '')
             if error_code == 'ThrottlingException' or error_code == 'TooManyRequestsException':
@@ -114,6 +120,116 @@ def invoke_bedrock_model_streaming(messages, enable_reasoning=False, reasoning_b
                 raise e  # Re-raise if it's not a rate limit error
 
 
+def stream_model_deltas(body, token=None):
+    """
+    Invoke the model and yield its output as it streams.
+
+    Cancelling the token closes the HTTP stream of the response immediately, so Bedrock stops generating
+    (and billing) output tokens instead of running on until max_tokens.
+
+    Yields:
+        ("delta", text) for every text or tool input fragment and ("stop", stop_reason) at the end
+    """
+    response = invoke_bedrock_with_retries(body)
+    if token is not None:
+        token.on_cancel(response['body'].close)
+    for event in response['body']:
+        chunk = event.get('chunk')
+        if chunk and 'bytes' in chunk:
+            decoded_chunk = json.loads(chunk['bytes'].decode('utf-8'))
+            if decoded_chunk.get("type") == "content_block_delta":
+                delta = decoded_chunk["delta"]
+                yield "delta", delta.get("text", "") or delta.get("partial_json", "")
+            elif decoded_chunk['type'] == 'message_delta':
+                yield "stop", decoded_chunk['delta'].get('stop_reason')
+
+
+@st.cache_resource
+def get_job_service():
+    # One worker pool per process, shared by every session
+    return JobService(stream_model_deltas)
+
+
+def run_generation_job(body, render, owner=None):
+    """
+    Run a model request as a background job and stream its output into the UI.
+
+    The job id is derived from the conversation and the request, so a rerun or a reconnect in the middle of
+    the generation re-attaches to the running job instead of invoking the model again. owner names the widget
+    that started the job so cancel_generation_jobs can stop it.
+    """
+    job = get_job_service().submit(job_key(st.session_state.get('conversation_id'), body), body)
+    if 'generation_jobs' not in st.session_state:
+        st.session_state.generation_jobs = {}
+    st.session_state.generation_jobs[job.id] = owner
+    response_placeholder = st.empty()
+    with response_placeholder.container(height=150):
+        output_placeholder = st.empty()
+        result = follow_job(job, lambda output: render(output_placeholder, output),
+                            on_queued=lambda: output_placeholder.caption("En cola, esperando un generador libre..."))
+    response_placeholder.empty()
+    return result
+
+
+def cancel_generation_jobs(owner=None):
+    """Cancel the generations of this session that are still running, only those of owner if given."""
+    jobs = st.session_state.get('generation_jobs', {})
+    for job_id, job_owner in list(jobs.items()):
+        if owner is None or job_owner == owner:
+            if get_job_service().cancel(job_id):
+                print(f"Cancelled generation job {job_id} of {job_owner or 'the conversation'}")
+            del jobs[job_id]
+
+
+@st.fragment
+def invoke_bedrock_model_streaming(messages, enable_reasoning=False, reasoning_budget=4096, owner=None):
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": BEDROCK_MAX_TOKENS,
+        "messages": messages,
+        "temperature": BEDROCK_TEMPERATURE,
+    }
+
+    if enable_reasoning:
+        body["thinking"] = {
+            "type": "enabled",
+            "budget_tokens": reasoning_budget
+        }
+        body["temperature"] = 1   # temperature may only be set to 1 when thinking is enabled.
+
+    return run_generation_job(body, lambda placeholder, result: placeholder.markdown(result), owner)
+
+
+@st.fragment
+def invoke_bedrock_model_structured(messages, tool, owner=None):
+    """
+    Invoca el modelo forzando el uso de una herramienta para obtener una salida JSON tipada
+
+    Args:
+        messages: Mensajes de la conversación
+        tool: Definición de la herramienta con name, description e input_schema (JSON Schema)
+
+    Returns:
+        (dict con la entrada de la herramienta o None si el JSON está incompleto, stop_reason)
+    """
+    body = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": BEDROCK_MAX_TOKENS,
+        "messages": messages,
+        "temperature": BEDROCK_TEMPERATURE,
+        "tools": [tool],
+        "tool_choice": {"type": "tool", "name": tool["name"]},
+    }
+
+    partial_json, stop_reason = run_generation_job(
+        body, lambda placeholder, partial_json: placeholder.code(partial_json[-2000:], language="json"), owner)
+    try:
+        return json.loads(partial_json), stop_reason
+    except ValueError:
+        print(f"Incomplete structured output for tool {tool['name']}. stop_reason: {stop_reason}")
+        return None, stop_reason
+
+
 def continuation_prompt(architecture_prompt, prev_response):
     continuation_prompt = f"""
     Please analyze the prompt and initial answer below. The initial answer is cut off due to token limits.
@@ -130,18 +246,36 @@ def continuation_prompt(architecture_prompt, prev_response):
     return prompts_to_messages(continuation_prompt)
 
 
-def read_agent_response(event_stream):
+def read_agent_response(event_stream, on_chunk=None):
+    """
+    Read an invoke_agent event stream.
+
+    Args:
+        event_stream: The 'completion' stream of the invoke_agent response
+        on_chunk: Optional callable(answer_so_far) called as every chunk of the answer arrives
+
+    Returns:
+        (ask_user, agent_answer)
+    """
     ask_user = False
-    agent_answer = ""
+    answer_chunks = []
+    # Only a sample of the turns is recorded, see agent_trace
+    turn_trace = start_turn_trace()
     try:
         for event in event_stream:
             if 'chunk' in event:
-                data = event['chunk']['bytes']
-                agent_answer = data.decode('utf8')
+                # With streamFinalResponse the answer arrives in several chunks
+                turn_trace.chunk()
+                answer_chunks.append(event['chunk']['bytes'].decode('utf8'))
+                if on_chunk:
+                    on_chunk("".join(answer_chunks))
             elif 'trace' in event:
-                print(f"orchestration trace = {event['trace']['trace']['orchestrationTrace']}")
-                if 'observation' in event['trace']['trace']['orchestrationTrace']:
-                    if event['trace']['trace']['orchestrationTrace']['observation']['type'] == "ASK_USER":
+                turn_trace.observe(event['trace'])
+                orchestration_trace = event['trace']['trace'].get('orchestrationTrace')
+                if orchestration_trace is None:
+                    continue
+                if 'observation' in orchestration_trace:
+                    if orchestration_trace['observation']['type'] == "ASK_USER":
                         ask_user = True
                     else:
                         ask_user = False
@@ -151,7 +285,8 @@ def read_agent_response(event_stream):
                 raise ValueError(f"Unexpected event: {event}")
     except Exception as e:
         raise ValueError(f"Unexpected Error:: {str(e)}")
-    return ask_user, agent_answer
+    turn_trace.finish()
+    return ask_user, "".join(answer_chunks)
 
 
 def prompts_to_messages(prompts):
@@ -187,7 +322,7 @@ def convert_xml_to_html(xml_string):
 # Retrieve feedback
 @st.fragment
 def collect_feedback(uuid, response, use_case, bedrock_model_name):
-    FEEDBACK_TABLE_NAME = retrieve_environment_variables("FEEDBACK_TABLE_NAME")
+    FEEDBACK_TABLE_NAME = get_config().feedback_table_name
     selected = st.feedback("thumbs", key=f"s-{uuid}")
     if selected is not None:
         print("about to write to dynamo")
@@ -211,28 +346,27 @@ def collect_feedback(uuid, response, use_case, bedrock_model_name):
                 'bedrock_model': bedrock_model_name,
                 'use_case': use_case
             }
-            feedback_table = dynamodb_resource.Table(FEEDBACK_TABLE_NAME)
             print(f"About to write item to dynamodb: {item}")
-            feedback_table.put_item(Item=item)
+            with borrow_resource("dynamodb") as dynamodb:
+                dynamodb.Table(FEEDBACK_TABLE_NAME).put_item(Item=item)
             print(f"updated item in DynamoDB table: {FEEDBACK_TABLE_NAME}")
             sentiment_mapping = [":material/thumb_down:", ":material/thumb_up:"]
             st.markdown(f"Feedback rating: {sentiment_mapping[selected]}. Feedback text: {text}")
 
 
 def retrieve_environment_variables(key):
-    ssm_parameter = json.loads(os.getenv("AWS_RESOURCE_NAMES_PARAMETER"))
-    return ssm_parameter[key]
+    # The parameter is parsed and validated once per process, see app_config
+    return get_config().parameters[key]
 
 
 def retrieve_cognito_details(key):
-    response = secrets_client.get_secret_value(SecretId=retrieve_environment_variables("COGNITO_SECRET_ID"))
-    cognito_details = json.loads(response['SecretString'])
+    cognito_details = get_secret(retrieve_environment_variables("COGNITO_SECRET_ID"))
     return cognito_details[key]
 
 
 # Store conversation details in DynamoDB
 def save_conversation(conversation_id, prompt, response):
-    CONVERSATION_TABLE_NAME = retrieve_environment_variables("CONVERSATION_TABLE_NAME")
+    CONVERSATION_TABLE_NAME = get_config().conversation_table_name
     item = {
         'conversation_id': conversation_id,
         'uuid': str(uuid.uuid4()),
@@ -240,48 +374,145 @@ def save_conversation(conversation_id, prompt, response):
         'assistant_response': response,
         'conversation_time': datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
     }
-    dynamodb_resource.Table(CONVERSATION_TABLE_NAME).put_item(Item=item)
+    with borrow_resource("dynamodb") as dynamodb:
+        dynamodb.Table(CONVERSATION_TABLE_NAME).put_item(Item=item)
+
+
+def authenticated_identity():
+    """
+    Name and email of the Cognito user signed in at the CloudFront edge.
+
+    The viewer request function in lib/edge-lambda only forwards requests with a valid Cognito id token, and the
+    cookies it sets reach the app, so the claims of the id token are read without verifying it again.
+
+    Returns:
+        dict with "name" and "email", both None when the app runs without the edge authentication (local runs)
+    """
+    identity = {"name": None, "email": None}
+    cookies = st.context.cookies
+    last_user_cookie = next((name for name in cookies.keys()
+                             if name.startswith(COGNITO_COOKIE_PREFIX) and name.endswith(".LastAuthUser")), None)
+    if last_user_cookie is None:
+        return identity
+    user = cookies[last_user_cookie]
+    id_token = cookies.get(f"{last_user_cookie[:-len('.LastAuthUser')]}.{user}.idToken")
+    if not id_token:
+        return identity
+    try:
+        payload = id_token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError) as e:
+        print(f"Could not read the Cognito id token: {e}")
+        return identity
+    return {"name": claims.get("name") or claims.get("cognito:username") or user, "email": claims.get("email")}
 
 
 # Store conversation details in DynamoDB
 def save_session(conversation_id, name, email):
-    SESSION_TABLE_NAME = retrieve_environment_variables("SESSION_TABLE_NAME")
+    SESSION_TABLE_NAME = get_config().session_table_name
     item = {
         'conversation_id': conversation_id,
         'user_name': name,
         'user_email': email,
-        'aws_midway_user_name': st.session_state.midway_user,
+        'aws_midway_user_name': st.session_state.get('midway_user'),
         'session_start_time': datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
     }
-    dynamodb_resource.Table(SESSION_TABLE_NAME).put_item(Item=item)
+    with borrow_resource("dynamodb") as dynamodb:
+        dynamodb.Table(SESSION_TABLE_NAME).put_item(Item=item)
 
 
 # Store conversation details in DynamoDB
 def update_session(conversation_id, presigned_url):
-    SESSION_TABLE_NAME = retrieve_environment_variables("SESSION_TABLE_NAME")
-    response = dynamodb_resource.Table(SESSION_TABLE_NAME).update_item(
-        Key={
-            'conversation_id': conversation_id
-        },
-        UpdateExpression='SET presigned_url = :url, session_update_time = :update_time',
-        ExpressionAttributeValues={
-            ':url': presigned_url,
-            ':update_time': datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
-        },
-        ReturnValues="UPDATED_NEW"
-    )
+    SESSION_TABLE_NAME = get_config().session_table_name
+    with borrow_resource("dynamodb") as dynamodb:
+        response = dynamodb.Table(SESSION_TABLE_NAME).update_item(
+            Key={
+                'conversation_id': conversation_id
+            },
+            UpdateExpression='SET presigned_url = :url, session_update_time = :update_time',
+            ExpressionAttributeValues={
+                ':url': presigned_url,
+                ':update_time': datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+            },
+            ReturnValues="UPDATED_NEW"
+        )
 
     return response
 
 
 # Store content in S3
 def store_in_s3(content, content_type):
-    S3_BUCKET_NAME = retrieve_environment_variables("S3_BUCKET_NAME")
+    S3_BUCKET_NAME = get_config().s3_bucket_name
     print(f"Bucket Name: {S3_BUCKET_NAME}")
     current_datetime = datetime.datetime.now(tz=datetime.timezone.utc)
     current_datetime = current_datetime.strftime("%Y%m%d-%H%M%S")
     object_name = f"{st.session_state['conversation_id']}/{content_type}-{current_datetime}.md"
-    s3_client.put_object(Body=content, Bucket=S3_BUCKET_NAME, Key=object_name)
+    get_client("s3").put_object(Body=content, Bucket=S3_BUCKET_NAME, Key=object_name)
+
+
+class S3StreamWriter:
+    """
+    Write-only file object that streams its content to S3 as a multipart upload,
+    so artifacts such as zip archives never have to be held in memory or on disk as a whole.
+    """
+    PART_SIZE = 8 * 1024 * 1024  # S3 requires at least 5 MiB for every part except the last one
+
+    def __init__(self, bucket, key, content_type="application/octet-stream"):
+        self.bucket = bucket
+        self.key = key
+        self._buffer = bytearray()
+        self._parts = []
+        self._upload_id = get_client("s3").create_multipart_upload(
+            Bucket=bucket, Key=key, ContentType=content_type)["UploadId"]
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.PART_SIZE:
+            self._upload_part(bytes(self._buffer[:self.PART_SIZE]))
+            del self._buffer[:self.PART_SIZE]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self, body):
+        part_number = len(self._parts) + 1
+        response = get_client("s3").upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=part_number, Body=body)
+        self._parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    def close(self):
+        if self._upload_id is None:
+            return
+        if self._buffer or not self._parts:
+            self._upload_part(bytes(self._buffer))
+            self._buffer.clear()
+        get_client("s3").complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, MultipartUpload={"Parts": self._parts})
+        self._upload_id = None
+
+    def abort(self):
+        if self._upload_id is not None:
+            get_client("s3").abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            self._upload_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def create_presigned_download_url(object_name, expiration=3600):
+    S3_BUCKET_NAME = get_config().s3_bucket_name
+    return get_client("s3").generate_presigned_url(
+        "get_object", Params={"Bucket": S3_BUCKET_NAME, "Key": object_name}, ExpiresIn=expiration)
 
 
 # Zip files in S3 pertaining to conversation
@@ -290,18 +521,19 @@ def create_artifacts_zip(object_name):
     tmpdir = tempfile.mkdtemp()
     # saved_umask = os.umask(0o077)
 
-    S3_BUCKET_NAME = retrieve_environment_variables("S3_BUCKET_NAME")
+    S3_BUCKET_NAME = get_config().s3_bucket_name
     conversation_id = st.session_state['conversation_id']
     # create directory locally to store s3 artifacts
     Path(f"{tmpdir}/{conversation_id}").mkdir(parents=True, exist_ok=True)
     print(f"Created directory: {tmpdir}/{conversation_id}")
 
     # download objects from S3 pertaining to the current conversation
-    bucket = s3_resource.Bucket(S3_BUCKET_NAME)
-    conversation_artifacts = list(bucket.objects.filter(Prefix=conversation_id))
-    for artifact in conversation_artifacts:
-        out_name = f"{tmpdir}/{conversation_id}/{artifact.key.split('/')[-1]}"
-        bucket.download_file(artifact.key, out_name)
+    with borrow_resource("s3") as s3:
+        bucket = s3.Bucket(S3_BUCKET_NAME)
+        conversation_artifacts = list(bucket.objects.filter(Prefix=conversation_id))
+        for artifact in conversation_artifacts:
+            out_name = f"{tmpdir}/{conversation_id}/{artifact.key.split('/')[-1]}"
+            bucket.download_file(artifact.key, out_name)
     print(f"Downloaded artifacts from S3 for conversation: {conversation_id}")
 
     # Create zip file with all transcript artifacts
@@ -317,7 +549,7 @@ def create_artifacts_zip(object_name):
     # Store the zip file in S3
     file_path = f"{conversation_id}/{object_name}"
     print(f"Uploading {file_path} to S3 bucket: {S3_BUCKET_NAME}")
-    s3_client.upload_file(f"{tmpdir}/{file_path}", S3_BUCKET_NAME, file_path)
+    get_client("s3").upload_file(f"{tmpdir}/{file_path}", S3_BUCKET_NAME, file_path)
     return tmpdir, file_path
 
 # Enable option to download conversation history
@@ -336,14 +568,14 @@ def enable_artifacts_download():
             tmp_transcript = ["# Transcript"]
             for interaction in st.session_state.interaction:
                 tmp_transcript.append(f"## {interaction['type']}")
-                tmp_transcript.append(f"{interaction['details']}")
+                tmp_transcript.append(f"{load_artifact(interaction['details'])}")
             
             transcript = '\n\n'.join(str(x) for x in tmp_transcript)
             
             # Upload transcript to S3
-            S3_BUCKET_NAME = retrieve_environment_variables('S3_BUCKET_NAME')
+            S3_BUCKET_NAME = get_config().s3_bucket_name
             transcript_object_name = f"{st.session_state['conversation_id']}/transcript.md"
-            s3_client.put_object(Body=transcript, Bucket=S3_BUCKET_NAME, Key=transcript_object_name)
+            get_client("s3").put_object(Body=transcript, Bucket=S3_BUCKET_NAME, Key=transcript_object_name)
             
             # Create a zip file with all artifacts
             download_transcript_zip_file = "conversation_artifacts.zip"
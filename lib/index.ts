@@ -13,6 +13,8 @@ import * as dynamodb from "aws-cdk-lib/aws-dynamodb";
 import * as s3 from "aws-cdk-lib/aws-s3";
 import * as logs from "aws-cdk-lib/aws-logs";
 import * as lambda from "aws-cdk-lib/aws-lambda";
+import * as events from "aws-cdk-lib/aws-events";
+import * as targets from "aws-cdk-lib/aws-events-targets";
 import * as customresource from "aws-cdk-lib/custom-resources";
 import * as secretsmanager from "aws-cdk-lib/aws-secretsmanager";
 import * as cloudfront from "aws-cdk-lib/aws-cloudfront";
@@ -35,7 +37,16 @@ export class DevGeniusStack extends cdk.Stack {
         "https://aws.amazon.com/about-aws/whats-new/2024/",
         "https://aws.amazon.com/blogs/architecture/category/analytics/",
     ]
+    // Pages per minute per crawled host, and "HOST_ONLY" or "SUBDOMAINS" ("" keeps the host and path of the seed URL)
+    private readonly BEDROCK_KNOWLEDGE_BASE_CRAWL_RATE_LIMIT = 300
+    private readonly BEDROCK_KNOWLEDGE_BASE_CRAWL_SCOPE = ""
+    // Minutes between two checks of the ingestion queue of the web data sources (lib/lambda/kb_ds.py)
+    private readonly BEDROCK_KB_INGESTION_QUEUE_MINUTES = 10
+    // Alias of the versioned vector index created by lib/lambda/oss_index.py
     private readonly BEDROCK_KB_INDEX_NAME = "devgenius"
+    private readonly BEDROCK_KB_INDEX_PROFILE = "recall"
+    // Must match KNOWLEDGE_BASE_UPLOADS_PREFIX in chatbot/upload.py
+    private readonly BEDROCK_KB_UPLOADS_PREFIX = "knowledge-base-uploads/"
     private readonly BEDROCK_AGENT_FOUNDATION_MODEL = "us.anthropic.claude-3-5-sonnet-20241022-v2:0"
     private readonly BEDROCK_AGENT_INSTRUCTION = `
         You are an AWS Data Analytics and DevOps Expert who will provide thorough,detailed, complete, ready to deploy end to end implementation AWS solutions.
@@ -137,7 +148,7 @@ export class DevGeniusStack extends cdk.Stack {
                         new iam.PolicyStatement({
                             sid: "BedrockDataSource",
                             effect: iam.Effect.ALLOW,
-                            actions: ["bedrock:CreateDataSource", "bedrock:StartIngestionJob", "bedrock:ListDataSources", "bedrock:DeleteDataSource", "bedrock:DeleteKnowledgeBase"],
+                            actions: ["bedrock:CreateDataSource", "bedrock:GetDataSource", "bedrock:UpdateDataSource", "bedrock:StartIngestionJob", "bedrock:GetIngestionJob", "bedrock:ListIngestionJobs", "bedrock:ListDataSources", "bedrock:DeleteDataSource", "bedrock:DeleteKnowledgeBase"],
                             resources: ["*"]
                         }),
                         new iam.PolicyStatement({
@@ -399,7 +410,15 @@ export class DevGeniusStack extends cdk.Stack {
         })
 
         // create custom resource using lambda function
-        const ossIndexCreateCustomResource = new cdk.CustomResource(this, 'OSSIndexCustomResource', { serviceToken: ossIndexLambdaFunction.functionArn });
+        const ossIndexCreateCustomResource = new cdk.CustomResource(this, 'OSSIndexCustomResource', {
+            serviceToken: ossIndexLambdaFunction.functionArn,
+            properties: {
+                // HNSW profile of the vector index, see lib/lambda/index_profiles.py
+                IndexProfile: this.BEDROCK_KB_INDEX_PROFILE,
+                // Bump to rebuild the index behind the alias with an unchanged profile
+                IndexRevision: "1",
+            },
+        });
 
         // Suppress CDK-Nag for Resources:*
         cdk_nag.NagSuppressions.addResourceSuppressions(ossIndexLambdaCustomResource, [
@@ -450,7 +469,6 @@ export class DevGeniusStack extends cdk.Stack {
             environment: {
                 DATASOURCE_NAME: `${cdk.Stack.of(this).stackName}-data-source`,
                 KNOWLEDGE_BASE_ID: bedrockKnowledgeBase.attrKnowledgeBaseId,
-                DATA_SOURCES: this.BEDROCK_KNOWLEDGE_BASE_SOURCES.toString()
             },
             logGroup: new logs.LogGroup(this, "KBDataSourceLambdaLogGroup", {
                 logGroupName: `/aws/lambda/${cdk.Stack.of(this).stackName}-custom-resource-kb-datasource-lambda`,
@@ -478,7 +496,42 @@ export class DevGeniusStack extends cdk.Stack {
         })
 
         // create custom resource using lambda function
-        new cdk.CustomResource(this, 'KBDataSourceCustomResource', { serviceToken: kbDataSourceLambdaFunction.functionArn });
+        // Every seed URL gets its own web data source up to the data source quota, the rest share one per crawl
+        // settings: changing the list only updates, creates or deletes the data sources that changed
+        new cdk.CustomResource(this, 'KBDataSourceCustomResource', {
+            serviceToken: kbDataSourceLambdaFunction.functionArn,
+            properties: {
+                DataSources: this.BEDROCK_KNOWLEDGE_BASE_SOURCES.map(url => ({
+                    Url: url,
+                    RateLimit: this.BEDROCK_KNOWLEDGE_BASE_CRAWL_RATE_LIMIT,
+                    Scope: this.BEDROCK_KNOWLEDGE_BASE_CRAWL_SCOPE,
+                })),
+            },
+        });
+
+        // The knowledge base runs one ingestion job at a time: the data sources waiting for a crawl after a sync
+        // are started one after another by the same function on this schedule
+        new events.Rule(this, "KBDataSourceIngestionSchedule", {
+            description: "Start the next queued ingestion job of the Knowledge Base web data sources",
+            schedule: events.Schedule.rate(cdk.Duration.minutes(this.BEDROCK_KB_INGESTION_QUEUE_MINUTES)),
+            targets: [new targets.LambdaFunction(kbDataSourceLambdaFunction)],
+        })
+
+        // S3 data source for the documents uploaded from the application
+        bucket.grantRead(bedrockIamRole, `${this.BEDROCK_KB_UPLOADS_PREFIX}*`)
+        const uploadsDataSource = new bedrock.CfnDataSource(this, "UploadsDataSource", {
+            name: `${cdk.Stack.of(this).stackName}-uploads-data-source`,
+            description: "Documents uploaded from the DevGenius application",
+            knowledgeBaseId: bedrockKnowledgeBase.attrKnowledgeBaseId,
+            dataDeletionPolicy: "DELETE",
+            dataSourceConfiguration: {
+                type: "S3",
+                s3Configuration: {
+                    bucketArn: bucket.bucketArn,
+                    inclusionPrefixes: [this.BEDROCK_KB_UPLOADS_PREFIX],
+                },
+            },
+        })
 
         // Suppress CDK-Nag for Resources:*
         cdk_nag.NagSuppressions.addResourceSuppressions(kbDataSourceLambdaCustomResource, [
@@ -576,6 +629,19 @@ export class DevGeniusStack extends cdk.Stack {
             billing: dynamodb.Billing.onDemand()
         })
 
+        // Compressed snapshots of the conversation state so a session can resume on any Fargate task
+        const sessionStateTable = new dynamodb.TableV2(this, "SessionStateTable", {
+            partitionKey: {
+                name: "session_id",
+                type: dynamodb.AttributeType.STRING
+            },
+            timeToLiveAttribute: "expires_at",
+            encryption: dynamodb.TableEncryptionV2.dynamoOwnedKey(),
+            tableName: `${cdk.Stack.of(this).stackName}-session-state-table`,
+            removalPolicy: cdk.RemovalPolicy.DESTROY,
+            billing: dynamodb.Billing.onDemand()
+        })
+
         // Create VPC for hosting Streamlit application in ECS
         const vpc = new ec2.Vpc(this, "Vpc", {
             maxAzs: 2,
@@ -649,6 +715,7 @@ export class DevGeniusStack extends cdk.Stack {
                             ],
                             resources: [
                                 `${sessionTable.tableArn}*`,
+                                `${sessionStateTable.tableArn}*`,
                                 `${feedbackTable.tableArn}*`,
                                 `${conversationTable.tableArn}*`,
                             ]
@@ -659,6 +726,12 @@ export class DevGeniusStack extends cdk.Stack {
                             actions: ["bedrock:InvokeModel", "bedrock:InvokeAgent", "bedrock:InvokeModelWithResponseStream"],
                             resources: ["*"]
                         }),
+                        new iam.PolicyStatement({
+                            sid: "BedrockIngestionPermissions",
+                            effect: iam.Effect.ALLOW,
+                            actions: ["bedrock:StartIngestionJob", "bedrock:GetIngestionJob", "bedrock:ListIngestionJobs", "bedrock:ListDataSources", "bedrock:Retrieve"],
+                            resources: [bedrockKnowledgeBase.attrKnowledgeBaseArn]
+                        }),
                         new iam.PolicyStatement({
                             sid: "ECRImage",
                             effect: iam.Effect.ALLOW,
@@ -859,11 +932,14 @@ export class DevGeniusStack extends cdk.Stack {
         const ssmParameter = new ssm.StringParameter(this, "ApplicationParameters", {
             stringValue: JSON.stringify({
                 "SESSION_TABLE_NAME": sessionTable.tableName,
+                "SESSION_STATE_TABLE_NAME": sessionStateTable.tableName,
                 "FEEDBACK_TABLE_NAME": feedbackTable.tableName,
                 "CONVERSATION_TABLE_NAME": conversationTable.tableName,
                 "BEDROCK_AGENT_ID": bedrockAgent.attrAgentId,
                 "BEDROCK_AGENT_ALIAS_ID": bedrockAgentAlias.attrAgentAliasId,
                 "S3_BUCKET_NAME": bucket.bucketName,
+                "KNOWLEDGE_BASE_ID": bedrockKnowledgeBase.attrKnowledgeBaseId,
+                "KNOWLEDGE_BASE_DATA_SOURCE_ID": uploadsDataSource.attrDataSourceId,
                 "FRONTEND_URL": this.Distribution.distributionDomainName
             }),
             tier: ssm.ParameterTier.STANDARD,
@@ -887,6 +963,10 @@ export class DevGeniusStack extends cdk.Stack {
                 secrets: {
                     "AWS_RESOURCE_NAMES_PARAMETER": ecs.Secret.fromSsmParameter(ssmParameter),
                 },
+                environment: {
+                    // Large session artifacts are written through to S3 so any task can serve a resumed session
+                    "ARTIFACT_SPILL": "s3",
+                },
                 taskRole: ecsTaskIamRole,
                 executionRole: ecsTaskIamRole,
             },
@@ -907,7 +987,7 @@ export class DevGeniusStack extends cdk.Stack {
         ], true)
 
         // Autoscaling task
-        const scaling = fargate.service.autoScaleTaskCount({ maxCapacity: 3 })
+        const scaling = fargate.service.autoScaleTaskCount({ maxCapacity: 10 })
         scaling.scaleOnCpuUtilization('Scaling', {
             targetUtilizationPercent: 50,
             scaleInCooldown: cdk.Duration.seconds(60),
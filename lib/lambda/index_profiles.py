@@ -0,0 +1,71 @@
+# Titan Text Embeddings v2 at the dimension configured on the Knowledge Base in lib/index.ts
+VECTOR_DIMENSION = 1024
+DEFAULT_PROFILE = "recall"
+
+# HNSW parameters of the Knowledge Base vector index, from fastest to most accurate. "recall" is the
+# configuration the index was originally created with. Measure them on a sample of the corpus with
+# benchmark_index_profiles.py at the root of the repository before switching.
+INDEX_PROFILES = {
+    # Smallest graph and search queue: lowest query latency and build time, lowest recall
+    "latency": {"m": 8, "ef_construction": 128, "ef_search": 64},
+    "balanced": {"m": 16, "ef_construction": 256, "ef_search": 128},
+    "recall": {"m": 16, "ef_construction": 512, "ef_search": 512},
+    # Vectors stored as fp16 by the faiss scalar quantizer: about half the memory of float32 vectors with
+    # nearly the same recall. The Knowledge Base still writes and queries float32 vectors.
+    "memory-saving": {"m": 16, "ef_construction": 256, "ef_search": 256, "encoder": "fp16"},
+}
+
+
+def index_body(profile=DEFAULT_PROFILE, dimension=VECTOR_DIMENSION):
+    """
+    Settings and mappings of the Knowledge Base vector index for an HNSW profile.
+
+    Args:
+        profile (str): Name of a profile in INDEX_PROFILES
+        dimension (int): Dimension of the embedding vectors
+
+    Returns:
+        dict: Body of the OpenSearch create index request
+
+    Raises:
+        ValueError: If the profile does not exist
+    """
+    if profile not in INDEX_PROFILES:
+        raise ValueError(f"Unknown index profile '{profile}', expected one of {', '.join(INDEX_PROFILES)}")
+    parameters = INDEX_PROFILES[profile]
+
+    method = {
+        "name": "hnsw",
+        "engine": "faiss",
+        "space_type": "l2",
+        "parameters": {
+            "ef_construction": parameters["ef_construction"],
+            "m": parameters["m"]
+        },
+    }
+    if parameters.get("encoder"):
+        method["parameters"]["encoder"] = {"name": "sq", "parameters": {"type": parameters["encoder"]}}
+
+    return {
+        "settings": {
+            "index.knn": "true",
+            "number_of_shards": 1,
+            "knn.algo_param.ef_search": parameters["ef_search"],
+            "number_of_replicas": 0,
+        },
+        "mappings": {
+            "properties": {
+                "vector": {
+                    "type": "knn_vector",
+                    "dimension": dimension,
+                    "method": method,
+                },
+                "text": {
+                    "type": "text"
+                },
+                "text-metadata": {
+                    "type": "text"
+                }
+            }
+        }
+    }
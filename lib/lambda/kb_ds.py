@@ -1,73 +1,324 @@
+import hashlib
 import json
 import os
+import time
 import boto3
+from botocore.exceptions import ClientError
 from crhelper import CfnResource
 
 REGION = os.getenv("AWS_REGION")
-DATA_SOURCES = os.getenv("DATA_SOURCES")
+KNOWLEDGE_BASE_ID = os.getenv("KNOWLEDGE_BASE_ID")
+DATASOURCE_NAME = os.getenv("DATASOURCE_NAME")
 service = "aoss"
+DEFAULT_RATE_LIMIT = 300
+# Seed URLs of a Bedrock web data source
+MAX_SEED_URLS = 100
+# Data sources of a knowledge base (default service quota), one of them used by the uploads data source
+DATA_SOURCE_QUOTA = 5
+WEB_DATA_SOURCE_QUOTA = DATA_SOURCE_QUOTA - 1
+# Ingestion jobs are followed for at most this long after they start, to log their first statistics; crawls
+# take much longer than the Lambda timeout and keep running afterwards
+INGESTION_STATS_WAIT = 60
+INGESTION_POLL_INTERVAL = 10
+FINISHED_JOB_STATUSES = {"COMPLETE", "FAILED", "STOPPED"}
 
 boto3_session = boto3.session.Session()
 bedrock_agent_client = boto3_session.client('bedrock-agent', region_name=REGION)
 helper = CfnResource(json_logging=False, log_level="DEBUG", boto_level="CRITICAL")
 
 
-@helper.create
-def create(event, context):
-    # Create datasource
-    seedUrls = []
-    for data_source in DATA_SOURCES.split(","):
-        seedUrls.append({"url": data_source})
-    create_ds_response = bedrock_agent_client.create_data_source(
-        name=os.getenv("DATASOURCE_NAME"),
-        dataDeletionPolicy='RETAIN',
-        description="Data source for Bedrock Knowledge Base",
-        knowledgeBaseId=os.getenv("KNOWLEDGE_BASE_ID"),
-        dataSourceConfiguration={
-            "type": "WEB",
-            "webConfiguration": {
-                "crawlerConfiguration": {
-                    "crawlerLimits": {
-                        "rateLimit": 300
-                    }
-                },
-                "sourceConfiguration": {
-                    "urlConfiguration": {
-                        "seedUrls": seedUrls
-                    }
+def crawler_configuration(source):
+    """
+    Crawler configuration of an entry of the DataSources property of the custom resource.
+
+    Args:
+        source (dict): Url and optionally RateLimit (pages per minute per host), Scope ("HOST_ONLY" or
+            "SUBDOMAINS", by default the host and path of the seed URL), InclusionFilters and ExclusionFilters
+            (regular expressions on the URLs)
+    """
+    crawler = {"crawlerLimits": {"rateLimit": int(source.get("RateLimit", DEFAULT_RATE_LIMIT))}}
+    if source.get("Scope"):
+        crawler["scope"] = source["Scope"]
+    if source.get("InclusionFilters"):
+        crawler["inclusionFilters"] = sorted(source["InclusionFilters"])
+    if source.get("ExclusionFilters"):
+        crawler["exclusionFilters"] = sorted(source["ExclusionFilters"])
+    return crawler
+
+
+def web_configuration(crawler, urls):
+    return {
+        "type": "WEB",
+        "webConfiguration": {
+            "crawlerConfiguration": crawler,
+            "sourceConfiguration": {
+                "urlConfiguration": {
+                    "seedUrls": [{"url": url} for url in urls]
                 }
             }
-        },
-        vectorIngestionConfiguration={}
+        }
+    }
+
+
+def grouped_data_sources(entries):
+    # Overflow seed URLs: grouped by crawl settings into data sources of at most MAX_SEED_URLS seed URLs
+    groups = {}
+    for url, crawler in entries:
+        settings = json.dumps(crawler, sort_keys=True)
+        groups.setdefault(settings, (crawler, set()))[1].add(url)
+
+    grouped = {}
+    for settings, (crawler, urls) in groups.items():
+        digest = hashlib.sha256(settings.encode("utf-8")).hexdigest()[:8]
+        urls = sorted(urls)
+        for part, first in enumerate(range(0, len(urls), MAX_SEED_URLS), start=1):
+            grouped[f"{DATASOURCE_NAME}-{digest}-{part}"] = web_configuration(crawler, urls[first:first + MAX_SEED_URLS])
+    return grouped
+
+
+def desired_data_sources(sources):
+    """
+    Web data sources for the seed URLs, one per URL within the free data source quota of the knowledge base.
+
+    A seed URL with its own data source is crawled again only when it changes. Past WEB_DATA_SOURCE_QUOTA, the
+    first URLs of the DataSources property keep a data source each and the rest are grouped by crawl settings,
+    so URLs appended to the list never move the earlier ones. The name of a data source is derived from its
+    URL, or from its crawl settings for a group, so the stack finds it again on updates.
+
+    Returns:
+        dict: data source name -> data source configuration
+    """
+    entries = {}
+    for source in sources:
+        entries.setdefault(source["Url"], crawler_configuration(source))
+    entries = list(entries.items())
+
+    # As many URLs as possible keep their own data source, leaving room for the groups of the remaining ones
+    own = min(len(entries), WEB_DATA_SOURCE_QUOTA)
+    grouped = grouped_data_sources(entries[own:])
+    while own > 0 and own + len(grouped) > WEB_DATA_SOURCE_QUOTA:
+        own -= 1
+        grouped = grouped_data_sources(entries[own:])
+    if own + len(grouped) > WEB_DATA_SOURCE_QUOTA:
+        print(f"{len(grouped)} crawl settings groups exceed the quota of {WEB_DATA_SOURCE_QUOTA} web data sources")
+
+    desired = {}
+    for url, crawler in entries[:own]:
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:8]
+        desired[f"{DATASOURCE_NAME}-{digest}"] = web_configuration(crawler, [url])
+    desired.update(grouped)
+    return desired
+
+
+def crawl_settings(configuration):
+    # The parts of a web data source configuration that change what is crawled, ignoring service defaults
+    web = configuration.get("webConfiguration", {})
+    crawler = web.get("crawlerConfiguration", {})
+    seeds = web.get("sourceConfiguration", {}).get("urlConfiguration", {}).get("seedUrls", [])
+    return (
+        sorted(seed["url"] for seed in seeds),
+        crawler.get("crawlerLimits", {}).get("rateLimit"),
+        crawler.get("scope"),
+        sorted(crawler.get("inclusionFilters", [])),
+        sorted(crawler.get("exclusionFilters", [])),
     )
-    ds = create_ds_response["dataSource"]
-    print(f"Datasource response: {ds}")
-
-    # Start an ingestion job
-    start_job_response = bedrock_agent_client.start_ingestion_job(
-        knowledgeBaseId=os.getenv("KNOWLEDGE_BASE_ID"),
-        dataSourceId=ds["dataSourceId"])
-    job = start_job_response["ingestionJob"]
-    print(f"Ingestion job: {job}")
+
+
+def managed_data_sources():
+    """Web data sources created by this custom resource, by name, reading every page of list_data_sources."""
+    data_sources = {}
+    paginator = bedrock_agent_client.get_paginator("list_data_sources")
+    for page in paginator.paginate(knowledgeBaseId=KNOWLEDGE_BASE_ID):
+        for summary in page["dataSourceSummaries"]:
+            # The single data source of earlier versions is named DATASOURCE_NAME
+            if summary["name"] != DATASOURCE_NAME and not summary["name"].startswith(f"{DATASOURCE_NAME}-"):
+                continue
+            data_sources[summary["name"]] = bedrock_agent_client.get_data_source(
+                knowledgeBaseId=KNOWLEDGE_BASE_ID, dataSourceId=summary["dataSourceId"])["dataSource"]
+    return data_sources
+
+
+def latest_ingestion_job(data_source_id):
+    jobs = bedrock_agent_client.list_ingestion_jobs(
+        knowledgeBaseId=KNOWLEDGE_BASE_ID, dataSourceId=data_source_id,
+        sortBy={"attribute": "STARTED_AT", "order": "DESCENDING"}, maxResults=1)["ingestionJobSummaries"]
+    return jobs[0] if jobs else None
+
+
+def start_next_ingestion(data_sources):
+    """
+    Start the ingestion job of the next data source waiting for one.
+
+    A knowledge base runs one ingestion job at a time, so the data sources are crawled one after another. A data
+    source waits for ingestion until a job has started after its last update: the queue is read from Bedrock
+    and nothing is lost between invocations. Nothing is started while a job of a data source is running, and
+    a ConflictException (a job of the uploads data source) leaves the data source waiting for the next call.
+    Called after every sync and on the schedule of lib/index.ts.
+
+    Args:
+        data_sources (dict): name -> data source, as returned by get_data_source
+
+    Returns:
+        dict: data source id -> ingestion job id of the started job, empty if none was started
+    """
+    waiting = []
+    for name, data_source in sorted(data_sources.items()):
+        job = latest_ingestion_job(data_source["dataSourceId"])
+        if job is not None and job["status"] not in FINISHED_JOB_STATUSES:
+            print(f"Ingestion job {job['ingestionJobId']} of data source {name} is {job['status']}, "
+                  f"{len(data_sources)} data source(s) wait for it")
+            return {}
+        if job is None or job["startedAt"] < data_source["updatedAt"]:
+            waiting.append(data_source)
+    if not waiting:
+        return {}
+
+    data_source = waiting[0]
+    seeds = crawl_settings(data_source["dataSourceConfiguration"])[0]
+    try:
+        job = bedrock_agent_client.start_ingestion_job(
+            knowledgeBaseId=KNOWLEDGE_BASE_ID, dataSourceId=data_source["dataSourceId"],
+            description=f"Crawl of {len(seeds)} seed URL(s)")["ingestionJob"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConflictException":
+            raise
+        print(f"Another ingestion job is running, {len(waiting)} data source(s) stay queued: {e}")
+        return {}
+    print(f"Started ingestion job {job['ingestionJobId']} for data source {data_source['name']}, "
+          f"{len(waiting) - 1} data source(s) still queued")
+    return {data_source["dataSourceId"]: job["ingestionJobId"]}
+
+
+def report_ingestion(jobs, wait_seconds=INGESTION_STATS_WAIT):
+    """
+    Follow ingestion jobs for up to wait_seconds and log their statistics.
+
+    Args:
+        jobs (dict): data source id -> ingestion job id
+    """
+    deadline = time.monotonic() + wait_seconds
+    pending = dict(jobs)
+    while pending:
+        for data_source_id, job_id in list(pending.items()):
+            job = bedrock_agent_client.get_ingestion_job(
+                knowledgeBaseId=KNOWLEDGE_BASE_ID, dataSourceId=data_source_id, ingestionJobId=job_id)["ingestionJob"]
+            if job["status"] in FINISHED_JOB_STATUSES or time.monotonic() >= deadline:
+                print(f"Ingestion job {job_id} of data source {data_source_id} is {job['status']}: "
+                      f"{json.dumps(job.get('statistics', {}))}")
+                del pending[data_source_id]
+        if pending:
+            time.sleep(INGESTION_POLL_INTERVAL)
+
+
+def sync_data_sources(sources):
+    """
+    Make the web data sources of the Knowledge Base match the desired seed URLs.
+
+    Seed URLs get a data source each, or share one past the quota (see desired_data_sources), and only the
+    differences are applied per data source: a data source is created when it is new, updated when its seed URLs
+    or settings changed, deleted when it is no longer desired and left alone otherwise. Created and updated data sources wait
+    for ingestion, which start_next_ingestion starts one data source at a time, so a refresh crawls only what
+    changed.
+
+    Returns:
+        list: Ids of the data sources of the desired seed URLs
+    """
+    desired = desired_data_sources(sources)
+    existing = managed_data_sources()
+    print(f"{len(desired)} desired data source(s) for {len(sources)} seed URL(s), {len(existing)} existing")
+
+    # Deleted first: the data sources of the knowledge base are limited
+    for name, data_source in existing.items():
+        if name not in desired:
+            if data_source.get("dataDeletionPolicy") != 'DELETE':
+                # Earlier data sources retained their vectors on deletion: they would stay in the index forever
+                bedrock_agent_client.update_data_source(
+                    name=name,
+                    dataDeletionPolicy='DELETE',
+                    knowledgeBaseId=KNOWLEDGE_BASE_ID,
+                    dataSourceId=data_source["dataSourceId"],
+                    dataSourceConfiguration=data_source["dataSourceConfiguration"],
+                )
+            bedrock_agent_client.delete_data_source(
+                knowledgeBaseId=KNOWLEDGE_BASE_ID, dataSourceId=data_source["dataSourceId"])
+            print(f"Deleted data source name: {name} with id: {data_source['dataSourceId']}")
+
+    synced = {}
+    for name, configuration in desired.items():
+        current = existing.get(name)
+        seeds = len(configuration["webConfiguration"]["sourceConfiguration"]["urlConfiguration"]["seedUrls"])
+        if current is None:
+            synced[name] = bedrock_agent_client.create_data_source(
+                name=name,
+                dataDeletionPolicy='DELETE',
+                description=f"Web crawl of {seeds} seed URL(s)",
+                knowledgeBaseId=KNOWLEDGE_BASE_ID,
+                dataSourceConfiguration=configuration,
+                vectorIngestionConfiguration={}
+            )["dataSource"]
+            print(f"Created data source {name} ({synced[name]['dataSourceId']}) with {seeds} seed URL(s)")
+        elif crawl_settings(current["dataSourceConfiguration"]) != crawl_settings(configuration):
+            synced[name] = bedrock_agent_client.update_data_source(
+                name=name,
+                dataDeletionPolicy=current.get("dataDeletionPolicy", 'DELETE'),
+                description=f"Web crawl of {seeds} seed URL(s)",
+                knowledgeBaseId=KNOWLEDGE_BASE_ID,
+                dataSourceId=current["dataSourceId"],
+                dataSourceConfiguration=configuration,
+            )["dataSource"]
+            print(f"Updated seed URLs or crawl settings of data source {name} ({current['dataSourceId']})")
+        else:
+            synced[name] = current
+
+    report_ingestion(start_next_ingestion(synced))
+    return [data_source["dataSourceId"] for data_source in synced.values()]
+
+
+def ingestion_status(data_sources):
+    """Latest ingestion job of every managed data source with its statistics."""
+    status = {}
+    for name, data_source in data_sources.items():
+        job = latest_ingestion_job(data_source["dataSourceId"])
+        seeds = crawl_settings(data_source["dataSourceConfiguration"])[0]
+        status[name] = {"seedUrls": seeds, "dataSourceId": data_source["dataSourceId"],
+                        "status": job["status"] if job else None,
+                        "statistics": job.get("statistics", {}) if job else {}}
+    return status
+
+
+@helper.create
+def create(event, context):
+    data_source_ids = sync_data_sources(event["ResourceProperties"].get("DataSources", []))
+    helper.Data["DataSourceIds"] = ",".join(data_source_ids)
     print("Started sync process. This would take a longer time than Lambda timeout. Ending CFN execution here.")  # noqa
 
 
 @helper.update
 def update(event, context):
-    return None
+    data_source_ids = sync_data_sources(event["ResourceProperties"].get("DataSources", []))
+    helper.Data["DataSourceIds"] = ",".join(data_source_ids)
+    # Same physical id: a new one would make CloudFormation delete the data sources just synced
+    return event["PhysicalResourceId"]
 
 
 @helper.delete
 def delete(event, context):
-    # Delete datasource
-    response = bedrock_agent_client.list_data_sources(knowledgeBaseId=os.getenv("KNOWLEDGE_BASE_ID"))
-    for ds in response["dataSourceSummaries"]:
+    # Delete the web data sources; the uploads data source belongs to the stack
+    for name, data_source in managed_data_sources().items():
         bedrock_agent_client.delete_data_source(
-            knowledgeBaseId=os.getenv("KNOWLEDGE_BASE_ID"), dataSourceId=ds["dataSourceId"])
-        print(f"Deleted data source name: {ds['name']} with id: {ds['dataSourceId']}")
+            knowledgeBaseId=KNOWLEDGE_BASE_ID, dataSourceId=data_source["dataSourceId"])
+        print(f"Deleted data source name: {name} with id: {data_source['dataSourceId']}")
     return None
 
 
 def handler(event, context):
     print(f"event received: {json.dumps(event, default=str)}")
+    if "RequestType" not in event:
+        # Invoked on schedule or directly (not by CloudFormation): start the next queued ingestion and report the
+        # ingestion of every web data source
+        data_sources = managed_data_sources()
+        start_next_ingestion(data_sources)
+        status = ingestion_status(data_sources)
+        print(json.dumps(status, default=str))
+        return status
     helper(event, context)
@@ -1,15 +1,25 @@
-from opensearchpy import OpenSearch, RequestsHttpConnection
-from opensearchpy.exceptions import RequestError, ConnectionError, AuthorizationException
+from opensearchpy import OpenSearch, RequestsHttpConnection, helpers
+from opensearchpy.exceptions import RequestError, ConnectionError, AuthorizationException, TransportError
 from requests_aws4auth import AWS4Auth
+import hashlib
 import time
 import json
 import os
 from crhelper import CfnResource
 from boto3.session import Session
+from index_profiles import DEFAULT_PROFILE, index_body
 
 REGION = os.getenv("AWS_REGION")
 COLLECTION_ENDPOINT = os.getenv("COLLECTION_ENDPOINT").replace("https://", "")
 service = "aoss"
+# Readiness of a new index and of copied documents is polled instead of waiting a fixed time
+READY_POLL_INTERVAL = 5
+READY_TIMEOUT = 300
+COPY_BATCH_SIZE = 500
+COPY_THREADS = 4
+# Documents written to the previous index just before the swap become searchable after the refresh interval of
+# the collection; they are looked for once it has passed
+SWAP_SETTLE_SECONDS = 15
 
 helper = CfnResource(json_logging=False, log_level="DEBUG", boto_level="CRITICAL")
 credentials = Session().get_credentials()
@@ -98,48 +108,202 @@ oss_client = create_opensearch_client(
     auth=awsauth
 )
 
-# OpenSearch Index Configuration
-body_json = {
-    "settings": {
-        "index.knn": "true",
-        "number_of_shards": 1,
-        "knn.algo_param.ef_search": 512,
-        "number_of_replicas": 0,
-    },
-    "mappings": {
-        "properties": {
-            "vector": {
-                "type": "knn_vector",
-                "dimension": 1024,
-                "method": {
-                    "name": "hnsw",
-                    "engine": "faiss",
-                    "space_type": "l2",
-                    "parameters": {
-                        "ef_construction": 512,
-                        "m": 16
-                    },
-                },
-            },
-            "text": {
-                "type": "text"
-            },
-            "text-metadata": {
-                "type": "text"
-            }
-        }
-    }
-}
+
+def versioned_index_name(alias: str, body: dict, revision: str) -> str:
+    """
+    Name of the concrete index behind the alias for an index body.
+
+    The name is derived from the body, so any mapping or HNSW change produces a new index, and from the
+    IndexRevision property, which forces a rebuild with an unchanged body.
+    """
+    digest = hashlib.sha256(f"{revision}\n{json.dumps(body, sort_keys=True)}".encode("utf-8")).hexdigest()[:8]
+    return f"{alias}-{digest}"
+
+
+def alias_targets(alias: str) -> list:
+    """
+    Concrete indexes currently served under the alias name.
+
+    Returns [alias] when the name is still a concrete index created before versioned indexes, and [] when
+    nothing exists under the name.
+    """
+    if oss_client.indices.exists_alias(name=alias):
+        return list(oss_client.indices.get_alias(name=alias))
+    if oss_client.indices.exists(alias):
+        return [alias]
+    return []
+
+
+def wait_until(check, description: str, timeout: int = READY_TIMEOUT):
+    """Poll check() with a growing interval until it returns True, at most timeout seconds."""
+    deadline = time.monotonic() + timeout
+    delay = 1
+    while True:
+        try:
+            if check():
+                return
+        except TransportError as e:
+            # Data access rules and new indexes take a while to propagate in OpenSearch Serverless
+            print(f"Waiting for {description}: {e}")
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"Timed out after {timeout} seconds waiting for {description}")
+        time.sleep(delay)
+        delay = min(delay * 2, READY_POLL_INTERVAL)
+
+
+def create_index(index_name: str, body: dict, profile: str):
+    """
+    Create an index and wait until it serves searches.
+
+    Retries with exponential backoff while the data access policy of the collection is not enforced yet.
+    """
+    attempt = 0
+    max_retries = 3
+    initial_backoff = 3
+    while True:
+        try:
+            print(f"Attempting to create index '{index_name}' with profile '{profile}' (attempt {attempt+1}/{max_retries})")
+            response = oss_client.indices.create(index_name, body=json.dumps(body))
+            print(f"Creating index response: {json.dumps(response, default=str)}")
+            break
+        except (RequestError, ConnectionError, AuthorizationException) as e:
+            print(f"Exception occurred when trying to create index: {str(e)}")
+            if "User does not have permissions for the requested resource" in str(e):
+                print("User permissions error detected. Need to wait for data access rules to be enforced")
+            attempt += 1
+            if attempt >= max_retries:
+                print(f"Max retries ({max_retries}) exceeded. Failed to create index")
+                raise  # Re-raise the last exception
+
+            # Calculate backoff time with exponential increase
+            backoff_time = initial_backoff * (2 ** attempt)
+            print(f"Attempt {attempt + 1} failed. Retrying in {backoff_time} seconds...")
+            time.sleep(backoff_time)
+
+    wait_until(lambda: oss_client.indices.exists(index_name) and
+               oss_client.search(index=index_name, body={"size": 0}) is not None, f"index '{index_name}'")
+
+
+def count_documents(index_name: str) -> int:
+    return oss_client.count(index=index_name)["count"]
+
+
+def _bulk_copy(actions, source: str, target: str) -> int:
+    copied = 0
+    errors = []
+    for ok, item in helpers.parallel_bulk(oss_client, actions, thread_count=COPY_THREADS,
+                                          chunk_size=COPY_BATCH_SIZE, raise_on_error=False):
+        if ok:
+            copied += 1
+        else:
+            errors.append(item)
+    if errors:
+        raise RuntimeError(f"{len(errors)} document(s) could not be copied from '{source}' to '{target}': {errors[:3]}")
+    return copied
+
+
+def copy_documents(source: str, target: str) -> int:
+    """
+    Copy every document, vectors included, from one index to another with parallel bulk requests.
+
+    Documents keep their ids so the Knowledge Base can still update and delete the chunks it wrote. Returns
+    the number of documents copied.
+
+    Raises:
+        RuntimeError: If any document could not be copied
+    """
+    actions = ({"_index": target, "_id": hit["_id"], "_source": hit["_source"]}
+               for hit in helpers.scan(oss_client, index=source, size=COPY_BATCH_SIZE))
+    copied = _bulk_copy(actions, source, target)
+    print(f"Copied {copied} document(s) from '{source}' to '{target}'")
+    return copied
+
+
+def _search_ids(index_name: str, ids: list, with_source: bool) -> list:
+    response = oss_client.search(index=index_name, body={
+        "size": len(ids), "_source": with_source, "query": {"ids": {"values": ids}}})
+    return response["hits"]["hits"]
+
+
+def copy_missing_documents(source: str, target: str) -> int:
+    """
+    Copy the documents of source whose ids are not in target.
+
+    Catches up with the chunks the Knowledge Base wrote to the previous index while copy_documents was reading
+    its snapshot. Returns the number of documents copied.
+    """
+    def actions():
+        ids = []
+        for hit in helpers.scan(oss_client, index=source, size=COPY_BATCH_SIZE, _source=False):
+            ids.append(hit["_id"])
+            if len(ids) == COPY_BATCH_SIZE:
+                yield from missing(ids)
+                ids = []
+        if ids:
+            yield from missing(ids)
+
+    def missing(ids):
+        present = {hit["_id"] for hit in _search_ids(target, ids, with_source=False)}
+        missing_ids = [document_id for document_id in ids if document_id not in present]
+        if not missing_ids:
+            return []
+        return [{"_index": target, "_id": hit["_id"], "_source": hit["_source"]}
+                for hit in _search_ids(source, missing_ids, with_source=True)]
+
+    copied = _bulk_copy(actions(), source, target)
+    print(f"Copied {copied} document(s) written to '{source}' during the rebuild to '{target}'")
+    return copied
+
+
+def swap_alias(alias: str, new_index: str, old_indexes: list):
+    """
+    Point the alias at the new index in one update_aliases call. The old indexes are kept for reconciliation.
+
+    A concrete index still using the alias name (created before versioned indexes) has to be deleted before
+    the alias can take its name; that one-time migration leaves the name unresolved for a moment, and the
+    documents written to it during the copy cannot be recovered.
+    """
+    if old_indexes == [alias]:
+        print(f"Replacing concrete index '{alias}' with an alias to '{new_index}'")
+        oss_client.indices.delete(index=alias)
+        oss_client.indices.put_alias(index=new_index, name=alias)
+    else:
+        actions = [{"remove": {"index": old_index, "alias": alias}} for old_index in old_indexes]
+        actions.append({"add": {"index": new_index, "alias": alias}})
+        oss_client.indices.update_aliases(body={"actions": actions})
+    wait_until(lambda: list(oss_client.indices.get_alias(name=alias)) == [new_index], f"alias '{alias}'")
+
+
+def reconcile_and_delete(alias: str, new_index: str, old_indexes: list, copied: int):
+    """
+    After the swap, copy what the Knowledge Base wrote to the old indexes during the copy, then delete them.
+
+    The copy reads a snapshot of the old indexes: chunks ingested meanwhile are missing from the new index.
+    Once the swap has moved the writes to the new index, the document counts of the old indexes are compared
+    with the number copied and the missing documents are copied before the old indexes are deleted.
+    """
+    old_indexes = [old_index for old_index in old_indexes if old_index != alias]
+    if not old_indexes:
+        return
+    time.sleep(SWAP_SETTLE_SECONDS)
+    total = sum(count_documents(old_index) for old_index in old_indexes)
+    # Deletions during the copy lower the count: any difference means the old indexes changed
+    if total != copied:
+        print(f"{old_indexes} hold {total} document(s), {copied} were copied")
+        for old_index in old_indexes:
+            copy_missing_documents(old_index, new_index)
+    for old_index in old_indexes:
+        print(f"Deleting previous index '{old_index}'")
+        oss_client.indices.delete(index=old_index)
 
 
 @helper.create
 def create(event, context):
     """
-    CloudFormation custom resource handler to create an OpenSearch index.
+    CloudFormation custom resource handler to create the Knowledge Base vector index.
 
-    Creates a new OpenSearch index with vector search capabilities for use with Amazon Bedrock
-    Knowledge Base. Implements retry logic with exponential backoff to handle eventual 
-    consistency of IAM permissions and transient failures.
+    Creates a versioned index with vector search capabilities for use with Amazon Bedrock Knowledge Base and
+    serves it under the BEDROCK_KB_INDEX_NAME alias, which is the name the Knowledge Base is configured with.
 
     Args:
         event (dict): CloudFormation custom resource event containing:
@@ -151,77 +315,92 @@ def create(event, context):
         context (Any): Lambda context object containing runtime information
 
     Returns:
-        Optional[dict]: OpenSearch create index response if successful, None if index already exists
+        str: The alias name, used as physical resource id
 
     Raises:
         RequestError: If index creation fails due to invalid configuration
         ConnectionError: If unable to connect to OpenSearch endpoint
         AuthorizationException: If permissions are insufficient
-        Exception: If index creation fails after maximum retries
+        TimeoutError: If the index does not become searchable in time
 
     Environment Variables Required:
-        BEDROCK_KB_INDEX_NAME (str): Name of the OpenSearch index to create
+        BEDROCK_KB_INDEX_NAME (str): Alias of the OpenSearch index to create
 
     Example CloudFormation Resource:
         MySearchIndex:
           Type: Custom::OpenSearchIndex
           Properties:
             ServiceToken: !GetAtt IndexCreationFunction.Arn
+            IndexProfile: recall  # HNSW profile from index_profiles.INDEX_PROFILES
+            IndexRevision: "1"  # Bump to rebuild the index with an unchanged body
 
     Notes:
-        - Implements retry mechanism with exponential backoff
-        - Maximum 3 retry attempts
-        - Initial backoff of 3 seconds
-        - Checks for existing index before creation
-        - Waits for IAM permission propagation
-        - Logs detailed operation status and errors
+        - Skips creation if something already exists under the alias name
+        - Polls until the index is searchable instead of sleeping a fixed time
         - Uses crhelper for CloudFormation response handling
-
-    AWS Best Practices:
-        - Implements idempotency through index existence check
-        - Handles eventual consistency of IAM permissions
-        - Uses exponential backoff for retries
-        - Provides detailed logging for troubleshooting
-        - Properly handles CloudFormation stack events
     """
-    index_name = os.getenv("BEDROCK_KB_INDEX_NAME")
-    attempt = 0
-    max_retries = 3
-    initial_backoff = 3
-    while attempt < max_retries:
-        try:
-            exists_response = oss_client.indices.exists(index_name)
-            print(f"{index_name} exists status: {exists_response}")
-            if exists_response:
-                print(f"Index '{index_name}' already exists. Skipping creation.")
-                return
-            print(f"Attempting to create index '{index_name}' (attempt {attempt+1}/{max_retries})")
-            response = oss_client.indices.create(index_name, body=json.dumps(body_json))
-            print(f"Creating index response: {json.dumps(response, default=str)}")
-            backoff_time = initial_backoff * 10
-            time.sleep(backoff_time)
-            return response
-        except (RequestError, ConnectionError, AuthorizationException) as e:
-            print(f"Exception occurred when trying to create index: {str(EOFError)}")
-            if "User does not have permissions for the requested resource" in str(e):
-                print("User permissions error detected. Need to wait for data access rules to be enforced")
-            attempt += 1
-            if attempt >= max_retries:
-                print(f"Max retries ({max_retries}) exceeded. Failed to create index")
-                raise  # Re-raise the last exception
+    alias = os.getenv("BEDROCK_KB_INDEX_NAME")
+    properties = event["ResourceProperties"]
+    profile = properties.get("IndexProfile", DEFAULT_PROFILE)
+    body_json = index_body(profile)
+    index_name = versioned_index_name(alias, body_json, properties.get("IndexRevision", ""))
 
-            # Calculate backoff time with exponential increase
-            backoff_time = initial_backoff * (2 ** attempt)
-            print(f"Attempt {attempt + 1} failed. Retrying in {backoff_time} seconds...")
-            time.sleep(backoff_time)
-    else:
-        print("Index creation could not be verified")
-        raise
+    existing = alias_targets(alias)
+    if existing:
+        print(f"Index '{alias}' already exists ({existing}). Skipping creation.")
+        helper.Data["IndexName"] = existing[0]
+        return alias
+
+    create_index(index_name, body_json, profile)
+    oss_client.indices.put_alias(index=index_name, name=alias)
+    wait_until(lambda: oss_client.indices.exists_alias(name=alias), f"alias '{alias}'")
+    helper.Data["IndexName"] = index_name
+    return alias
 
 
 @helper.update
 def update(event, context):
-    return None
+    """
+    Rebuild the index behind the alias when its profile or revision changes, without Knowledge Base downtime.
+
+    The new versioned index is created next to the current one and filled with a parallel bulk copy of its
+    documents. Once every document is searchable in the new index the alias is swapped atomically. The chunks
+    the Knowledge Base wrote to the previous index during the copy are then copied over (see
+    reconcile_and_delete) and the previous index is deleted. Retrieval keeps using the previous index until the
+    swap; if anything fails before it, the stack update rolls back with the previous index untouched.
+
+    Chunks the Knowledge Base updated or deleted in place during the copy keep their copied version; starting
+    an ingestion job of the data sources after the update brings them back in line.
+
+    Returns:
+        str: The alias name, so the physical resource id does not change
+    """
+    alias = os.getenv("BEDROCK_KB_INDEX_NAME")
+    properties = event["ResourceProperties"]
+    profile = properties.get("IndexProfile", DEFAULT_PROFILE)
+    body_json = index_body(profile)
+    index_name = versioned_index_name(alias, body_json, properties.get("IndexRevision", ""))
+
+    existing = alias_targets(alias)
+    if existing == [index_name]:
+        print(f"Index '{index_name}' is already served under '{alias}'. Nothing to do.")
+        helper.Data["IndexName"] = index_name
+        return alias
+
+    started = time.monotonic()
+    if oss_client.indices.exists(index_name):
+        # Left over from an update that failed before the swap
+        oss_client.indices.delete(index=index_name)
+    create_index(index_name, body_json, profile)
+    expected = 0
+    for source in existing:
+        expected += copy_documents(source, index_name)
+    wait_until(lambda: count_documents(index_name) >= expected, f"{expected} document(s) in '{index_name}'")
+    swap_alias(alias, index_name, existing)
+    reconcile_and_delete(alias, index_name, existing, expected)
+    print(f"Swapped '{alias}' to '{index_name}' in {time.monotonic() - started:.0f} seconds")
+    helper.Data["IndexName"] = index_name
+    return alias
 
 
 @helper.delete